@@ -7,6 +7,7 @@ from .example_questions import router as example_questions_router
 from .roles import router as roles_router
 from .settings import router as settings_router
 from .auth import router as auth_router
+from .search import router as search_router
 
 router = APIRouter()
 
@@ -16,3 +17,4 @@ router.include_router(models_router, tags=["models"])
 router.include_router(example_questions_router, tags=["example_questions"])
 router.include_router(roles_router, tags=["roles"])
 router.include_router(settings_router, tags=["settings"])
+router.include_router(search_router, tags=["search"])
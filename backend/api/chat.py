@@ -1,97 +1,194 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+import json
+import time
+from functools import partial
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import Awaitable, Callable, List, Optional, Tuple
 from fastapi.responses import StreamingResponse
 from ..database.db_models import Message, Chat, ChatUpdate
 from ..core import chat as chat_service
-from ..core import ollama as ollama_service
-from ..utils.stream import stream_response
-import json
-import sqlite3
-from ..config import config
+from ..core import context
+from ..core import roles as roles_service
+from ..core import generations, response_cache, scheduler
+from ..utils.auth import request_user
+from ..utils.stream import format_sse, stream_response
+from ..utils.timing import record, span
 
 router = APIRouter()
 
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Content-Type": "text/event-stream",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, Last-Event-ID",
+    "X-Accel-Buffering": "no"
+}
+
+def _admit(model: str, request: Request) -> scheduler.Ticket:
+    """Claim a generation slot for the caller or reject with 429"""
+    try:
+        return scheduler.admit(model, request_user(request))
+    except scheduler.QueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail="请求过多，请稍后重试",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+def _stream_reply(
+    chat_id: str,
+    model: str,
+    ticket: scheduler.Ticket,
+    generate: Optional[Callable[[], Awaitable]],
+    ollama_response=None,
+    started: Optional[float] = None
+) -> StreamingResponse:
+    """Stream an Ollama reply to the client and save it once it completes
+
+    If the ticket was granted straight away the caller has already started
+    the generation, so upstream errors still surface as an HTTP error. A
+    reply served from the response cache is passed the same way, with its
+    ticket already released and no ``generate``.
+    Otherwise the stream reports the queue position until a slot frees up
+    and then starts the generation itself.
+
+    The generation runs in the background so a client that loses its
+    connection can resume it; if none comes back within the grace period it
+    is cancelled. The slot is released and the upstream response closed when
+    it ends, even if it is cancelled before it starts.
+    """
+    async def save_response(content: str, truncated: bool):
+        await chat_service.save_message(
+            chat_id,
+            Message(role="assistant", content=content, model=model, truncated=truncated)
+        )
+
+    async def body():
+        response = ollama_response
+        if response is None:
+            queued_at = time.perf_counter()
+            async for position in ticket.wait():
+                yield json.dumps({"queue_position": position}) + "\n"
+            record("queue", queued_at)
+            try:
+                response = await generate()
+            except HTTPException as e:
+                yield json.dumps({"error": e.detail}) + "\n"
+                return
+            except Exception as e:
+                yield json.dumps({"error": f"生成响应时出错: {str(e)}"}) + "\n"
+                return
+        async for chunk in stream_response(response, on_complete=save_response, model=model, started=started):
+            yield chunk
+
+    async def finish():
+        ticket.release()
+        if ollama_response is not None:
+            await ollama_response.aclose()
+
+    return _follow(generations.start(chat_id, model, body(), on_finish=finish))
+
+def _follow(generation: generations.Generation, after: Optional[int] = None) -> StreamingResponse:
+    """Send a generation's frames as server-sent events, replaying those after ``after``"""
+    async def events():
+        async for event_id, data in generation.events(after):
+            yield format_sse(data, event_id)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def _resolve_role(chat_id: str, requested: Optional[str], bound: Optional[str]) -> Optional[str]:
+    """Pick the role for this turn, rebinding the chat if the client switched roles"""
+    if requested and requested != bound:
+        await chat_service.bind_role(chat_id, requested)
+        return requested
+    return bound
+
+async def _prepare(chat_id: str, model: str, role_id: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+    """Assemble the prompt with the role's system prompt as the stable prefix"""
+    system_prompt = await roles_service.get_system_prompt(role_id)
+    with span("assemble"):
+        messages = await context.assemble(chat_id, model, system_prompt)
+    return messages, system_prompt
+
+async def _generate(model: str, messages: List[dict], system_prompt: Optional[str]):
+    """Start a generation on Ollama for a prepared prompt"""
+    response = await response_cache.generate(model, messages)
+    roles_service.mark_warm(model, system_prompt)
+    return response
+
 @router.post("/chats")
 async def create_chat(chat: Chat):
     """Create a new chat"""
     return await chat_service.create_chat(chat)
 
 @router.get("/chats/{chat_id}/messages")
-async def get_chat_messages(chat_id: str):
-    """Get messages for a specific chat"""
-    return await chat_service.get_chat_messages(chat_id)
+async def get_chat_messages(
+    chat_id: str,
+    before: Optional[int] = Query(None, ge=0, description="Return messages with seq lower than this"),
+    after: Optional[int] = Query(None, ge=0, description="Return messages with seq higher than this"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of messages")
+):
+    """Get messages for a specific chat, optionally one page at a time"""
+    return await chat_service.get_chat_messages(chat_id, before=before, after=after, limit=limit)
 
 @router.post("/chat/{chat_id}")
-async def chat(chat_id: str, message: Message):
+async def chat(chat_id: str, message: Message, request: Request):
     """Send message to Ollama and stream response"""
+    started = time.perf_counter()
     try:
         # Validate message content
         if not message.content or not message.content.strip():
             raise HTTPException(status_code=422, detail="消息内容不能为空")
 
+        # Get chat model and role if not provided in message
+        with span("chat_lookup"):
+            binding = await chat_service.get_chat_binding(chat_id)
+        if not binding:
+            raise HTTPException(status_code=404, detail="聊天不存在")
+        message.model = message.model or binding[0]
+
+        # Reject before saving anything if the model's queue is full
+        ticket = _admit(message.model, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    try:
         # Save user message
-        await chat_service.save_message(chat_id, message)
-        
-        # Get chat model if not provided in message
-        if not message.model:
-            conn = sqlite3.connect(config.storage.database)
-            c = conn.cursor()
-            c.execute("SELECT model FROM chats WHERE id = ?", (chat_id,))
-            result = c.fetchone()
-            conn.close()
-            if result:
-                message.model = result[0]
-            else:
-                raise HTTPException(status_code=404, detail="聊天不存在")
-        
+        with span("save_message"):
+            await chat_service.save_message(chat_id, message)
+        role_id = await _resolve_role(chat_id, message.role_id, binding[1])
+        messages, system_prompt = await _prepare(chat_id, message.model, role_id)
+        cached = await response_cache.lookup(message.model, messages)
+        if cached is not None:
+            # Replaying a cached reply needs no slot on the model
+            ticket.release()
+            return _stream_reply(chat_id, message.model, ticket, None, cached, started)
+        generate = partial(_generate, message.model, messages, system_prompt)
+        if not ticket.granted:
+            return _stream_reply(chat_id, message.model, ticket, generate, started=started)
+
         # Get response from Ollama
         try:
-            ollama_response = await ollama_service.generate_response(message.model, message.content)
+            ollama_response = await generate()
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"生成响应时出错: {str(e)}")
         
-        # Save assistant's response in background
-        async def save_response():
-            full_response = ""
-            async for chunk in ollama_response.aiter_lines():
-                if chunk.strip():
-                    try:
-                        data = json.loads(chunk)
-                        if "response" in data:
-                            full_response += data["response"]
-                    except json.JSONDecodeError:
-                        full_response += chunk.strip()
-            
-            if full_response:
-                await chat_service.save_message(
-                    chat_id,
-                    Message(role="assistant", content=full_response)
-                )
-        
-        background_tasks = BackgroundTasks()
-        background_tasks.add_task(save_response)
-        
-        return StreamingResponse(
-            stream_response(ollama_response),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type",
-                "X-Accel-Buffering": "no"
-            },
-            background=background_tasks
-        )
+        return _stream_reply(chat_id, message.model, ticket, generate, ollama_response, started)
             
     except Exception as e:
+        ticket.release()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/chats")
-async def get_chats():
-    """Get all chats"""
-    return await chat_service.get_chats()
+async def get_chats(
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Maximum number of chats"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page")
+):
+    """Get chats, most recently active first"""
+    return await chat_service.get_chats(limit=limit, cursor=cursor)
 
 @router.delete("/chats/{chat_id}")
 async def delete_chat(chat_id: str):
@@ -103,52 +200,79 @@ async def update_chat(chat_id: str, chat_update: ChatUpdate):
     """Update chat details"""
     return await chat_service.update_chat(chat_id, chat_update)
 
+def _resume(chat_id: str, last_event_id: str) -> StreamingResponse:
+    """Continue an in-flight or just finished generation after ``last_event_id``"""
+    parsed = generations.parse_event_id(last_event_id)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail="无效的 Last-Event-ID")
+    generation = generations.get(chat_id)
+    if generation is None or generation.id != parsed[0]:
+        raise HTTPException(status_code=404, detail="没有可恢复的回复")
+    return _follow(generation, parsed[1])
+
+@router.delete("/chat/{chat_id}/generation")
+async def cancel_generation(chat_id: str):
+    """Stop the chat's reply in progress, keeping the partial answer"""
+    generation = generations.get(chat_id)
+    if generation is None or generation.finished:
+        raise HTTPException(status_code=404, detail="没有进行中的回复")
+    await generation.cancel()
+    return {"status": "cancelled", "generation_id": generation.id}
+
 @router.get("/chat/{chat_id}/stream")
-async def stream_chat(chat_id: str, content: str, model: str):
-    """Stream chat response"""
+async def stream_chat(
+    chat_id: str,
+    request: Request,
+    content: Optional[str] = None,
+    model: Optional[str] = None,
+    role_id: Optional[str] = None,
+    last_event_id: Optional[str] = Query(None, description="Resume after this event, like the Last-Event-ID header")
+):
+    """Stream chat response
+
+    With a ``Last-Event-ID`` header (sent by EventSource when it reconnects)
+    or ``last_event_id`` parameter, the current reply is resumed instead of
+    sending a new message.
+    """
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    if last_event_id:
+        return _resume(chat_id, last_event_id)
+    if not content or not model:
+        raise HTTPException(status_code=422, detail="content 和 model 不能为空")
+
+    started = time.perf_counter()
+    try:
+        with span("chat_lookup"):
+            binding = await chat_service.get_chat_binding(chat_id)
+        if not binding:
+            raise HTTPException(status_code=404, detail="聊天不存在")
+        ticket = _admit(model, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
     try:
         # Save user message
-        message = Message(role="user", content=content, model=model)
-        await chat_service.save_message(chat_id, message)
+        message = Message(role="user", content=content, model=model, role_id=role_id)
+        with span("save_message"):
+            await chat_service.save_message(chat_id, message)
+        role_id = await _resolve_role(chat_id, role_id, binding[1])
+        messages, system_prompt = await _prepare(chat_id, model, role_id)
+        cached = await response_cache.lookup(model, messages)
+        if cached is not None:
+            # Replaying a cached reply needs no slot on the model
+            ticket.release()
+            return _stream_reply(chat_id, model, ticket, None, cached, started)
+        generate = partial(_generate, model, messages, system_prompt)
+        if not ticket.granted:
+            return _stream_reply(chat_id, model, ticket, generate, started=started)
         
         # Get response from Ollama
-        ollama_response = await ollama_service.generate_response(model, content)
-        
-        # Save assistant's response in background
-        async def save_response():
-            full_response = ""
-            async for chunk in ollama_response.aiter_lines():
-                if chunk.strip():
-                    try:
-                        data = json.loads(chunk)
-                        if "response" in data:
-                            full_response += data["response"]
-                    except json.JSONDecodeError:
-                        full_response += chunk.strip()
-            
-            if full_response:
-                await chat_service.save_message(
-                    chat_id,
-                    Message(role="assistant", content=full_response)
-                )
+        ollama_response = await generate()
         
-        background_tasks = BackgroundTasks()
-        background_tasks.add_task(save_response)
-        
-        return StreamingResponse(
-            stream_response(ollama_response),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type",
-                "X-Accel-Buffering": "no"
-            },
-            background=background_tasks
-        )
+        return _stream_reply(chat_id, model, ticket, generate, ollama_response, started)
             
     except Exception as e:
+        ticket.release()
         raise HTTPException(status_code=500, detail=str(e))
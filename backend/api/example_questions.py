@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException
 import sqlite3
-from ..config import config
+from ..database.connection import db
 
 router = APIRouter()
 
@@ -8,11 +8,7 @@ router = APIRouter()
 async def get_example_questions():
     """Get example questions for chat suggestions"""
     try:
-        conn = sqlite3.connect(config.storage.database)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, content, category, order_num FROM example_questions ORDER BY order_num")
-        questions = cursor.fetchall()
-        conn.close()
+        questions = await db.fetchall("SELECT id, content, category, order_num FROM example_questions ORDER BY order_num")
         
         return [
             {
@@ -1,5 +1,9 @@
+import logging
 from fastapi import APIRouter
 from ..core import ollama as ollama_service
+from ..core import residency
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -7,3 +11,13 @@ router = APIRouter()
 async def get_models():
     """Get available Ollama models"""
     return await ollama_service.get_models()
+
+@router.get("/models/status")
+async def get_models_status():
+    """Get loaded models and their memory use"""
+    try:
+        await residency.poll()
+    except Exception as e:
+        # Fall back to the last result the monitor saw
+        logger.warning(f"Error connecting to Ollama service: {e}")
+    return residency.status()
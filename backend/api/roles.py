@@ -5,6 +5,9 @@ import uuid
 from datetime import datetime
 from ..database.db_models import Role, RoleUpdate
 from ..config import config
+from ..database.connection import db
+from ..core import roles as roles_service
+from ..core import ollama as ollama_service
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -109,70 +112,50 @@ def init_db():
 # 初始化数据库
 init_db()
 
-def get_roles() -> List[RoleInDB]:
-    conn = sqlite3.connect(config.storage.database)
-    c = conn.cursor()
-    
-    try:
-        c.execute('SELECT id, name, description, system_prompt, category, is_built_in, created_at, updated_at FROM roles')
-        roles = []
-        for row in c.fetchall():
-            roles.append({
-                'id': row[0],
-                'name': row[1],
-                'description': row[2],
-                'system_prompt': row[3],
-                'category': row[4],
-                'is_built_in': bool(row[5]),
-                'created_at': row[6],
-                'updated_at': row[7]
-            })
-        return roles
-    finally:
-        conn.close()
-
-def create_role(role: RoleBase) -> RoleInDB:
-    conn = sqlite3.connect(config.storage.database)
-    c = conn.cursor()
-    
-    try:
-        # 生成唯一ID
-        role_id = str(uuid.uuid4())
-        
-        c.execute('''
+def _row_to_role(row) -> dict:
+    return {
+        'id': row[0],
+        'name': row[1],
+        'description': row[2],
+        'system_prompt': row[3],
+        'category': row[4],
+        'is_built_in': bool(row[5]),
+        'created_at': row[6]
+    }
+
+async def get_roles() -> List[RoleInDB]:
+    rows = await db.fetchall('SELECT id, name, description, system_prompt, category, is_built_in, created_at, updated_at FROM roles')
+    roles = []
+    for row in rows:
+        role = _row_to_role(row)
+        role['updated_at'] = row[7]
+        roles.append(role)
+    return roles
+
+async def create_role(role: RoleBase) -> RoleInDB:
+    # 生成唯一ID
+    role_id = str(uuid.uuid4())
+
+    def insert(conn):
+        conn.execute('''
             INSERT INTO roles (id, name, description, system_prompt, category)
             VALUES (?, ?, ?, ?, ?)
         ''', (role_id, role.name, role.description, role.system_prompt, role.category))
         
-        conn.commit()
-        
         # 获取创建的角色
-        c.execute('''
+        return conn.execute('''
             SELECT id, name, description, system_prompt, category, is_built_in, created_at
             FROM roles WHERE id = ?
-        ''', (role_id,))
-        
-        row = c.fetchone()
-        return {
-            'id': row[0],
-            'name': row[1],
-            'description': row[2],
-            'system_prompt': row[3],
-            'category': row[4],
-            'is_built_in': bool(row[5]),
-            'created_at': row[6]
-        }
-    finally:
-        conn.close()
-
-def update_role(role_id: str, role: RoleBase) -> RoleInDB:
-    conn = sqlite3.connect(config.storage.database)
-    c = conn.cursor()
-    
-    try:
+        ''', (role_id,)).fetchone()
+
+    row = await db.run(insert)
+    roles_service.invalidate()
+    return _row_to_role(row)
+
+async def update_role(role_id: str, role: RoleBase) -> RoleInDB:
+    def update(conn):
         # 检查是否为内置角色
-        c.execute('SELECT is_built_in FROM roles WHERE id = ?', (role_id,))
-        row = c.fetchone()
+        row = conn.execute('SELECT is_built_in FROM roles WHERE id = ?', (role_id,)).fetchone()
         
         if not row:
             raise HTTPException(status_code=404, detail="角色不存在")
@@ -180,41 +163,26 @@ def update_role(role_id: str, role: RoleBase) -> RoleInDB:
         if row[0]:  # is_built_in
             raise HTTPException(status_code=400, detail="内置角色不能修改")
         
-        c.execute('''
+        conn.execute('''
             UPDATE roles 
             SET name = ?, description = ?, system_prompt = ?, category = ?
             WHERE id = ?
         ''', (role.name, role.description, role.system_prompt, role.category, role_id))
         
-        conn.commit()
-        
         # 获取更新后的角色
-        c.execute('''
+        return conn.execute('''
             SELECT id, name, description, system_prompt, category, is_built_in, created_at
             FROM roles WHERE id = ?
-        ''', (role_id,))
-        
-        row = c.fetchone()
-        return {
-            'id': row[0],
-            'name': row[1],
-            'description': row[2],
-            'system_prompt': row[3],
-            'category': row[4],
-            'is_built_in': bool(row[5]),
-            'created_at': row[6]
-        }
-    finally:
-        conn.close()
-
-def delete_role(role_id: str):
-    conn = sqlite3.connect(config.storage.database)
-    c = conn.cursor()
-    
-    try:
+        ''', (role_id,)).fetchone()
+
+    row = await db.run(update)
+    roles_service.invalidate()
+    return _row_to_role(row)
+
+async def delete_role(role_id: str):
+    def delete(conn):
         # 检查是否为内置角色
-        c.execute('SELECT is_built_in FROM roles WHERE id = ?', (role_id,))
-        row = c.fetchone()
+        row = conn.execute('SELECT is_built_in FROM roles WHERE id = ?', (role_id,)).fetchone()
         
         if not row:
             raise HTTPException(status_code=404, detail="角色不存在")
@@ -222,25 +190,36 @@ def delete_role(role_id: str):
         if row[0]:  # is_built_in
             raise HTTPException(status_code=400, detail="内置角色不能删除")
         
-        c.execute('DELETE FROM roles WHERE id = ?', (role_id,))
-        conn.commit()
-    finally:
-        conn.close()
+        conn.execute('DELETE FROM roles WHERE id = ?', (role_id,))
+
+    await db.run(delete)
+    roles_service.invalidate()
 
 # API 路由
 @router.get("/roles", response_model=List[RoleInDB])
 async def get_all_roles():
-    return get_roles()
+    return await get_roles()
 
 @router.post("/roles", response_model=RoleInDB)
 async def create_new_role(role: RoleBase):
-    return create_role(role)
+    return await create_role(role)
 
 @router.put("/roles/{role_id}", response_model=RoleInDB)
 async def update_existing_role(role_id: str, role: RoleBase):
-    return update_role(role_id, role)
+    return await update_role(role_id, role)
 
 @router.delete("/roles/{role_id}")
 async def delete_existing_role(role_id: str):
-    delete_role(role_id)
-    return {"status": "success"} 
\ No newline at end of file
+    await delete_role(role_id)
+    return {"status": "success"} 
+
+@router.post("/roles/{role_id}/warm")
+async def warm_role(role_id: str, model: str):
+    """Evaluate the role's system prompt on the model ahead of the first message"""
+    if model not in (await ollama_service.get_models())["models"]:
+        raise HTTPException(status_code=400, detail="模型不可用")
+    system_prompt = await roles_service.get_system_prompt(role_id)
+    if system_prompt is None:
+        raise HTTPException(status_code=404, detail="角色不存在")
+    roles_service.warm_prefix(model, system_prompt)
+    return {"status": "success"}
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+import sqlite3
+from ..database.connection import db
+from ..database import search as search_index
+
+router = APIRouter()
+
+@router.get("/search")
+async def search_messages(
+    q: str = Query(..., min_length=1, description="Search text"),
+    chat_id: Optional[str] = Query(None, description="Only search this chat"),
+    model: Optional[str] = Query(None, description="Only search messages from this model"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """Search message history, best matches first"""
+    try:
+        results = await db.run(search_index.search, q, chat_id, model, limit, offset)
+        return {"results": results}
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -1,9 +1,14 @@
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from backend.api import router
 from backend.database.init import init_db
-from backend.utils.security import add_security_headers
+from backend.utils.security import ConfigCORSMiddleware, add_security_headers
 from backend.config import config_manager
+from backend.core import ollama as ollama_service
+from backend.core import chat_index, persistence, residency, response_cache, tiering
+from backend.database.connection import db
+from backend.utils import metrics
+from backend.utils.timing import TimingMiddleware
 
 # Initialize the database
 init_db()
@@ -16,8 +21,7 @@ app = FastAPI(
 
 # Add CORS middleware
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=config_manager.config.server.cors_origins,
+    ConfigCORSMiddleware,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -27,6 +31,32 @@ app.add_middleware(
 # Add security headers middleware
 app.middleware("http")(add_security_headers)
 
+# Outermost, so the timings cover every other middleware
+app.add_middleware(TimingMiddleware)
+
+@app.on_event("startup")
+async def startup():
+    """Open long-lived resources"""
+    config_manager.start_watching()
+    await ollama_service.start_client()
+    await chat_index.start()
+    await response_cache.start()
+    persistence.start()
+    residency.start()
+    tiering.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Release long-lived resources"""
+    await residency.stop()
+    await tiering.stop()
+    await chat_index.stop()
+    await ollama_service.close_client()
+    # Drain the write-behind queue while the database is still open
+    await persistence.stop()
+    db.close()
+    config_manager.stop_watching()
+
 # Include API routes
 app.include_router(router, prefix="/api")
 
@@ -34,4 +64,10 @@ app.include_router(router, prefix="/api")
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "version": __import__("backend").__version__} 
\ No newline at end of file
+    return {"status": "healthy", "version": __import__("backend").__version__} 
+
+# Prometheus metrics endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus metrics endpoint"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,32 +1,112 @@
-from pydantic import BaseModel
-from typing import List, Dict
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Literal, Union
 
-class OllamaConfig(BaseModel):
+class FrozenModel(BaseModel):
+    """Base for config sections; published snapshots must not be mutated"""
+    model_config = ConfigDict(frozen=True)
+
+class OllamaConfig(FrozenModel):
     host: str = "http://localhost:11434"
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+    models_cache_ttl: float = 30.0
 
-class StorageConfig(BaseModel):
+class StorageConfig(FrozenModel):
     chat_dir: str = "./storage/chats"
     database: str = "./storage/database.db"
+    db_pool_size: int = 4
+    messages_backend: Literal["files", "sqlite"] = "files"
+    consistency_check_interval: float = 600.0
+
+class PersistenceConfig(FrozenModel):
+    ack: Literal["queued", "flushed"] = "queued"
+    flush_interval_ms: int = 10
+    max_batch: int = 256
+    max_queue: int = 1024
+    fsync: bool = True
+
+class TieringConfig(FrozenModel):
+    enabled: bool = False
+    cold_after: float = 604800.0
+    interval: float = 3600.0
+    level: int = 6
 
-class ServerConfig(BaseModel):
+class ServerConfig(FrozenModel):
     host: str = "localhost"
     port: int = 8080
     cors_origins: List[str] = ["http://localhost:5173"]
     secret_key: str = "your-secret-key-please-change-in-production"
     token_expire_days: int = 30
+    config_watch_interval: float = 2.0
+
+class StreamConfig(FrozenModel):
+    coalesce: bool = True
+    flush_interval_ms: int = 30
+    flush_bytes: int = 256
+    replay_frames: int = 4096
+    replay_retention: float = 60.0
+    disconnect_grace: float = 5.0
+
+class ContextConfig(FrozenModel):
+    history_cache_size: int = 256
+    max_prompt_tokens: int = 6000
+    recent_ratio: float = 0.5
+    compaction_enabled: bool = True
+    summary_model: str = ""
+    prefix_warm_ttl: float = 240.0
+
+class SchedulerConfig(FrozenModel):
+    concurrency: int = 2
+    model_concurrency: Dict[str, int] = {}
+    max_queue: int = 32
+    default_retry_after: float = 10.0
+
+class ResponseCacheConfig(FrozenModel):
+    enabled: bool = False
+    allow_sampling: bool = False
+    ttl: float = 86400.0
+    max_memory_bytes: int = 8 * 1024 * 1024
+    directory: str = "./storage/response_cache"
+    max_disk_bytes: int = 128 * 1024 * 1024
+
+class ResidencyConfig(FrozenModel):
+    hot_models: List[str] = []
+    preload: bool = True
+    keep_alive: Union[str, int] = "10m"
+    hot_keep_alive: Union[str, int] = -1
+    model_keep_alive: Dict[str, Union[str, int]] = {}
+    poll_interval: float = 15.0
+    memory_budget_bytes: int = 0
+    idle_timeout: float = 300.0
+
+class TracingConfig(FrozenModel):
+    enabled: bool = False
+    sample_rate: float = 0.01
+    path: str = "./storage/traces.jsonl"
 
-class ModelsConfig(BaseModel):
+class ModelsConfig(FrozenModel):
     default: str = "deepseek-r1:1.5b"
     available: List[str] = []
 
-class AuthConfig(BaseModel):
+class AuthConfig(FrozenModel):
     users: Dict[str, str] = {
         "admin": "admin123"
     }
 
-class Config(BaseModel):
+class Config(FrozenModel):
     ollama: OllamaConfig = OllamaConfig()
     storage: StorageConfig
+    persistence: PersistenceConfig = PersistenceConfig()
+    tiering: TieringConfig = TieringConfig()
     server: ServerConfig
     models: ModelsConfig = ModelsConfig()
+    stream: StreamConfig = StreamConfig()
+    context: ContextConfig = ContextConfig()
+    scheduler: SchedulerConfig = SchedulerConfig()
+    response_cache: ResponseCacheConfig = ResponseCacheConfig()
+    residency: ResidencyConfig = ResidencyConfig()
+    tracing: TracingConfig = TracingConfig()
     auth: AuthConfig = AuthConfig()
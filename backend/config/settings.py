@@ -1,12 +1,27 @@
+import os
 import yaml
-from typing import Dict, Any, Optional
+import logging
+import threading
+from typing import Callable, Dict, Any, List, Optional
 from pathlib import Path
 from .config_models import Config
+from ..utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+CONFIG_RELOADS = Counter("config_reloads_total", "Configuration reloads by outcome", ["result"])
+
+# Called as callback(old_config, new_config) whenever a new snapshot is published
+ConfigSubscriber = Callable[[Config, Config], None]
 
 class ConfigManager:
+    """Holds the current configuration as an immutable, versioned snapshot
+
+    Reading ``config`` never touches the filesystem. A watcher thread polls
+    the config file at a fixed interval, and every change (from the file or
+    from ``update_config``) publishes a new snapshot and notifies subscribers.
+    """
     _instance: Optional['ConfigManager'] = None
-    _config: Optional[Config] = None
-    _last_load_time: float = 0
     
     def __init__(self):
         raise RuntimeError('Call get_instance() instead')
@@ -16,51 +31,114 @@ class ConfigManager:
         if cls._instance is None:
             cls._instance = cls.__new__(cls)
             cls._instance._config = None
-            cls._instance._last_load_time = 0
+            cls._instance._version = 0
+            cls._instance._last_mtime = None
+            cls._instance._subscribers = []
+            cls._instance._lock = threading.RLock()
+            cls._instance._watcher = None
+            cls._instance._stop_watching = threading.Event()
         return cls._instance
     
-    def _should_reload(self) -> bool:
-        """Check if config file has been modified since last load"""
-        if not CONFIG_FILE.exists():
-            return False
-        
-        current_mtime = CONFIG_FILE.stat().st_mtime
-        should_reload = current_mtime > self._last_load_time
-        
-        if should_reload:
-            print(f"Config file modified, reloading... (last load: {self._last_load_time}, current: {current_mtime})")
-        
-        return should_reload
-    
     @property
     def config(self) -> Config:
-        """Get current configuration, reloading if file has been modified"""
-        if self._config is None or self._should_reload():
-            print("[CONFIG_SOURCE] Loading config...")
-            self._config = Config(**load_config())
-            if CONFIG_FILE.exists():
-                self._last_load_time = CONFIG_FILE.stat().st_mtime
+        """Get the current configuration snapshot"""
+        if self._config is None:
+            self.reload_config()
         return self._config
+
+    @property
+    def version(self) -> int:
+        """Incremented every time a new snapshot is published"""
+        return self._version
+
+    def subscribe(self, callback: ConfigSubscriber) -> None:
+        """Register a callback for configuration changes"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: ConfigSubscriber) -> None:
+        """Remove a previously registered callback"""
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _publish(self, new_config: Config) -> Config:
+        with self._lock:
+            old_config = self._config
+            self._config = new_config
+            self._version += 1
+            subscribers: List[ConfigSubscriber] = self._subscribers[:]
+        if old_config is not None and old_config != new_config:
+            for callback in subscribers:
+                try:
+                    callback(old_config, new_config)
+                except Exception as e:
+                    logger.error(f"[CONFIG_SOURCE] Config subscriber failed: {e}")
+        return new_config
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return CONFIG_FILE.stat().st_mtime
+        except FileNotFoundError:
+            return None
     
     def reload_config(self) -> Config:
         """Force reload configuration from file"""
-        print("[CONFIG_SOURCE] Reloading config...")
-        self._config = Config(**load_config())
-        if CONFIG_FILE.exists():
-            self._last_load_time = CONFIG_FILE.stat().st_mtime
-        return self._config
+        with self._lock:
+            logger.info("[CONFIG_SOURCE] Reloading config...")
+            self._last_mtime = self._file_mtime()
+            try:
+                config = Config(**load_config())
+            except Exception:
+                CONFIG_RELOADS.labels("error").inc()
+                raise
+            CONFIG_RELOADS.labels("changed" if config != self._config else "unchanged").inc()
+            return self._publish(config)
+
+    def check_for_changes(self) -> bool:
+        """Reload if the config file changed since the last load"""
+        mtime = self._file_mtime()
+        if mtime == self._last_mtime:
+            return False
+        logger.info(f"[CONFIG_SOURCE] Config file modified, reloading... (last load: {self._last_mtime}, current: {mtime})")
+        self.reload_config()
+        return True
+
+    def start_watching(self, interval: Optional[float] = None) -> None:
+        """Poll the config file in a background thread"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        interval = interval or self.config.server.config_watch_interval
+        self._stop_watching.clear()
+
+        def watch():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.check_for_changes()
+                except Exception as e:
+                    logger.error(f"[CONFIG_SOURCE] Failed to reload config: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        """Stop the background watcher"""
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
     
     def update_config(self, new_config: Dict[str, Any]) -> Config:
         """Update and save configuration"""
         try:
-            print("[CONFIG_SOURCE] Updating config...")
+            logger.info("[CONFIG_SOURCE] Updating config...")
             # Save configuration to file
             save_config(new_config)
             
             # Force reload configuration
             return self.reload_config()
         except Exception as e:
-            print(f"Failed to update config: {e}")
+            logger.error(f"Failed to update config: {e}")
             raise
 
 # Default configuration
@@ -88,7 +166,8 @@ DEFAULT_CONFIG = {
 
 # Get the absolute path to the config directory (same directory as this file)
 CONFIG_DIR = Path(__file__).parent
-CONFIG_FILE = CONFIG_DIR / "config.yaml"
+# WEBUI_CONFIG_FILE points the backend at another config, e.g. for benchmarks
+CONFIG_FILE = Path(os.environ.get("WEBUI_CONFIG_FILE") or CONFIG_DIR / "config.yaml")
 
 def deep_merge(dict1: Dict, dict2: Dict) -> Dict:
     """Deep merge two dictionaries"""
@@ -104,58 +183,58 @@ def load_config() -> Dict[str, Any]:
     """Load configuration from file or use defaults"""
     try:
         if CONFIG_FILE.exists():
-            print(f"[CONFIG_SOURCE] Loading config from {CONFIG_FILE}")
+            logger.info(f"[CONFIG_SOURCE] Loading config from {CONFIG_FILE}")
             with open(CONFIG_FILE, "r", encoding='utf-8') as f:
                 user_config = yaml.safe_load(f)
                 if user_config is None:
-                    print("[CONFIG_SOURCE] Empty config file, using defaults")
+                    logger.info("[CONFIG_SOURCE] Empty config file, using defaults")
                     user_config = {}
                 # Use deep merge to properly handle nested configurations
                 final_config = deep_merge(DEFAULT_CONFIG, user_config)
-                print(f"[CONFIG_SOURCE] Loaded config: {final_config}")
+                logger.debug(f"[CONFIG_SOURCE] Loaded config: {final_config}")
                 return final_config
-        print("[CONFIG_SOURCE] Config file not found, using defaults")
+        logger.info("[CONFIG_SOURCE] Config file not found, using defaults")
         return DEFAULT_CONFIG.copy()
     except Exception as e:
-        print(f"[CONFIG_SOURCE] Failed to load config, using defaults: {e}")
+        logger.error(f"[CONFIG_SOURCE] Failed to load config, using defaults: {e}")
         return DEFAULT_CONFIG.copy()
 
 def save_config(new_config: Dict[str, Any]) -> None:
     """Save configuration to file"""
     try:
         # Ensure config directory exists
-        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
         
-        print("[CONFIG_SOURCE] Current new_config:", new_config)
+        logger.debug(f"[CONFIG_SOURCE] Current new_config: {new_config}")
         
         # Load existing config from file directly
         current_config = {}
         if CONFIG_FILE.exists():
-            print(f"[CONFIG_SOURCE] Loading existing config from {CONFIG_FILE}")
+            logger.debug(f"[CONFIG_SOURCE] Loading existing config from {CONFIG_FILE}")
             with open(CONFIG_FILE, "r", encoding='utf-8') as f:
                 file_config = yaml.safe_load(f)
                 if file_config is not None:
                     current_config = file_config
-                    print("[CONFIG_SOURCE] Existing config:", current_config)
+                    logger.debug(f"[CONFIG_SOURCE] Existing config: {current_config}")
         
         # Merge new config with current config
         updated_config = deep_merge(current_config, new_config)
-        print("[CONFIG_SOURCE] Merged config:", updated_config)
+        logger.debug(f"[CONFIG_SOURCE] Merged config: {updated_config}")
         
         # Save to file with proper encoding
         with open(CONFIG_FILE, "w", encoding='utf-8') as f:
             yaml.dump(updated_config, f, default_flow_style=False, allow_unicode=True)
             
-        print(f"[CONFIG_SOURCE] Configuration saved to {CONFIG_FILE}: {updated_config}")
+        logger.info(f"[CONFIG_SOURCE] Configuration saved to {CONFIG_FILE}")
     except Exception as e:
-        print(f"[CONFIG_SOURCE] Failed to save config: {e}")
+        logger.error(f"[CONFIG_SOURCE] Failed to save config: {e}")
         raise
 
 # Initialize the config manager singleton
 config_manager = ConfigManager.get_instance()
 
 # Initialize the config property for backward compatibility
-print("[CONFIG_SOURCE] Initializing module-level config")
+logger.info("[CONFIG_SOURCE] Initializing module-level config")
 config = config_manager.config
 
 # Export both config and config_manager
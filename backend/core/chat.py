@@ -1,123 +1,129 @@
+import base64
 import os
 import sqlite3
 import uuid
+from typing import Optional, Tuple
 from fastapi import HTTPException
-import json
+from fastapi.responses import JSONResponse, StreamingResponse
 from datetime import datetime
 from ..database.db_models import Chat, ChatUpdate, Message
-from ..config import config_manager
+from ..database.connection import db
+from ..database.init import NOW
+from ..database import search
+from ..utils.timing import span
+from . import chat_index, context, generations, history, message_store, persistence, roles
 
-async def verify_chat_storage(chat_id: str) -> bool:
-    """Verify that both database record and chat file exist"""
-    try:
-        config = config_manager.config
-        # Check database record
-        conn = sqlite3.connect(config.storage.database)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM chats WHERE id = ?", (chat_id,))
-        count = cursor.fetchone()[0]
-        conn.close()
-
-        if count == 0:
-            return False
-
-        # Check chat file
-        chat_file = os.path.join(config.storage.chat_dir, chat_id, "chat.json")
-        return os.path.exists(chat_file)
-    except Exception:
-        return False
+def _remove_chat_dir(chat_dir: str):
+    """Remove a chat directory and the files inside it"""
+    if os.path.exists(chat_dir):
+        for file in os.listdir(chat_dir):
+            os.remove(os.path.join(chat_dir, file))
+        os.rmdir(chat_dir)
 
 async def create_chat(chat: Chat):
     """Create a new chat"""
     try:
-        config = config_manager.config
-        # Ensure storage directory exists
-        storage_dir = os.path.dirname(config.storage.chat_dir)
-        if not os.path.exists(storage_dir):
-            os.makedirs(storage_dir, exist_ok=True)
-        if not os.path.exists(config.storage.chat_dir):
-            os.makedirs(config.storage.chat_dir, exist_ok=True)
-
         chat_id = str(uuid.uuid4())
-        chat_dir = os.path.join(config.storage.chat_dir, chat_id)
-        chat_file = os.path.join(chat_dir, "chat.json")
+        chat_dir = message_store.chat_path(chat_id)
     
         try:
-            # Create chat directory
-            os.makedirs(chat_dir, exist_ok=True)
-            
-            # Initialize empty chat file
+            # Create the chat directory and empty message log (files backend only)
             try:
-                with open(chat_file, "w") as f:
-                    json.dump([], f)
+                message_store.create(chat_id)
             except IOError as e:
-                if os.path.exists(chat_dir):
-                    os.rmdir(chat_dir)
+                _remove_chat_dir(chat_dir)
                 raise HTTPException(status_code=500, detail=f"Failed to create chat file: {str(e)}")
             
             # Insert chat record into database
             try:
-                conn = sqlite3.connect(config.storage.database)
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO chats (id, title, model) VALUES (?, ?, ?)",
-                    (chat_id, chat.title, chat.model)
+                await db.execute(
+                    f"INSERT INTO chats (id, title, model, role_id, updated_at) VALUES (?, ?, ?, ?, {NOW})",
+                    (chat_id, chat.title, chat.model, chat.role_id)
                 )
-                conn.commit()
             except sqlite3.Error as e:
                 # Clean up if database insert fails
-                if os.path.exists(chat_file):
-                    os.remove(chat_file)
-                if os.path.exists(chat_dir):
-                    os.rmdir(chat_dir)
+                _remove_chat_dir(chat_dir)
                 raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-            finally:
-                if 'conn' in locals():
-                    conn.close()
 
-            # Verify storage
-            if not await verify_chat_storage(chat_id):
-                raise HTTPException(status_code=500, detail="Failed to verify chat storage")
+            chat_index.add(chat_id)
+
+            # Evaluate the role's system prompt before the first message arrives
+            roles.warm_prefix(chat.model, await roles.get_system_prompt(chat.role_id))
             
             # Return chat object with consistent structure
             return {
                 "chat": {
                     "id": chat_id,
                     "title": chat.title,
-                    "model": chat.model
+                    "model": chat.model,
+                    "role_id": chat.role_id
                 }
             }
         except Exception as e:
             # Clean up if anything fails
-            if os.path.exists(chat_dir):
-                os.rmdir(chat_dir)
+            _remove_chat_dir(chat_dir)
             raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def get_chat_messages(chat_id: str):
-    """Get messages for a chat"""
-    config = config_manager.config
-    chat_file = os.path.join(config.storage.chat_dir, chat_id, "chat.json")
+def _with_seq(line: bytes, seq: int) -> bytes:
+    """Add the message's sequence number to an encoded message"""
+    if line == b"{}":
+        return b'{"seq":%d}' % seq
+    return b'{"seq":%d,' % seq + line[1:]
+
+async def get_chat_messages(chat_id: str, before: Optional[int] = None,
+                            after: Optional[int] = None, limit: Optional[int] = None):
+    """Get messages for a chat
+
+    Every message carries its ``seq``, which serves as the paging cursor:
+    ``before`` returns the newest ``limit`` messages older than that seq,
+    ``after`` the oldest ``limit`` messages newer than it, and ``limit``
+    alone the newest page. Pages are always in chronological order.
+
+    Only the requested page is read: the log's index gives the offset of
+    each message, and the messages table is keyed on ``(chat_id, seq)``.
+    Log lines are streamed without decoding.
+    """
+    await persistence.flushed(chat_id)
     try:
-        with open(chat_file, "r") as f:
-            messages = json.load(f)
-        return messages
+        total = await message_store.count(chat_id)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Chat not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    start = 0 if after is None else max(after + 1, 0)
+    stop = total if before is None else min(max(before, 0), total)
+    if limit is not None:
+        if after is not None and before is None:
+            stop = min(stop, start + limit)
+        else:
+            start = max(start, stop - limit)
+
+    def generate():
+        yield b"["
+        for seq, line in enumerate(message_store.iter_raw(chat_id, start, stop), start):
+            if seq != start:
+                yield b","
+            yield _with_seq(line, seq)
+        yield b"]"
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/json",
+        headers={"X-Message-Count": str(total)}
+    )
+
 async def save_message(chat_id: str, message: Message):
-    """Save a message to chat history"""
-    config = config_manager.config
-    await verify_chat_storage(chat_id)
-    chat_file = os.path.join(config.storage.chat_dir, chat_id, "chat.json")
-    
+    """Save a message to chat history
+
+    The message is written behind by the persistence queue; with
+    ``persistence.ack: flushed`` this returns once it is on disk.
+    """
+    if not chat_index.contains(chat_id):
+        raise HTTPException(status_code=404, detail="Chat not found")
     try:
-        with open(chat_file, "r", encoding='utf-8') as f:
-            messages = json.load(f)
-        
         # Convert message to dict, ensuring created_at is set
         message_dict = {
             "role": message.role,
@@ -125,11 +131,12 @@ async def save_message(chat_id: str, message: Message):
             "model": message.model,
             "created_at": message.created_at or datetime.now().isoformat()
         }
+        if message.truncated:
+            message_dict["truncated"] = True
         
-        messages.append(message_dict)
-        
-        with open(chat_file, "w", encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
+        history.append(chat_id, message_dict)
+        with span("enqueue"):
+            await persistence.submit(chat_id, message_dict)
             
         return message_dict
     except FileNotFoundError:
@@ -137,71 +144,135 @@ async def save_message(chat_id: str, message: Message):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def get_chats():
-    """Get all chats"""
+def _encode_cursor(updated_at: str, chat_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at}|{chat_id}".encode()).decode()
+
+def _decode_cursor(cursor: str):
     try:
-        config = config_manager.config
-        conn = sqlite3.connect(config.storage.database)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, model FROM chats ORDER BY created_at DESC")
-        chats = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {"id": chat[0], "title": chat[1], "model": chat[2]}
-            for chat in chats
-        ]
+        updated_at, chat_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return updated_at, chat_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def get_chats(limit: Optional[int] = None, cursor: Optional[str] = None):
+    """Get chats, most recently active first
+
+    Pages are keyset-paginated on ``(updated_at, id)`` through
+    ``idx_chats_updated``. When a page is full, ``X-Next-Cursor`` holds the
+    cursor for the following page.
+    """
+    sql = (
+        "SELECT id, title, model, updated_at, message_count, last_message_preview, last_message_at, role_id "
+        "FROM chats"
+    )
+    params = []
+    if cursor:
+        sql += " WHERE (updated_at, id) < (?, ?)"
+        params.extend(_decode_cursor(cursor))
+    sql += " ORDER BY updated_at DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    try:
+        chats = await db.fetchall(sql, params)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    headers = {}
+    if limit is not None and len(chats) == limit:
+        headers["X-Next-Cursor"] = _encode_cursor(chats[-1][3], chats[-1][0])
+    return JSONResponse(
+        [
+            {
+                "id": chat[0],
+                "title": chat[1],
+                "model": chat[2],
+                "updated_at": chat[3],
+                "message_count": chat[4],
+                "last_message_preview": chat[5],
+                "last_message_at": chat[6],
+                "role_id": chat[7]
+            }
+            for chat in chats
+        ],
+        headers=headers
+    )
+
 async def delete_chat(chat_id: str):
     """Delete a chat"""
-    config = config_manager.config
-    chat_dir = os.path.join(config.storage.chat_dir, chat_id)
     try:
+        # Stop a running reply first so its partial save lands before the deletes
+        generation = generations.get(chat_id)
+        if generation is not None:
+            await generation.cancel()
+        await persistence.flushed(chat_id)
+
         # Delete from database first
-        conn = sqlite3.connect(config.storage.database)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
-        conn.commit()
-        conn.close()
+        def delete(conn):
+            conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+            message_store.delete_rows(conn, chat_id)
+            search.delete_chat(conn, chat_id)
+
+        await db.run(delete)
+        chat_index.discard(chat_id)
         
-        # Then delete files
-        if os.path.exists(chat_dir):
-            for file in os.listdir(chat_dir):
-                os.remove(os.path.join(chat_dir, file))
-            os.rmdir(chat_dir)
+        # Then delete files; the directory also holds the chat's summary
+        _remove_chat_dir(message_store.chat_path(chat_id))
+        history.forget(chat_id)
+        context.forget(chat_id)
             
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def get_chat_binding(chat_id: str) -> Optional[Tuple[str, Optional[str]]]:
+    """Return the model and role a chat is bound to, or None if it does not exist"""
+    return await chat_index.binding(chat_id)
+
+async def bind_role(chat_id: str, role_id: Optional[str]):
+    """Switch the role a chat answers with"""
+    try:
+        await db.execute("UPDATE chats SET role_id = ? WHERE id = ?", (role_id, chat_id))
+    finally:
+        chat_index.forget_binding(chat_id)
+
 async def update_chat(chat_id: str, chat_update: ChatUpdate):
     """Update chat details"""
     try:
-        config = config_manager.config
-        conn = sqlite3.connect(config.storage.database)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE chats SET title = ? WHERE id = ?",
-            (chat_update.title, chat_id)
-        )
-        conn.commit()
-        
-        # Get updated chat details
-        cursor.execute("SELECT id, title, model FROM chats WHERE id = ?", (chat_id,))
-        chat = cursor.fetchone()
-        conn.close()
+        fields = chat_update.model_dump(exclude_unset=True)
+
+        def update(conn):
+            if "title" in fields:
+                conn.execute(
+                    f"UPDATE chats SET title = ?, updated_at = {NOW} WHERE id = ?",
+                    (fields["title"], chat_id)
+                )
+            if "role_id" in fields:
+                conn.execute("UPDATE chats SET role_id = ? WHERE id = ?", (fields["role_id"], chat_id))
+            # Get updated chat details
+            return conn.execute("SELECT id, title, model, role_id FROM chats WHERE id = ?", (chat_id,)).fetchone()
+
+        try:
+            chat = await db.run(update)
+        finally:
+            chat_index.forget_binding(chat_id)
         
         if not chat:
             raise HTTPException(status_code=404, detail="Chat not found")
+
+        if "role_id" in fields:
+            roles.warm_prefix(chat[2], await roles.get_system_prompt(chat[3]))
             
         return {
             "chat": {
                 "id": chat[0],
                 "title": chat[1],
-                "model": chat[2]
+                "model": chat[2],
+                "role_id": chat[3]
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
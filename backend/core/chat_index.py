@@ -0,0 +1,189 @@
+"""In-memory index of existing chats
+
+The set of chat IDs is loaded once at startup and kept current by
+``create_chat`` and ``delete_chat``, so checking that a chat exists before
+saving a message is a set lookup instead of a query and a stat. Next to it,
+the model and role each chat is bound to are cached on first use and kept
+current by the functions that change them.
+
+Verifying storage on disk happens in a background consistency check every
+``storage.consistency_check_interval`` seconds. It re-syncs the index with
+the ``chats`` table and reports, in the log and as metrics:
+- chats whose message storage is missing;
+- message storage without a chat record;
+- chats whose ``message_count`` differs from the stored messages.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Set, Tuple
+from ..config import config_manager
+from ..database.connection import db
+from ..utils.metrics import Gauge
+from . import message_log, message_store, persistence
+
+logger = logging.getLogger(__name__)
+
+INCONSISTENCIES = Gauge(
+    "chat_storage_inconsistencies", "Problems found by the last storage consistency check", ["kind"]
+)
+
+_ids: Set[str] = set()
+_loaded = False
+# chat_id -> (model, role_id)
+_bindings: Dict[str, Tuple[str, Optional[str]]] = {}
+# Bumped whenever a binding is dropped, so a read that raced with it is not cached
+_bindings_version = 0
+# IDs added or removed while a consistency check is running
+_touched: Optional[Set[str]] = None
+_checker: Optional[asyncio.Task] = None
+
+
+def _replace(ids: Set[str]):
+    global _ids, _loaded
+    _ids = ids
+    _loaded = True
+
+
+async def load():
+    """Read every chat ID from the database"""
+    rows = await db.fetchall("SELECT id FROM chats")
+    _replace({row[0] for row in rows})
+
+
+def contains(chat_id: str) -> bool:
+    if not _loaded:
+        # Outside the app (e.g. scripts) nothing loaded the index yet
+        _replace({row[0] for row in db.run_sync(lambda conn: conn.execute("SELECT id FROM chats").fetchall())})
+    return chat_id in _ids
+
+
+def add(chat_id: str):
+    _ids.add(chat_id)
+    if _touched is not None:
+        _touched.add(chat_id)
+
+
+def discard(chat_id: str):
+    _ids.discard(chat_id)
+    forget_binding(chat_id)
+    if _touched is not None:
+        _touched.add(chat_id)
+
+
+async def binding(chat_id: str) -> Optional[Tuple[str, Optional[str]]]:
+    """The model and role a chat is bound to, or None if it does not exist"""
+    cached = _bindings.get(chat_id)
+    if cached is not None:
+        return cached
+    version = _bindings_version
+    row = await db.fetchone("SELECT model, role_id FROM chats WHERE id = ?", (chat_id,))
+    if row is None:
+        return None
+    if version == _bindings_version:
+        _bindings[chat_id] = (row[0], row[1])
+    return row[0], row[1]
+
+
+def forget_binding(chat_id: str):
+    """Drop a chat's cached binding after its model or role changed"""
+    global _bindings_version
+    _bindings.pop(chat_id, None)
+    _bindings_version += 1
+
+
+def _scan_files(counts: Dict[str, int]) -> Tuple[List[str], List[str], List[str]]:
+    """Compare the chat directories with the database; runs on an executor thread"""
+    missing, mismatched = [], []
+    for chat_id, message_count in counts.items():
+        path = message_store.chat_path(chat_id)
+        if not message_log.exists(path):
+            missing.append(chat_id)
+        elif message_log.count(path) != message_count:
+            mismatched.append(chat_id)
+    chat_dir = config_manager.config.storage.chat_dir
+    orphaned = [
+        name for name in (os.listdir(chat_dir) if os.path.isdir(chat_dir) else [])
+        if name not in counts and message_log.exists(os.path.join(chat_dir, name))
+    ]
+    return missing, orphaned, mismatched
+
+
+def _scan_rows(conn) -> Tuple[List[str], List[str], List[str]]:
+    """Compare the messages table with the chats table"""
+    mismatched = [row[0] for row in conn.execute(
+        "SELECT id FROM chats WHERE message_count != (SELECT COUNT(*) FROM messages WHERE chat_id = chats.id)"
+    )]
+    orphaned = [row[0] for row in conn.execute(
+        "SELECT DISTINCT chat_id FROM messages WHERE chat_id NOT IN (SELECT id FROM chats)"
+    )]
+    return [], orphaned, mismatched
+
+
+async def check() -> Dict[str, List[str]]:
+    """Re-sync the index and compare stored messages with the chats table"""
+    global _touched
+    _touched = set()
+    busy = persistence.pending_chats()
+    try:
+        rows = await db.fetchall("SELECT id, message_count FROM chats")
+        counts = {chat_id: count for chat_id, count in rows}
+        if message_store.uses_sqlite():
+            missing, orphaned, mismatched = await db.run(_scan_rows)
+        else:
+            loop = asyncio.get_running_loop()
+            missing, orphaned, mismatched = await loop.run_in_executor(None, _scan_files, counts)
+
+        # Chats created or deleted meanwhile are already right in the index
+        touched = _touched
+        added = [chat_id for chat_id in counts if chat_id not in _ids and chat_id not in touched]
+        stale = [chat_id for chat_id in _ids if chat_id not in counts and chat_id not in touched]
+    finally:
+        _touched = None
+    _ids.update(added)
+    _ids.difference_update(stale)
+    for chat_id in stale:
+        forget_binding(chat_id)
+
+    # Counts of chats written to during the check may be caught mid-flush
+    busy |= persistence.pending_chats()
+    mismatched = [chat_id for chat_id in mismatched if chat_id not in busy]
+    report = {
+        "missing_storage": missing,
+        "orphaned_storage": orphaned,
+        "count_mismatch": mismatched,
+        "index_drift": added + stale
+    }
+    for kind, chat_ids in report.items():
+        INCONSISTENCIES.labels(kind).set(len(chat_ids))
+        if chat_ids:
+            logger.warning(f"Storage check: {len(chat_ids)} {kind.replace('_', ' ')}: {', '.join(chat_ids[:10])}")
+    return report
+
+
+async def _check_loop():
+    while True:
+        interval = config_manager.config.storage.consistency_check_interval
+        await asyncio.sleep(interval if interval > 0 else 60)
+        if interval <= 0:
+            continue
+        try:
+            await check()
+        except Exception as e:
+            logger.warning(f"Storage consistency check failed: {e}")
+
+
+async def start():
+    """Load the index and start the periodic consistency check"""
+    global _checker
+    await load()
+    if _checker is None or _checker.done():
+        _checker = asyncio.ensure_future(_check_loop())
+
+
+async def stop():
+    global _checker
+    if _checker is not None:
+        _checker.cancel()
+        await asyncio.gather(_checker, return_exceptions=True)
+        _checker = None
@@ -0,0 +1,226 @@
+"""Token-budgeted prompt assembly with background conversation compaction
+
+The prompt for a turn is the system prompt, a rolling summary of older
+turns, and the most recent turns. Once the unsummarized window no longer
+fits ``context.max_prompt_tokens``, a background job folds the oldest turns
+into the summary using ``context.summary_model``, leaving roughly
+``context.recent_ratio`` of the budget for verbatim history.
+
+The summary only moves forward in large steps, so between compactions the
+prompt keeps the same prefix and Ollama can keep reusing its KV cache.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+from ..config import config_manager
+from . import chat_index, history, message_store, scheduler
+from . import ollama as ollama_service
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FILE = "summary.json"
+
+# Per-message overhead of the chat template, in tokens
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_INSTRUCTION = (
+    "Summarize the conversation below so it can replace the original messages. "
+    "Keep facts, decisions, code identifiers and open questions. "
+    "Write in the language of the conversation and reply with the summary only."
+)
+
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+
+# Scheduler user that compactions are admitted as
+COMPACTION_USER = "system:compaction"
+
+# In-flight compaction per chat
+_compactions: Dict[str, asyncio.Task] = {}
+
+# chat_id -> summary (None if the chat has none), bounded like the history cache
+_summaries: "OrderedDict[str, Optional[dict]]" = OrderedDict()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, one per four other characters"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def _message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+def _summary_path(chat_id: str) -> str:
+    return os.path.join(config_manager.config.storage.chat_dir, chat_id, SUMMARY_FILE)
+
+def _read_summary(chat_id: str) -> Optional[dict]:
+    try:
+        with open(_summary_path(chat_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Failed to read summary for chat {chat_id}: {e}")
+        return None
+
+def _cache_summary(chat_id: str, summary: Optional[dict]):
+    _summaries[chat_id] = summary
+    _summaries.move_to_end(chat_id)
+    while len(_summaries) > config_manager.config.context.history_cache_size:
+        _summaries.popitem(last=False)
+
+async def load_summary(chat_id: str) -> Optional[dict]:
+    """Return ``{"upto": n, "content": ...}`` covering the first n history messages
+
+    The file is read off the event loop once and then served from memory.
+    """
+    if chat_id in _summaries:
+        _summaries.move_to_end(chat_id)
+        return _summaries[chat_id]
+    summary = await asyncio.get_running_loop().run_in_executor(None, _read_summary, chat_id)
+    # A compaction that finished during the read has cached a newer summary
+    if chat_id in _summaries:
+        return _summaries[chat_id]
+    _cache_summary(chat_id, summary)
+    return summary
+
+def _write_summary(chat_id: str, summary: dict) -> bool:
+    """Write the summary file; returns False if the chat was deleted meanwhile"""
+    path = _summary_path(chat_id)
+    chat_dir = os.path.dirname(path)
+    if not os.path.isdir(chat_dir):
+        # With the sqlite messages backend the chat has no directory until now
+        if not message_store.uses_sqlite() or not chat_index.contains(chat_id):
+            return False
+        os.makedirs(chat_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+    except FileNotFoundError:
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+async def _save_summary(chat_id: str, upto: int, content: str) -> Optional[dict]:
+    summary = {"upto": upto, "content": content, "updated_at": datetime.now().isoformat()}
+    saved = await asyncio.get_running_loop().run_in_executor(None, _write_summary, chat_id, summary)
+    if not saved:
+        return None
+    _cache_summary(chat_id, summary)
+    return summary
+
+def forget(chat_id: str) -> None:
+    """Drop a chat's cached summary"""
+    _summaries.pop(chat_id, None)
+
+def _summary_message(content: str) -> Dict[str, str]:
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{content}"}
+
+async def assemble(chat_id: str, model: str, system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+    """Build the message list for the next generation within the token budget"""
+    context_config = config_manager.config.context
+    messages = await history.get_messages(chat_id)
+
+    prefix = []
+    if system_prompt:
+        prefix.append({"role": "system", "content": system_prompt})
+    summary = await load_summary(chat_id)
+    start = 0
+    if summary and 0 < summary["upto"] <= len(messages):
+        prefix.append(_summary_message(summary["content"]))
+        start = summary["upto"]
+
+    budget = context_config.max_prompt_tokens - sum(_message_tokens(m) for m in prefix)
+
+    # Walk back from the newest turn until the budget is used up
+    used = 0
+    keep_from = len(messages)
+    while keep_from > start:
+        cost = _message_tokens(messages[keep_from - 1])
+        if used + cost > budget and keep_from < len(messages):
+            break
+        used += cost
+        keep_from -= 1
+
+    if keep_from > start:
+        # The unsummarized window overflows: trim it for this turn and compact
+        # in the background so later turns get a stable prefix again.
+        if context_config.compaction_enabled:
+            schedule_compaction(chat_id, model)
+
+    return prefix + messages[keep_from:]
+
+def _compaction_target(messages: List[Dict[str, str]], start: int) -> int:
+    """Index up to which history should be summarized"""
+    context_config = config_manager.config.context
+    recent_budget = int(context_config.max_prompt_tokens * context_config.recent_ratio)
+    used = 0
+    keep_from = len(messages)
+    while keep_from > start + 1:
+        cost = _message_tokens(messages[keep_from - 1])
+        if used + cost > recent_budget:
+            break
+        used += cost
+        keep_from -= 1
+    # Always leave the newest turn verbatim
+    return min(keep_from, len(messages) - 1)
+
+async def compact(chat_id: str, model: str) -> Optional[dict]:
+    """Fold older turns into the chat's rolling summary
+
+    The summary model is called through a low-priority scheduler ticket, so
+    compaction waits until no user request needs the model.
+    """
+    summary_model = config_manager.config.context.summary_model or model
+    ticket = scheduler.admit_background(summary_model, COMPACTION_USER)
+    try:
+        async for _ in ticket.wait():
+            pass
+        return await _compact(chat_id, summary_model)
+    finally:
+        ticket.release()
+
+async def _compact(chat_id: str, model: str) -> Optional[dict]:
+    messages = await history.get_messages(chat_id)
+    summary = await load_summary(chat_id)
+    start = summary["upto"] if summary else 0
+    upto = _compaction_target(messages, start)
+    if upto <= start:
+        return summary
+
+    transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages[start:upto])
+    if summary:
+        transcript = f"Previous summary:\n{summary['content']}\n\nNew messages:\n{transcript}"
+    content = await ollama_service.complete(
+        model,
+        [
+            {"role": "system", "content": SUMMARY_INSTRUCTION},
+            {"role": "user", "content": transcript}
+        ]
+    )
+    if not content.strip():
+        return summary
+    saved = await _save_summary(chat_id, upto, content.strip())
+    if saved is None:
+        logger.info(f"Chat {chat_id} was deleted during compaction, dropping its summary")
+        return None
+    logger.info(f"Compacted chat {chat_id}: summarized {upto} messages")
+    return saved
+
+def _compaction_done(chat_id: str, task: asyncio.Task):
+    _compactions.pop(chat_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Compaction failed for chat {chat_id}: {task.exception()}")
+
+def schedule_compaction(chat_id: str, model: str) -> asyncio.Task:
+    """Start a compaction for the chat unless one is already running"""
+    task = _compactions.get(chat_id)
+    if task is None:
+        task = asyncio.ensure_future(compact(chat_id, model))
+        _compactions[chat_id] = task
+        task.add_done_callback(lambda t: _compaction_done(chat_id, t))
+    return task
@@ -0,0 +1,194 @@
+"""In-flight generations that clients can detach from and resume
+
+A generation runs as its own task, independent of the HTTP response that
+started it. Every frame it produces gets a sequence number and goes into a
+bounded replay buffer, and any number of clients can follow it. A client
+that reconnects with ``Last-Event-ID`` is sent the frames after that ID and
+then follows the live stream, without a new upstream request.
+
+Event IDs have the form ``<generation id>-<seq>``. Finished generations stay
+resumable for ``stream.replay_retention`` seconds.
+
+A generation nobody follows any more is cancelled once
+``stream.disconnect_grace`` seconds pass without a client reconnecting, and
+``cancel`` stops one explicitly. Either way the upstream request is closed
+and the partial reply is saved marked as truncated.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from ..config import config_manager
+
+logger = logging.getLogger(__name__)
+
+
+class Generation:
+    def __init__(self, chat_id: str, model: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.chat_id = chat_id
+        self.model = model
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.followers = 0
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+        # Buffered frames; _base is the sequence number of _frames[0]
+        self._frames: List[str] = []
+        self._base = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def next_seq(self) -> int:
+        return self._base + len(self._frames)
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.id}-{seq}"
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, data: str):
+        """Append a frame and wake every follower"""
+        self._frames.append(data)
+        limit = config_manager.config.stream.replay_frames
+        if len(self._frames) > limit:
+            # Drop the oldest half at once so trimming stays amortized O(1)
+            drop = len(self._frames) - limit // 2
+            del self._frames[:drop]
+            self._base += drop
+        self._wake()
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+        self._wake()
+
+    async def cancel(self):
+        """Stop the generation and wait until its partial reply is saved"""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.wait({self.task})
+
+    def _follow(self):
+        self.followers += 1
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+            self._abandon_timer = None
+
+    def _unfollow(self):
+        self.followers -= 1
+        if self.followers or self.finished:
+            return
+        grace = config_manager.config.stream.disconnect_grace
+        self._abandon_timer = asyncio.get_running_loop().call_later(grace, self._abandon)
+
+    def _abandon(self):
+        self._abandon_timer = None
+        if not self.followers and self.task is not None and not self.task.done():
+            logger.info(f"No client left for chat {self.chat_id}, cancelling generation {self.id}")
+            self.task.cancel()
+
+    async def events(self, after: Optional[int] = None) -> AsyncIterator[Tuple[Optional[str], str]]:
+        """Yield ``(event_id, data)`` for frames after ``after``, then follow live
+
+        If the frames after ``after`` were already dropped from the replay
+        buffer, a single error frame without an ID is yielded instead.
+        """
+        seq = 0 if after is None else after + 1
+        self._follow()
+        try:
+            while True:
+                if seq < self._base:
+                    yield None, json.dumps({"error": "stream can no longer be resumed", "resumable": False})
+                    return
+                for data in self._frames[seq - self._base:]:
+                    yield self.event_id(seq), data
+                    seq += 1
+                if self.finished and seq >= self.next_seq:
+                    return
+                await self._changed.wait()
+        finally:
+            self._unfollow()
+
+
+# chat_id -> the chat's most recent generation
+_generations: Dict[str, Generation] = {}
+
+
+async def _run(generation: Generation, frames: AsyncIterator[str]):
+    try:
+        async for frame in frames:
+            generation.publish(frame.rstrip("\n"))
+    except asyncio.CancelledError:
+        # Cancelled before the reply started streaming
+        generation.publish(json.dumps({"done": True, "truncated": True}))
+    except Exception as e:
+        logger.error(f"Generation for chat {generation.chat_id} failed: {e}")
+        generation.publish(json.dumps({"error": str(e)}))
+
+
+async def _cleanup(generation: Generation, on_finish: Callable[[], Awaitable]):
+    try:
+        await on_finish()
+    except Exception as e:
+        logger.error(f"Cleanup after generation {generation.id} failed: {e}")
+
+
+def _finished(generation: Generation, on_finish: Optional[Callable[[], Awaitable]], task: asyncio.Task):
+    """Done callback of the generation task
+
+    Unlike a ``finally`` in ``_run`` or in ``frames``, this also runs when the
+    task is cancelled before its first step.
+    """
+    if task.cancelled():
+        generation.publish(json.dumps({"done": True, "truncated": True}))
+    generation.finish()
+    loop = asyncio.get_running_loop()
+    loop.call_later(config_manager.config.stream.replay_retention, _expire, generation)
+    if on_finish is not None:
+        asyncio.ensure_future(_cleanup(generation, on_finish))
+
+
+def _expire(generation: Generation):
+    if _generations.get(generation.chat_id) is generation:
+        del _generations[generation.chat_id]
+
+
+def start(
+    chat_id: str,
+    model: str,
+    frames: AsyncIterator[str],
+    on_finish: Optional[Callable[[], Awaitable]] = None
+) -> Generation:
+    """Run ``frames`` as the chat's current generation
+
+    ``on_finish`` is awaited once the generation ends, however it ends; use
+    it to release what the generation holds rather than a ``finally`` in
+    ``frames``, which never runs if the task is cancelled before starting.
+    """
+    generation = Generation(chat_id, model)
+    generation.task = asyncio.ensure_future(_run(generation, frames))
+    generation.task.add_done_callback(lambda task: _finished(generation, on_finish, task))
+    _generations[chat_id] = generation
+    return generation
+
+
+def get(chat_id: str) -> Optional[Generation]:
+    """The chat's current or recently finished generation"""
+    return _generations.get(chat_id)
+
+
+def parse_event_id(event_id: str) -> Optional[Tuple[str, int]]:
+    """Split an event ID into generation ID and sequence number"""
+    generation_id, _, seq = event_id.strip().rpartition("-")
+    if not generation_id or not seq.isdigit():
+        return None
+    return generation_id, int(seq)
@@ -0,0 +1,76 @@
+"""Server-side cache of conversation history sent to the model
+
+Generation goes through Ollama's ``/api/chat`` with the full message list.
+Ollama's runner keeps the KV cache of the previous request and reuses the
+longest common prefix, so as long as the history we send is byte-identical
+from turn to turn only the new tokens are evaluated. This cache keeps that
+history in memory for recently active chats, so a turn neither re-reads the
+message log nor risks drifting from what was sent last time.
+
+Loading a chat reads storage off the event loop. A message appended while a
+load is in flight may or may not be part of its result, so such a load is
+returned but not cached.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Set
+from ..config import config_manager
+from . import persistence
+
+# Roles Ollama's chat API accepts; anything else in the log is not history
+CHAT_ROLES = {"system", "user", "assistant"}
+
+_cache: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+# Chats being loaded, and those of them that changed during the load
+_loading: Dict[str, int] = {}
+_changed: Set[str] = set()
+
+def _to_chat_message(message: dict) -> Dict[str, str]:
+    return {"role": message.get("role"), "content": message.get("content") or ""}
+
+async def _load(chat_id: str) -> List[Dict[str, str]]:
+    # Includes messages still waiting in the write-behind queue
+    return [
+        _to_chat_message(message)
+        for message in await persistence.load(chat_id)
+        if message.get("role") in CHAT_ROLES
+    ]
+
+async def get_messages(chat_id: str) -> List[Dict[str, str]]:
+    """Return the chat history in Ollama's message format
+
+    The returned list is a copy; callers may extend it freely.
+    """
+    messages = _cache.get(chat_id)
+    if messages is not None:
+        _cache.move_to_end(chat_id)
+        return list(messages)
+
+    _loading[chat_id] = _loading.get(chat_id, 0) + 1
+    try:
+        messages = await _load(chat_id)
+    finally:
+        _loading[chat_id] -= 1
+        if not _loading[chat_id]:
+            del _loading[chat_id]
+        changed = chat_id in _changed
+        if chat_id not in _loading:
+            _changed.discard(chat_id)
+    if not changed:
+        _cache[chat_id] = messages
+        while len(_cache) > config_manager.config.context.history_cache_size:
+            _cache.popitem(last=False)
+    return list(messages)
+
+def append(chat_id: str, message: dict) -> None:
+    """Record a newly saved message in the cached history, if present"""
+    if chat_id in _loading:
+        _changed.add(chat_id)
+    messages = _cache.get(chat_id)
+    if messages is not None and message.get("role") in CHAT_ROLES:
+        messages.append(_to_chat_message(message))
+
+def forget(chat_id: str) -> None:
+    """Drop a chat from the cache"""
+    if chat_id in _loading:
+        _changed.add(chat_id)
+    _cache.pop(chat_id, None)
@@ -0,0 +1,321 @@
+"""Append-only per-chat message log
+
+Each chat directory holds ``chat.jsonl`` with one JSON message per line and
+``chat.idx`` with the byte offset of every line packed as little-endian
+unsigned 64-bit integers. Appending a message writes one line and one offset,
+and message ``n`` can be located with a single seek into the index.
+
+Chats created before the log existed store a pretty-printed ``chat.json``
+array; it is converted the first time the chat is touched.
+
+Cold chats keep their log gzip-compressed as ``chat.jsonl.gz`` (see
+``compress``). The index is left uncompressed and still holds offsets into
+the uncompressed log, so counting stays a stat and reads decompress on the
+fly. The next append promotes the chat back to a plain log.
+"""
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+from typing import Iterator, List, Optional
+from ..utils.metrics import Counter, Histogram
+
+LOG_FILE = "chat.jsonl"
+INDEX_FILE = "chat.idx"
+LEGACY_FILE = "chat.json"
+COLD_FILE = "chat.jsonl.gz"
+
+# Serializes appends with the swap between plain and compressed logs
+_tier_lock = threading.Lock()
+
+_OFFSET = struct.Struct("<Q")
+
+FILE_SECONDS = Histogram("chat_file_seconds", "Time spent reading or appending chat logs", ["op"])
+FILE_BYTES = Counter("chat_file_bytes_total", "Bytes read from or appended to chat logs", ["op"])
+TIER_CHANGES = Counter("chat_tier_changes_total", "Chats moved to the compressed (cold) or plain (hot) tier", ["to"])
+
+
+def encode_message(message: dict) -> bytes:
+    """Serialize a message as a single log line"""
+    return (json.dumps(message, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def exists(chat_dir: str) -> bool:
+    """Check whether a chat directory holds a log, in either format"""
+    return (
+        os.path.exists(os.path.join(chat_dir, LOG_FILE))
+        or os.path.exists(os.path.join(chat_dir, COLD_FILE))
+        or os.path.exists(os.path.join(chat_dir, LEGACY_FILE))
+    )
+
+
+def _open_log(chat_dir: str):
+    """Open the log for reading, decompressing a cold log as it is read
+
+    Call with _tier_lock held, so an append cannot promote the chat between
+    choosing the file and opening it. The open file stays readable after
+    a later swap removes it.
+    """
+    try:
+        return open(os.path.join(chat_dir, LOG_FILE), "rb")
+    except FileNotFoundError:
+        return gzip.open(os.path.join(chat_dir, COLD_FILE), "rb")
+
+
+def create(chat_dir: str) -> None:
+    """Create an empty log and index"""
+    with open(os.path.join(chat_dir, LOG_FILE), "wb"):
+        pass
+    with open(os.path.join(chat_dir, INDEX_FILE), "wb"):
+        pass
+
+
+def migrate_legacy(chat_dir: str) -> bool:
+    """Convert a legacy ``chat.json`` into the log format
+
+    The new files are written under temporary names and moved into place
+    before the legacy file is removed, so an interrupted migration is simply
+    retried on the next access. Returns True if a migration happened.
+    """
+    legacy_file = os.path.join(chat_dir, LEGACY_FILE)
+    log_file = os.path.join(chat_dir, LOG_FILE)
+    if not os.path.exists(legacy_file) or os.path.exists(log_file):
+        return False
+
+    with open(legacy_file, "r", encoding="utf-8") as f:
+        messages = json.load(f)
+
+    tmp_log = log_file + ".tmp"
+    tmp_index = os.path.join(chat_dir, INDEX_FILE) + ".tmp"
+    with open(tmp_log, "wb") as log, open(tmp_index, "wb") as index:
+        offset = 0
+        for message in messages:
+            line = encode_message(message)
+            log.write(line)
+            index.write(_OFFSET.pack(offset))
+            offset += len(line)
+
+    os.replace(tmp_index, os.path.join(chat_dir, INDEX_FILE))
+    os.replace(tmp_log, log_file)
+    os.remove(legacy_file)
+    return True
+
+
+def rebuild_index(chat_dir: str) -> None:
+    """Regenerate ``chat.idx`` by scanning the log; call with _tier_lock held"""
+    tmp_index = os.path.join(chat_dir, INDEX_FILE) + ".tmp"
+    with _open_log(chat_dir) as log, open(tmp_index, "wb") as index:
+        offset = 0
+        for line in log:
+            if line.endswith(b"\n"):
+                index.write(_OFFSET.pack(offset))
+            offset += len(line)
+    os.replace(tmp_index, os.path.join(chat_dir, INDEX_FILE))
+
+
+def _ensure_log(chat_dir: str) -> None:
+    """Make sure the chat has a log and index, migrating or repairing it if needed
+
+    Readers only take _tier_lock when there is something to fix, so two
+    first reads of a legacy chat do not both migrate it.
+    """
+    index_file = os.path.join(chat_dir, INDEX_FILE)
+    if os.path.exists(index_file) and not os.path.exists(os.path.join(chat_dir, LEGACY_FILE)):
+        return
+    with _tier_lock:
+        _prepare_log(chat_dir)
+
+
+def _prepare_log(chat_dir: str) -> None:
+    """Migrate a legacy chat and rebuild a missing index; call with _tier_lock held"""
+    migrate_legacy(chat_dir)
+    log_file = os.path.join(chat_dir, LOG_FILE)
+    if not os.path.exists(log_file) and not os.path.exists(os.path.join(chat_dir, COLD_FILE)):
+        raise FileNotFoundError(log_file)
+    if not os.path.exists(os.path.join(chat_dir, INDEX_FILE)):
+        rebuild_index(chat_dir)
+
+
+def compress(chat_dir: str, level: int = 6) -> Optional[int]:
+    """Move a chat's log to the compressed cold tier
+
+    The log is compressed next to the original, and the swap only happens if
+    no append arrived in the meantime. Returns the bytes saved, or None if
+    the chat was not compressed.
+    """
+    with _tier_lock:
+        migrate_legacy(chat_dir)
+    log_file = os.path.join(chat_dir, LOG_FILE)
+    cold_file = os.path.join(chat_dir, COLD_FILE)
+    try:
+        size = os.path.getsize(log_file)
+    except FileNotFoundError:
+        return None
+
+    tmp_cold = cold_file + ".tmp"
+    with open(log_file, "rb") as log, open(tmp_cold, "wb") as out:
+        with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=level, mtime=0) as gz:
+            remaining = size
+            while remaining:
+                chunk = log.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                gz.write(chunk)
+                remaining -= len(chunk)
+        out.flush()
+        os.fsync(out.fileno())
+
+    with _tier_lock:
+        if os.path.getsize(log_file) != size:
+            os.remove(tmp_cold)
+            return None
+        os.replace(tmp_cold, cold_file)
+        os.remove(log_file)
+        saved = size - os.path.getsize(cold_file)
+    TIER_CHANGES.labels("cold").inc()
+    return saved
+
+
+def _promote(chat_dir: str) -> bool:
+    """Restore a cold chat's plain log; call with _tier_lock held"""
+    log_file = os.path.join(chat_dir, LOG_FILE)
+    cold_file = os.path.join(chat_dir, COLD_FILE)
+    if not os.path.exists(cold_file):
+        return False
+    if not os.path.exists(log_file):
+        tmp_log = log_file + ".tmp"
+        with gzip.open(cold_file, "rb") as gz, open(tmp_log, "wb") as log:
+            while True:
+                chunk = gz.read(1 << 20)
+                if not chunk:
+                    break
+                log.write(chunk)
+        os.replace(tmp_log, log_file)
+    # A plain log next to a compressed one is the newer copy
+    os.remove(cold_file)
+    TIER_CHANGES.labels("hot").inc()
+    return True
+
+
+def _repair_tail(chat_dir: str) -> None:
+    """Bring the index back in line with the log after an interrupted append
+
+    Only the last indexed message is read, so this stays cheap on long chats.
+    A torn final line is truncated and unindexed complete lines are indexed.
+    """
+    log_file = os.path.join(chat_dir, LOG_FILE)
+    index_file = os.path.join(chat_dir, INDEX_FILE)
+    index_size = os.path.getsize(index_file)
+    last_offset = 0
+    if index_size >= _OFFSET.size:
+        with open(index_file, "rb") as index:
+            index.seek(index_size - index_size % _OFFSET.size - _OFFSET.size)
+            (last_offset,) = _OFFSET.unpack(index.read(_OFFSET.size))
+
+    with open(log_file, "rb") as log:
+        log.seek(last_offset)
+        tail = log.read()
+
+    consistent = index_size % _OFFSET.size == 0 and (
+        tail.count(b"\n") == 1 and tail.endswith(b"\n")
+        if index_size
+        else not tail
+    )
+    if consistent:
+        return
+
+    if tail and not tail.endswith(b"\n"):
+        with open(log_file, "r+b") as log:
+            log.truncate(last_offset + tail.rfind(b"\n") + 1)
+    rebuild_index(chat_dir)
+
+
+def append_many(chat_dir: str, messages: List[dict]) -> int:
+    """Append messages with one write per file and return the first one's seq"""
+    started = time.perf_counter()
+    lines = [encode_message(message) for message in messages]
+    with _tier_lock:
+        _prepare_log(chat_dir)
+        _promote(chat_dir)
+        _repair_tail(chat_dir)
+        with open(os.path.join(chat_dir, LOG_FILE), "ab") as log:
+            offset = log.seek(0, os.SEEK_END)
+            log.write(b"".join(lines))
+        offsets = []
+        for line in lines:
+            offsets.append(_OFFSET.pack(offset))
+            offset += len(line)
+        with open(os.path.join(chat_dir, INDEX_FILE), "ab") as index:
+            seq = index.seek(0, os.SEEK_END) // _OFFSET.size
+            index.write(b"".join(offsets))
+    FILE_SECONDS.labels("write").observe(time.perf_counter() - started)
+    FILE_BYTES.labels("write").inc(sum(len(line) for line in lines))
+    return seq
+
+
+def append(chat_dir: str, message: dict) -> int:
+    """Append a message and return its sequence number"""
+    return append_many(chat_dir, [message])
+
+
+def sync(chat_dir: str) -> None:
+    """Flush the log and index to stable storage"""
+    for name in (LOG_FILE, INDEX_FILE):
+        fd = os.open(os.path.join(chat_dir, name), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def count(chat_dir: str) -> int:
+    """Number of messages in the log"""
+    _ensure_log(chat_dir)
+    return os.path.getsize(os.path.join(chat_dir, INDEX_FILE)) // _OFFSET.size
+
+
+def iter_raw(chat_dir: str, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+    """Yield encoded messages ``start <= seq < stop`` without parsing them
+
+    The starting offset is read from the index, so the cost depends on the
+    number of messages returned rather than on the size of the chat. Only
+    time spent in file reads is recorded, not time spent by the consumer.
+    """
+    started = time.perf_counter()
+    _ensure_log(chat_dir)
+    total = os.path.getsize(os.path.join(chat_dir, INDEX_FILE)) // _OFFSET.size
+    stop = total if stop is None else min(stop, total)
+    if start >= stop:
+        return
+
+    with open(os.path.join(chat_dir, INDEX_FILE), "rb") as index:
+        index.seek(start * _OFFSET.size)
+        (offset,) = _OFFSET.unpack(index.read(_OFFSET.size))
+
+    elapsed = time.perf_counter() - started
+    read = 0
+    try:
+        # Seeking a compressed log decompresses up to the offset
+        with _tier_lock:
+            log = _open_log(chat_dir)
+        with log:
+            log.seek(offset)
+            for _ in range(stop - start):
+                read_started = time.perf_counter()
+                line = log.readline()
+                elapsed += time.perf_counter() - read_started
+                if not line:
+                    break
+                read += len(line)
+                yield line.rstrip(b"\n")
+    finally:
+        FILE_SECONDS.labels("read").observe(elapsed)
+        FILE_BYTES.labels("read").inc(read)
+
+
+def iter_messages(chat_dir: str, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+    """Yield decoded messages ``start <= seq < stop``"""
+    for line in iter_raw(chat_dir, start, stop):
+        yield json.loads(line)
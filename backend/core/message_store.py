@@ -0,0 +1,204 @@
+"""Where chat messages are stored
+
+``storage.messages_backend`` selects between two stores:
+- ``files`` (default): one append-only log per chat directory, see
+  ``message_log``;
+- ``sqlite``: the ``messages`` table in the main database, keyed on
+  ``(chat_id, seq)``. Creating a chat needs no directory, and counting,
+  paging and deleting a chat's messages are single indexed queries.
+
+Both hand out messages encoded exactly as the log stores them, so callers
+do not care which one is active. Run
+
+    python -m backend.core.message_store migrate
+
+to copy the logs of every chat into the table, then switch the backend. The
+import streams one batch at a time and can be re-run safely; the logs are
+left in place.
+"""
+import os
+import sqlite3
+import sys
+from typing import Iterator, List, Optional, Tuple
+from ..config import config_manager
+from ..database.connection import db
+from . import message_log
+
+# Messages read or written per query when streaming
+BATCH_SIZE = 500
+
+# Message fields in the order save_message builds them
+_COLUMNS = "role, content, model, created_at, truncated"
+
+
+def create_table(conn) -> None:
+    """Create the messages table; its primary key is the (chat_id, seq) index"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            chat_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            model TEXT,
+            created_at TEXT,
+            truncated INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, seq)
+        ) WITHOUT ROWID
+    ''')
+
+
+def uses_sqlite() -> bool:
+    return config_manager.config.storage.messages_backend == "sqlite"
+
+
+def chat_path(chat_id: str) -> str:
+    return os.path.join(config_manager.config.storage.chat_dir, chat_id)
+
+
+def _to_message(row) -> dict:
+    message = {"role": row[0], "content": row[1], "model": row[2], "created_at": row[3]}
+    if row[4]:
+        message["truncated"] = True
+    return message
+
+
+def _to_row(chat_id: str, seq: int, message: dict) -> tuple:
+    return (
+        chat_id, seq, message.get("role"), message.get("content") or "",
+        message.get("model"), message.get("created_at"), 1 if message.get("truncated") else 0
+    )
+
+
+def create(chat_id: str) -> None:
+    """Set up storage for a new chat"""
+    if uses_sqlite():
+        return
+    path = chat_path(chat_id)
+    os.makedirs(path, exist_ok=True)
+    message_log.create(path)
+
+
+def exists(chat_id: str) -> bool:
+    """Check whether a chat's message storage is present"""
+    # Rows need no setup, so a chat in the database always has storage
+    return uses_sqlite() or message_log.exists(chat_path(chat_id))
+
+
+def delete_rows(conn, chat_id: str) -> None:
+    """Delete a chat's messages within the caller's transaction"""
+    if uses_sqlite():
+        conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+
+
+async def count(chat_id: str) -> int:
+    """Number of messages in a chat; raises FileNotFoundError for unknown chats"""
+    if uses_sqlite():
+        row = await db.fetchone(
+            "SELECT (SELECT COUNT(*) FROM messages WHERE chat_id = ?), EXISTS (SELECT 1 FROM chats WHERE id = ?)",
+            (chat_id, chat_id)
+        )
+        if not row[1]:
+            raise FileNotFoundError(chat_id)
+        return row[0]
+    return message_log.count(chat_path(chat_id))
+
+
+def read_rows(conn, chat_id: str, start: int = 0, stop: Optional[int] = None) -> List[dict]:
+    """Messages ``start <= seq < stop`` from the table"""
+    sql = f"SELECT {_COLUMNS} FROM messages WHERE chat_id = ? AND seq >= ?"
+    params = [chat_id, start]
+    if stop is not None:
+        sql += " AND seq < ?"
+        params.append(stop)
+    return [_to_message(row) for row in conn.execute(sql + " ORDER BY seq", params)]
+
+
+def iter_all(conn) -> Iterator[Tuple[str, int, dict]]:
+    """Yield ``(chat_id, seq, message)`` for every row in key order"""
+    for row in conn.execute(f"SELECT chat_id, seq, {_COLUMNS} FROM messages ORDER BY chat_id, seq"):
+        yield row[0], row[1], _to_message(row[2:])
+
+
+def iter_messages(chat_id: str, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+    """Yield decoded messages ``start <= seq < stop``
+
+    The table is read in batches so no connection is held between them.
+    """
+    if not uses_sqlite():
+        yield from message_log.iter_messages(chat_path(chat_id), start, stop)
+        return
+    while stop is None or start < stop:
+        end = start + BATCH_SIZE if stop is None else min(stop, start + BATCH_SIZE)
+        batch = db.run_sync(read_rows, chat_id, start, end)
+        yield from batch
+        if len(batch) < end - start:
+            return
+        start = end
+
+
+def iter_raw(chat_id: str, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+    """Yield messages ``start <= seq < stop`` encoded as log lines"""
+    if not uses_sqlite():
+        yield from message_log.iter_raw(chat_path(chat_id), start, stop)
+        return
+    for message in iter_messages(chat_id, start, stop):
+        yield message_log.encode_message(message).rstrip(b"\n")
+
+
+def insert_rows(conn, chat_id: str, messages: List[dict]) -> int:
+    """Append messages to a chat's rows and return the first one's seq"""
+    row = conn.execute("SELECT MAX(seq) FROM messages WHERE chat_id = ?", (chat_id,)).fetchone()
+    seq = 0 if row[0] is None else row[0] + 1
+    conn.executemany(
+        f"INSERT INTO messages (chat_id, seq, {_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [_to_row(chat_id, seq + offset, message) for offset, message in enumerate(messages)]
+    )
+    return seq
+
+
+def migrate(conn: sqlite3.Connection, chat_dir: str) -> int:
+    """Copy every chat's log into the messages table, one batch at a time"""
+    create_table(conn)
+    chat_ids = [row[0] for row in conn.execute("SELECT id FROM chats")]
+    imported = 0
+    batch = []
+    for chat_id in chat_ids:
+        path = os.path.join(chat_dir, chat_id)
+        if not message_log.exists(path):
+            continue
+        for seq, message in enumerate(message_log.iter_messages(path)):
+            batch.append(_to_row(chat_id, seq, message))
+            if len(batch) >= BATCH_SIZE:
+                imported += _insert_batch(conn, batch)
+                batch = []
+    if batch:
+        imported += _insert_batch(conn, batch)
+    return imported
+
+
+def _insert_batch(conn: sqlite3.Connection, batch: List[tuple]) -> int:
+    # Rows already imported by an earlier run keep their primary key and are skipped
+    cursor = conn.executemany(
+        f"INSERT OR IGNORE INTO messages (chat_id, seq, {_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        batch
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def main(argv: List[str]) -> int:
+    if argv[1:] != ["migrate"]:
+        print("Usage: python -m backend.core.message_store migrate")
+        return 2
+    config = config_manager.config
+    conn = sqlite3.connect(config.storage.database)
+    try:
+        count = migrate(conn, config.storage.chat_dir)
+    finally:
+        conn.close()
+    print(f"Imported {count} messages; set storage.messages_backend to \"sqlite\" to use them")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,49 +1,291 @@
+import asyncio
+import logging
+import time
 import httpx
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Union
 from fastapi import HTTPException
 from ..config import config_manager
+from ..utils.metrics import Histogram
+from ..utils.timing import span
+
+logger = logging.getLogger(__name__)
+
+# Application-scoped client so connections to Ollama are pooled and kept alive
+_client: Optional[httpx.AsyncClient] = None
+# Clients replaced after a settings change; each is closed once its last
+# in-flight request finishes
+_retired_clients: List[httpx.AsyncClient] = []
+# Client -> number of requests or response streams still using it
+_users: Dict[httpx.AsyncClient, int] = {}
+
+# Last good /api/tags result, when it was fetched, and the in-flight refresh
+_models_cache: Optional[dict] = None
+_models_fetched_at: float = 0
+_models_refresh: Optional[asyncio.Task] = None
+
+UPSTREAM_CONNECT = Histogram(
+    "ollama_upstream_connect_seconds", "Time until Ollama returns response headers for a generation", ["model"]
+)
+
+# Model name -> monotonic time of its last generation request
+last_used: Dict[str, float] = {}
+
+def _build_client() -> httpx.AsyncClient:
+    """Create a pooled client from the current Ollama configuration"""
+    ollama = config_manager.config.ollama
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=ollama.max_connections,
+            max_keepalive_connections=ollama.max_keepalive_connections,
+            keepalive_expiry=ollama.keepalive_expiry
+        ),
+        timeout=httpx.Timeout(
+            ollama.read_timeout,
+            connect=ollama.connect_timeout
+        )
+    )
+
+_client_stale = False
+
+def _on_config_change(old, new):
+    """Rebuild the client on next use when the Ollama settings change
+
+    Config subscribers may run on the watcher thread, so this only flags the
+    client; the swap itself happens on the event loop in get_client.
+    """
+    global _client_stale
+    if old.ollama != new.ollama:
+        _client_stale = True
+
+config_manager.subscribe(_on_config_change)
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared client, creating it on first use"""
+    global _client, _client_stale
+    if _client_stale:
+        _client_stale = False
+        _replace_client()
+    elif _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+async def start_client():
+    """Open the shared client at application startup"""
+    get_client()
+
+async def close_client():
+    """Close the shared client and its pooled connections"""
+    global _client
+    clients = _retired_clients[:]
+    _retired_clients.clear()
+    if _client is not None:
+        clients.append(_client)
+        _client = None
+    for client in clients:
+        await client.aclose()
+
+def _replace_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        if _users.get(_client):
+            _retired_clients.append(_client)
+        else:
+            asyncio.ensure_future(_client.aclose())
+    _client = _build_client()
+    invalidate_models()
+
+def _acquire() -> httpx.AsyncClient:
+    client = get_client()
+    _users[client] = _users.get(client, 0) + 1
+    return client
+
+async def _release(client: httpx.AsyncClient):
+    remaining = _users.pop(client) - 1
+    if remaining:
+        _users[client] = remaining
+    elif client in _retired_clients:
+        _retired_clients.remove(client)
+        await client.aclose()
+
+@asynccontextmanager
+async def borrow_client() -> AsyncIterator[httpx.AsyncClient]:
+    """Use the shared client for requests that complete within the block
+
+    A client retired by a settings change meanwhile is closed on exit.
+    """
+    client = _acquire()
+    try:
+        yield client
+    finally:
+        await _release(client)
+
+class _ClientStream(httpx.AsyncByteStream):
+    """Streaming response body that hands its client back once closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, client: httpx.AsyncClient):
+        self._stream = stream
+        self._client = client
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            await _release(self._client)
+
+def invalidate_models():
+    """Forget the cached model list, e.g. after the Ollama host changes"""
+    global _models_cache, _models_fetched_at
+    _models_cache = None
+    _models_fetched_at = 0
+
+def _model_info(model: dict) -> dict:
+    """Pick the fields of an /api/tags entry that the UI cares about"""
+    details = model.get("details") or {}
+    return {
+        "name": model["name"],
+        "size": model.get("size"),
+        "modified_at": model.get("modified_at"),
+        "family": details.get("family"),
+        "parameter_size": details.get("parameter_size"),
+        "quantization_level": details.get("quantization_level")
+    }
+
+async def _fetch_models() -> dict:
+    """Fetch the model list from Ollama and store it as the last good result"""
+    global _models_cache, _models_fetched_at
+    config = config_manager.config
+    async with borrow_client() as client:
+        response = await client.get(f"{config.ollama.host}/api/tags")
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Failed to get models from Ollama service: {response.text}")
+    models = response.json()["models"]
+    _models_cache = {
+        "models": [model["name"] for model in models],
+        "details": [_model_info(model) for model in models]
+    }
+    _models_fetched_at = time.monotonic()
+    return _models_cache
+
+def _log_refresh_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Error connecting to Ollama service: {task.exception()}")
+
+def _refresh_models() -> asyncio.Task:
+    """Start a model list refresh, or join the one already in flight"""
+    global _models_refresh
+    if _models_refresh is None or _models_refresh.done():
+        _models_refresh = asyncio.ensure_future(_fetch_models())
+        _models_refresh.add_done_callback(_log_refresh_error)
+    return _models_refresh
 
 async def get_models():
-    """Get available models from Ollama service"""
+    """Get available models from Ollama service
+
+    Results are cached for ``ollama.models_cache_ttl`` seconds. A stale entry
+    is returned immediately while a background refresh runs, concurrent
+    callers share one upstream request, and the last good list is kept when
+    Ollama is unreachable.
+    """
+    if _models_cache is not None:
+        if time.monotonic() - _models_fetched_at >= config_manager.config.ollama.models_cache_ttl:
+            _refresh_models()
+        return _models_cache
+
     try:
-        config = config_manager.config
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{config.ollama.host}/api/tags")
-            if response.status_code == 200:
-                models = response.json()
-                return {"models": [model["name"] for model in models["models"]]}
-            else:
-                raise HTTPException(status_code=502, detail=f"Failed to get models from Ollama service: {response.text}")
-    except Exception as e:
-        print(f"Error connecting to Ollama service: {str(e)}")
-        return {"models": []}  # 返回空列表而不是默认配置
+        # Shield so one cancelled caller does not abort the shared fetch
+        return await asyncio.shield(_refresh_models())
+    except Exception:
+        return {"models": [], "details": []}  # 返回空列表而不是默认配置
+
+# Sampling options for chat replies
+GENERATION_OPTIONS = {
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "top_k": 40,
+    "num_predict": 4096
+}
+
+def keep_alive(model: str) -> Union[str, int]:
+    """How long Ollama should keep a model loaded after a request"""
+    residency = config_manager.config.residency
+    if model in residency.model_keep_alive:
+        return residency.model_keep_alive[model]
+    if model in hot_models():
+        return residency.hot_keep_alive
+    return residency.keep_alive
+
+def hot_models() -> List[str]:
+    """The default model followed by the configured hot set"""
+    config = config_manager.config
+    models = [config.models.default] if config.models.default else []
+    return models + [m for m in config.residency.hot_models if m not in models]
+
+async def complete(model: str, messages: List[Dict[str, str]], options: Optional[dict] = None) -> str:
+    """Run a non-streaming chat completion and return the reply text"""
+    config = config_manager.config
+    payload = {"model": model, "messages": messages, "stream": False, "keep_alive": keep_alive(model)}
+    last_used[model] = time.monotonic()
+    if options:
+        payload["options"] = options
+    async with borrow_client() as client:
+        response = await client.post(f"{config.ollama.host}/api/chat", json=payload)
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Failed to generate response: {response.text}")
+    return response.json().get("message", {}).get("content", "")
+
+async def generate_response(
+    model: str,
+    messages: List[Dict[str, str]],
+    options: Optional[dict] = None
+) -> httpx.Response:
+    """Generate response from Ollama
 
-async def generate_response(model: str, prompt: str) -> httpx.Response:
-    """Generate response from Ollama"""
+    ``messages`` is the conversation so far, ending with the new user turn,
+    and ``options`` defaults to GENERATION_OPTIONS. The returned response is
+    still streaming; the caller reads it once and must close it with
+    ``aclose()``.
+    """
     try:
         config = config_manager.config
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{config.ollama.host}/api/generate",
+        last_used[model] = time.monotonic()
+        client = _acquire()
+        try:
+            request = client.build_request(
+                "POST",
+                f"{config.ollama.host}/api/chat",
                 json={
                     "model": model,
-                    "prompt": prompt,
+                    "messages": messages,
                     "stream": True,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "top_k": 40,
-                        "num_predict": 4096
-                    }
-                },
-                timeout=60.0
+                    "keep_alive": keep_alive(model),
+                    "options": GENERATION_OPTIONS if options is None else options
+                }
             )
+            sent_at = time.perf_counter()
+            with span("ollama_connect"):
+                response = await client.send(request, stream=True)
+        except BaseException:
+            await _release(client)
+            raise
+        # Closing the response releases the client
+        response.stream = _ClientStream(response.stream, client)
+        UPSTREAM_CONNECT.labels(model).observe(time.perf_counter() - sent_at)
+        
+        if response.status_code != 200:
+            await response.aread()
+            await response.aclose()
+            error_msg = f"Failed to generate response: {response.text}"
+            raise HTTPException(status_code=502, detail=error_msg)
             
-            if response.status_code != 200:
-                error_msg = f"Failed to generate response: {response.text}"
-                raise HTTPException(status_code=502, detail=error_msg)
-                
-            return response
+        return response
             
+    except HTTPException:
+        raise
     except httpx.HTTPError as e:
         error_msg = f"Failed to connect to Ollama service: {str(e)}"
         raise HTTPException(status_code=502, detail=error_msg)
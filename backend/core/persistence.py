@@ -0,0 +1,291 @@
+"""Write-behind persistence of chat messages
+
+``save_message`` hands messages to a single writer task through a bounded
+queue instead of touching storage inside the request. The writer takes
+everything that has queued up, appends each chat's messages to its log with
+one write per file, fsyncs the touched logs once, and applies all metadata and
+search index updates in one SQLite transaction. Flushes are at least
+``persistence.flush_interval_ms`` apart, so under load more messages share
+each commit.
+
+With the ``sqlite`` messages backend the rows are inserted in that same
+transaction instead, so there is no separate file write at all. With log
+files, a failed metadata update is only logged: the messages are already
+durable, and the consistency check in ``chat_index`` reports the drift.
+
+With ``persistence.ack: queued`` a save returns as soon as the message is
+queued; with ``flushed`` it returns once the batch holding it is committed.
+``load`` includes queued messages so history reads never miss them, and
+``stop`` drains the queue on shutdown.
+
+``_lock`` only guards the queued-message bookkeeping and is never held
+during I/O. The writer assigns each message its seq before the message can
+show up in storage, so ``load`` reads storage without the lock and drops the
+queued messages the read already covers.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Set
+from ..config import config_manager
+from ..database import search
+from ..database.connection import db
+from ..database.init import NOW, message_preview
+from ..utils.metrics import Gauge, Histogram
+from . import message_log, message_store
+
+logger = logging.getLogger(__name__)
+
+QUEUED_MESSAGES = Gauge("persistence_queued_messages", "Messages waiting to be written")
+FLUSH_SECONDS = Histogram("persistence_flush_seconds", "Time to write and commit one batch of messages")
+BATCH_MESSAGES = Histogram(
+    "persistence_batch_messages", "Messages written per flush",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+
+
+class _Entry:
+    __slots__ = ("chat_id", "message", "future", "seq", "error")
+
+    def __init__(self, chat_id: str, message: dict, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.message = message
+        self.future = future
+        self.seq: Optional[int] = None
+        self.error: Optional[Exception] = None
+
+
+_queue: Optional[asyncio.Queue] = None
+_writer: Optional[asyncio.Task] = None
+# chat_id -> entries queued or being written, guarded by _lock
+_pending: Dict[str, List[_Entry]] = {}
+_lock = threading.Lock()
+# chat_id -> the chat's most recently queued entry
+_last: Dict[str, _Entry] = {}
+
+
+def _by_chat(batch: List[_Entry]) -> Dict[str, List[_Entry]]:
+    groups: Dict[str, List[_Entry]] = {}
+    for entry in batch:
+        groups.setdefault(entry.chat_id, []).append(entry)
+    return groups
+
+
+def _unqueue(chat_id: str, entries: List[_Entry]):
+    """Drop written or failed entries from the pending view"""
+    done = {id(entry) for entry in entries}
+    with _lock:
+        queued = [entry for entry in _pending.get(chat_id, ()) if id(entry) not in done]
+        if queued:
+            _pending[chat_id] = queued
+        else:
+            _pending.pop(chat_id, None)
+
+
+def _number(entries: List[_Entry], seq: int):
+    with _lock:
+        for offset, entry in enumerate(entries):
+            entry.seq = seq + offset
+
+
+def _write_logs(batch: List[_Entry]):
+    """Append the batch to the chat logs; runs on an executor thread"""
+    written = []
+    for chat_id, entries in _by_chat(batch).items():
+        path = message_store.chat_path(chat_id)
+        try:
+            # The writer is the only appender, so the log's length is the next seq
+            _number(entries, message_log.count(path))
+            seq = message_log.append_many(path, [entry.message for entry in entries])
+            if seq != entries[0].seq:
+                # Repairing a torn tail indexed lines the count did not include
+                _number(entries, seq)
+            written.append(path)
+        except Exception as e:
+            for entry in entries:
+                entry.error = e
+        finally:
+            _unqueue(chat_id, entries)
+
+    if config_manager.config.persistence.fsync:
+        for path in written:
+            message_log.sync(path)
+
+
+def _existing_chats(conn, chat_ids: Set[str]) -> Set[str]:
+    return {
+        chat_id for chat_id in chat_ids
+        if conn.execute("SELECT 1 FROM chats WHERE id = ?", (chat_id,)).fetchone() is not None
+    }
+
+
+def _record_batch(conn, entries: List[_Entry]):
+    """Update chat metadata and the search index for written messages"""
+    counts: Dict[str, int] = {}
+    last: Dict[str, dict] = {}
+    for entry in entries:
+        counts[entry.chat_id] = counts.get(entry.chat_id, 0) + 1
+        last[entry.chat_id] = entry.message
+        search.index_message(conn, entry.chat_id, entry.seq, entry.message)
+    conn.executemany(
+        "UPDATE chats SET message_count = message_count + ?, last_message_preview = ?, "
+        f"last_message_at = {NOW}, updated_at = {NOW} WHERE id = ?",
+        [(count, message_preview(last[chat_id].get("content")), chat_id) for chat_id, count in counts.items()]
+    )
+
+
+def _record_logged(conn, batch: List[_Entry]):
+    """Record messages appended to chat logs, skipping chats deleted since"""
+    written = [entry for entry in batch if entry.error is None]
+    existing = _existing_chats(conn, {entry.chat_id for entry in written})
+    _record_batch(conn, [entry for entry in written if entry.chat_id in existing])
+
+
+def _insert_batch(conn, batch: List[_Entry]):
+    """Insert the batch into the messages table along with its metadata
+
+    Entries are numbered before the commit makes them visible to ``load``.
+    """
+    try:
+        groups = _by_chat(batch)
+        existing = _existing_chats(conn, set(groups))
+        for chat_id, entries in groups.items():
+            if chat_id not in existing:
+                for entry in entries:
+                    entry.error = FileNotFoundError(f"Chat {chat_id} not found")
+                continue
+            _number(entries, message_store.insert_rows(conn, chat_id, [entry.message for entry in entries]))
+        _record_batch(conn, [entry for entry in batch if entry.error is None])
+        conn.commit()
+    finally:
+        for chat_id, entries in _by_chat(batch).items():
+            _unqueue(chat_id, entries)
+
+
+async def _flush(batch: List[_Entry]):
+    started = time.perf_counter()
+    try:
+        if message_store.uses_sqlite():
+            await db.run(_insert_batch, batch)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, _write_logs, batch)
+            try:
+                await db.run(_record_logged, batch)
+            except Exception as e:
+                # The messages are durable in their logs; only metadata lags
+                logger.error(f"Failed to update metadata for {len(batch)} written messages: {e}")
+    except Exception as e:
+        logger.error(f"Failed to persist {len(batch)} messages: {e}")
+        for entry in batch:
+            entry.error = entry.error or e
+    FLUSH_SECONDS.observe(time.perf_counter() - started)
+    BATCH_MESSAGES.observe(len(batch))
+
+    for entry in batch:
+        if entry.error is not None:
+            logger.error(f"Failed to save message to chat {entry.chat_id}: {entry.error}")
+            entry.future.set_exception(entry.error)
+            # Nobody may be waiting on the ack; the error has been logged
+            entry.future.exception()
+        else:
+            entry.future.set_result(entry.seq)
+        if _last.get(entry.chat_id) is entry:
+            del _last[entry.chat_id]
+
+
+async def _run(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        entry = await queue.get()
+        flush_started = loop.time()
+        batch = []
+        max_batch = config_manager.config.persistence.max_batch
+        while True:
+            if entry is None:
+                stopping = True
+            else:
+                batch.append(entry)
+            if stopping or len(batch) >= max_batch or queue.empty():
+                break
+            entry = queue.get_nowait()
+        QUEUED_MESSAGES.set(queue.qsize())
+        if batch:
+            await _flush(batch)
+        # Space flushes out so messages arriving meanwhile share the next one
+        delay = flush_started + config_manager.config.persistence.flush_interval_ms / 1000 - loop.time()
+        if delay > 0 and not stopping:
+            await asyncio.sleep(delay)
+
+
+def start():
+    """Start the writer task"""
+    global _queue, _writer
+    if _writer is None or _writer.done():
+        _queue = asyncio.Queue(maxsize=config_manager.config.persistence.max_queue)
+        _writer = asyncio.ensure_future(_run(_queue))
+
+
+async def stop():
+    """Write everything still queued, then stop the writer"""
+    global _queue, _writer
+    if _writer is None:
+        return
+    await _queue.put(None)
+    await _writer
+    _queue = None
+    _writer = None
+
+
+async def submit(chat_id: str, message: dict) -> Optional[int]:
+    """Queue a message for ``chat_id``'s log
+
+    Waits while the queue is full. Returns the message's seq under
+    ``ack: flushed`` and None under ``ack: queued``; a failed write raises
+    only under ``flushed``.
+    """
+    start()
+    entry = _Entry(chat_id, message, asyncio.get_running_loop().create_future())
+    with _lock:
+        _pending.setdefault(chat_id, []).append(entry)
+    _last[chat_id] = entry
+    await _queue.put(entry)
+    QUEUED_MESSAGES.set(_queue.qsize())
+    if config_manager.config.persistence.ack == "flushed":
+        return await asyncio.shield(entry.future)
+    return None
+
+
+async def flushed(chat_id: str):
+    """Wait until every message queued for ``chat_id`` has been written"""
+    entry = _last.get(chat_id)
+    if entry is not None:
+        await asyncio.wait({entry.future})
+
+
+def pending_chats() -> Set[str]:
+    """Chats with messages queued or being written"""
+    return set(_last)
+
+
+def _unwritten(queued: List[_Entry], stored: int) -> List[dict]:
+    """Queued messages not among the first ``stored`` messages in storage"""
+    return [entry.message for entry in queued if entry.seq is None or entry.seq >= stored]
+
+
+async def load(chat_id: str) -> List[dict]:
+    """All of a chat's messages, including those still queued
+
+    Storage is read off the event loop. Taking the queued entries before the
+    read means a message flushed meanwhile is found in one or the other; the
+    seqs tell which ones the read already returned.
+    """
+    with _lock:
+        queued = list(_pending.get(chat_id, ()))
+    if message_store.uses_sqlite():
+        stored = await db.run(message_store.read_rows, chat_id)
+    else:
+        loop = asyncio.get_running_loop()
+        stored = await loop.run_in_executor(None, lambda: list(message_store.iter_messages(chat_id)))
+    return stored + _unwritten(queued, len(stored))
@@ -0,0 +1,191 @@
+"""Keep frequently used models loaded in Ollama
+
+Loading a model takes seconds, and Ollama unloads a model five minutes after
+its last request unless told otherwise. At startup the default model and the
+``residency.hot_models`` set are preloaded, and every request carries a
+``keep_alive`` chosen per model (see ``ollama.keep_alive``), so hot models stay
+loaded indefinitely and others for ``residency.keep_alive``.
+
+A monitor polls ``/api/ps`` to track which models are loaded and how much
+memory they use. When ``residency.memory_budget_bytes`` is set and exceeded,
+models outside the hot set that have been idle for ``residency.idle_timeout``
+seconds are unloaded, least recently used first. A model counts as used when
+it was last sent a request or, if later, when a poll first saw it loaded, so
+a model loaded by another client is not mistaken for the idlest one.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from ..config import config_manager
+from . import ollama as ollama_service
+from . import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Model name -> /api/ps entry from the last successful poll
+_resident: Dict[str, dict] = {}
+# Model name -> when a poll first saw the current load of it
+_loaded_at: Dict[str, float] = {}
+_polled_at: Optional[float] = None
+_preloading: Dict[str, asyncio.Task] = {}
+_monitor: Optional[asyncio.Task] = None
+
+
+async def _load(model: str, keep_alive) -> None:
+    config = config_manager.config
+    # A generate request without a prompt only loads or unloads the model
+    async with ollama_service.borrow_client() as client:
+        response = await client.post(
+            f"{config.ollama.host}/api/generate",
+            json={"model": model, "keep_alive": keep_alive, "stream": False}
+        )
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Failed to load {model}: {response.text}")
+
+
+async def _preload(model: str):
+    try:
+        started = time.monotonic()
+        await _load(model, ollama_service.keep_alive(model))
+        logger.info(f"Preloaded {model} in {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        logger.warning(f"Failed to preload {model}: {e}")
+    finally:
+        _preloading.pop(model, None)
+
+
+def preload(model: str) -> asyncio.Task:
+    """Load a model in the background, joining a preload already in flight"""
+    task = _preloading.get(model)
+    if task is None:
+        task = _preloading[model] = asyncio.ensure_future(_preload(model))
+    return task
+
+
+async def unload(model: str):
+    """Ask Ollama to unload a model now"""
+    await _load(model, 0)
+    _resident.pop(model, None)
+    _loaded_at.pop(model, None)
+    logger.info(f"Unloaded idle model {model}")
+
+
+async def poll() -> Dict[str, dict]:
+    """Refresh the list of loaded models from ``/api/ps``"""
+    global _resident, _polled_at
+    config = config_manager.config
+    async with ollama_service.borrow_client() as client:
+        response = await client.get(f"{config.ollama.host}/api/ps")
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Failed to get loaded models: {response.text}")
+    _resident = {model["name"]: model for model in response.json().get("models", [])}
+    _polled_at = time.monotonic()
+    for name in list(_loaded_at):
+        if name not in _resident:
+            del _loaded_at[name]
+    for name in _resident:
+        _loaded_at.setdefault(name, _polled_at)
+    return _resident
+
+
+def _idle_for(model: str, now: float) -> Optional[float]:
+    used = max(ollama_service.last_used.get(model, 0.0), _loaded_at.get(model, 0.0))
+    return None if not used else now - used
+
+
+async def evict_idle() -> List[str]:
+    """Unload idle models outside the hot set until memory use fits the budget"""
+    budget = config_manager.config.residency.memory_budget_bytes
+    if budget <= 0:
+        return []
+    used = sum((model.get("size") or 0) for model in _resident.values())
+    if used <= budget:
+        return []
+
+    now = time.monotonic()
+    idle_timeout = config_manager.config.residency.idle_timeout
+    hot = set(ollama_service.hot_models())
+    busy = {name for name, state in scheduler.status().items() if state["active"] or state["queued"]}
+    candidates = []
+    for name, model in _resident.items():
+        idle = _idle_for(name, now)
+        if name in hot or name in busy or idle is None or idle < idle_timeout:
+            continue
+        candidates.append((idle, name, (model.get("size") or 0)))
+
+    unloaded = []
+    for _, name, size in sorted(candidates, reverse=True):
+        if used <= budget:
+            break
+        try:
+            await unload(name)
+        except Exception as e:
+            logger.warning(f"Failed to unload {name}: {e}")
+            continue
+        used -= size
+        unloaded.append(name)
+    return unloaded
+
+
+async def _monitor_loop():
+    while True:
+        try:
+            await poll()
+            await evict_idle()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Model residency check failed: {e}")
+        await asyncio.sleep(config_manager.config.residency.poll_interval)
+
+
+def start():
+    """Preload the hot models and start monitoring residency"""
+    global _monitor
+    if config_manager.config.residency.preload:
+        for model in ollama_service.hot_models():
+            preload(model)
+    if _monitor is None or _monitor.done():
+        _monitor = asyncio.ensure_future(_monitor_loop())
+
+
+async def stop():
+    """Stop the monitor and any preloads still running"""
+    global _monitor
+    tasks = list(_preloading.values())
+    if _monitor is not None:
+        tasks.append(_monitor)
+        _monitor = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def status() -> dict:
+    """Loaded models, their memory use and how long they have been idle"""
+    now = time.monotonic()
+    hot = ollama_service.hot_models()
+    models = []
+    for name, model in _resident.items():
+        idle = _idle_for(name, now)
+        models.append({
+            "name": name,
+            "size": model.get("size"),
+            "size_vram": model.get("size_vram"),
+            "expires_at": model.get("expires_at"),
+            "hot": name in hot,
+            "keep_alive": ollama_service.keep_alive(name),
+            "idle_seconds": None if idle is None else round(idle, 1)
+        })
+    return {
+        "models": models,
+        "memory_used": sum((model.get("size") or 0) for model in _resident.values()),
+        "vram_used": sum((model.get("size_vram") or 0) for model in _resident.values()),
+        "memory_budget": config_manager.config.residency.memory_budget_bytes,
+        "hot_models": hot,
+        "preloading": sorted(_preloading),
+        "checked_seconds_ago": None if _polled_at is None else round(now - _polled_at, 1),
+        "scheduler": scheduler.status()
+    }
@@ -0,0 +1,366 @@
+"""Exact-match cache of generated replies
+
+Replies are keyed on the model, the full prompt sent to ``/api/chat`` and the
+sampling options, so a hit only happens when Ollama would have received a
+byte-identical request. Entries live in an in-memory LRU backed by one JSON
+file per entry under ``response_cache.directory``; both tiers are bounded in
+bytes and entries expire after ``response_cache.ttl`` seconds.
+
+A reply sampled with ``temperature > 0`` is one draw out of many, so such
+requests bypass the cache unless ``response_cache.allow_sampling`` is set.
+The opening turn of a chat (no earlier reply, e.g. an example question) is
+the only prompt likely to repeat across chats, so while the cache is enabled
+it is generated with greedy ``OPENING_OPTIONS`` and cached regardless.
+
+Disk reads and writes run on executor threads. The entry files are scanned
+once, at startup or on first use, and their sizes tracked from then on, so a
+store does not list the directory to stay within its byte budget.
+
+Hits are replayed as Ollama NDJSON frames through the normal streaming path.
+Run ``python -m backend.core.response_cache prewarm`` to fill the cache with
+answers to the example questions.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from ..config import config_manager
+from ..database.connection import db
+from . import ollama as ollama_service
+
+logger = logging.getLogger(__name__)
+
+# Size of the text slices a cached reply is replayed in
+REPLAY_CHUNK_CHARS = 64
+
+# Deterministic options for a chat's opening turn
+OPENING_OPTIONS = {**ollama_service.GENERATION_OPTIONS, "temperature": 0}
+
+# key -> (stored_at, content)
+_memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_memory_bytes = 0
+
+# Disk tier, guarded by _disk_lock: key -> file size, least recently used
+# first, for the directory it was scanned from
+_disk_lock = threading.Lock()
+_disk_entries: "OrderedDict[str, int]" = OrderedDict()
+_disk_bytes = 0
+_disk_directory: Optional[str] = None
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], options: Optional[dict]) -> Optional[str]:
+    """Key for a generation request, or None if it must not be cached"""
+    cache_config = config_manager.config.response_cache
+    if not cache_config.enabled:
+        return None
+    if (options or {}).get("temperature", 0) > 0 and not cache_config.allow_sampling:
+        return None
+    request = json.dumps(
+        {"model": model, "messages": messages, "options": options or {}},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+def request_options(messages: List[Dict[str, str]]) -> Optional[dict]:
+    """Sampling options for a generation, or None for Ollama's defaults"""
+    if not config_manager.config.response_cache.enabled:
+        return None
+    if any(message["role"] == "assistant" for message in messages):
+        return ollama_service.GENERATION_OPTIONS
+    return OPENING_OPTIONS
+
+
+def _entry_size(content: str) -> int:
+    return len(content.encode("utf-8"))
+
+
+def _remember(key: str, stored_at: float, content: str):
+    global _memory_bytes
+    if key in _memory:
+        _memory_bytes -= _entry_size(_memory.pop(key)[1])
+    _memory[key] = (stored_at, content)
+    _memory_bytes += _entry_size(content)
+    limit = config_manager.config.response_cache.max_memory_bytes
+    while _memory_bytes > limit and _memory:
+        _, (_, evicted) = _memory.popitem(last=False)
+        _memory_bytes -= _entry_size(evicted)
+
+
+def _forget(key: str):
+    global _memory_bytes
+    entry = _memory.pop(key, None)
+    if entry is not None:
+        _memory_bytes -= _entry_size(entry[1])
+
+
+def _disk_path(key: str) -> Optional[str]:
+    directory = config_manager.config.response_cache.directory
+    return os.path.join(directory, f"{key}.json") if directory else None
+
+
+def _scan_disk(directory: str):
+    """Load the size of every entry file, oldest first; hold _disk_lock"""
+    global _disk_bytes, _disk_directory
+    entries = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+    _disk_entries.clear()
+    for _, key, size in sorted(entries):
+        _disk_entries[key] = size
+    _disk_bytes = sum(_disk_entries.values())
+    _disk_directory = directory
+
+
+def _disk_ready() -> Optional[str]:
+    """The cache directory, scanned if it has not been yet; hold _disk_lock"""
+    directory = config_manager.config.response_cache.directory
+    if directory and directory != _disk_directory:
+        _scan_disk(directory)
+    return directory or None
+
+
+def _unlink(directory: str, key: str):
+    try:
+        os.remove(os.path.join(directory, f"{key}.json"))
+    except FileNotFoundError:
+        pass
+
+
+def _remove_disk(key: str):
+    """Delete an entry file; runs on an executor thread"""
+    global _disk_bytes
+    with _disk_lock:
+        directory = _disk_ready()
+        if directory is None:
+            return
+        _disk_bytes -= _disk_entries.pop(key, 0)
+        _unlink(directory, key)
+
+
+def _read_disk(key: str) -> Optional[Tuple[float, str]]:
+    """Read an entry file; runs on an executor thread"""
+    with _disk_lock:
+        if _disk_ready() is None or key not in _disk_entries:
+            return None
+        _disk_entries.move_to_end(key)
+    path = _disk_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        # Touch the file so the next startup scan keeps the LRU order
+        os.utime(path)
+        return entry["stored_at"], entry["content"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+        _remove_disk(key)
+        return None
+
+
+def _write_disk(key: str, stored_at: float, content: str, model: str):
+    """Write an entry file and evict the oldest over budget; runs on an executor thread"""
+    global _disk_bytes
+    path = _disk_path(key)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stored_at": stored_at, "model": model, "content": content}, f, ensure_ascii=False)
+        size = os.path.getsize(tmp_path)
+        with _disk_lock:
+            directory = _disk_ready()
+            os.replace(tmp_path, path)
+            _disk_bytes += size - _disk_entries.pop(key, 0)
+            _disk_entries[key] = size
+            limit = config_manager.config.response_cache.max_disk_bytes
+            while _disk_bytes > limit and _disk_entries:
+                evicted, evicted_size = _disk_entries.popitem(last=False)
+                _disk_bytes -= evicted_size
+                _unlink(directory, evicted)
+    except OSError as e:
+        logger.warning(f"Failed to write response cache entry: {e}")
+
+
+async def start():
+    """Scan the disk tier once so later stores only update the running total"""
+    def scan():
+        with _disk_lock:
+            _disk_ready()
+
+    await asyncio.get_running_loop().run_in_executor(None, scan)
+
+
+async def get(key: str) -> Optional[str]:
+    """Cached reply for a key, promoting disk entries into memory"""
+    ttl = config_manager.config.response_cache.ttl
+    loop = asyncio.get_running_loop()
+    entry = _memory.get(key)
+    if entry is not None:
+        _memory.move_to_end(key)
+    else:
+        entry = await loop.run_in_executor(None, _read_disk, key)
+        if entry is None:
+            return None
+        _remember(key, *entry)
+
+    stored_at, content = entry
+    if time.time() - stored_at > ttl:
+        _forget(key)
+        await loop.run_in_executor(None, _remove_disk, key)
+        return None
+    return content
+
+
+def put(key: str, content: str, model: str = "") -> Optional[asyncio.Future]:
+    """Store a complete reply in memory and write it to disk in the background
+
+    Returns the future of the disk write for callers that want to wait on it.
+    """
+    if not content:
+        return None
+    stored_at = time.time()
+    _remember(key, stored_at, content)
+    return asyncio.get_running_loop().run_in_executor(None, _write_disk, key, stored_at, content, model)
+
+
+def clear():
+    """Drop every cached reply"""
+    global _memory_bytes, _disk_bytes
+    _memory.clear()
+    _memory_bytes = 0
+    with _disk_lock:
+        directory = _disk_ready()
+        if directory is not None:
+            for key in _disk_entries:
+                _unlink(directory, key)
+        _disk_entries.clear()
+        _disk_bytes = 0
+
+
+class CachedResponse:
+    """Replays a cached reply with the interface ``stream_response`` reads"""
+
+    def __init__(self, content: str):
+        self._content = content
+        self.is_closed = False
+
+    async def aiter_lines(self):
+        for start in range(0, len(self._content), REPLAY_CHUNK_CHARS):
+            chunk = self._content[start:start + REPLAY_CHUNK_CHARS]
+            yield json.dumps({"message": {"role": "assistant", "content": chunk}, "done": False})
+        yield json.dumps({"message": {"role": "assistant", "content": ""}, "done": True})
+
+    async def aclose(self):
+        self.is_closed = True
+
+
+class RecordingResponse:
+    """Wraps a streaming Ollama response and caches the reply once it is complete
+
+    Replies cut short by an error or a disconnect never reach the cache,
+    because only a ``done`` frame triggers the store.
+    """
+
+    def __init__(self, response, key: str, model: str):
+        self._response = response
+        self._key = key
+        self._model = model
+
+    @property
+    def is_closed(self) -> bool:
+        return self._response.is_closed
+
+    async def aiter_lines(self):
+        parts = []
+        async for line in self._response.aiter_lines():
+            # Store before yielding: the reader stops pulling after the done frame
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and "error" not in data:
+                parts.append((data.get("message") or {}).get("content") or "")
+                if data.get("done"):
+                    put(self._key, "".join(parts), self._model)
+            yield line
+
+    async def aclose(self):
+        await self._response.aclose()
+
+
+async def lookup(model: str, messages: List[Dict[str, str]]) -> Optional[CachedResponse]:
+    """Replay of a cached reply to this request, or None on a miss"""
+    key = cache_key(model, messages, request_options(messages))
+    if key is None:
+        return None
+    content = await get(key)
+    return CachedResponse(content) if content is not None else None
+
+
+async def generate(model: str, messages: List[Dict[str, str]]):
+    """Start a generation on Ollama, caching the reply if the request allows it"""
+    options = request_options(messages)
+    response = await ollama_service.generate_response(model, messages, options)
+    key = cache_key(model, messages, options)
+    return response if key is None else RecordingResponse(response, key, model)
+
+
+async def prewarm(models: List[str]) -> int:
+    """Answer every example question on each model and cache the replies
+
+    The prompt and options match what a new chat without a role sends for its
+    first message, so clicking an example question hits the cache.
+    """
+    questions = [row[0] for row in await db.fetchall("SELECT content FROM example_questions ORDER BY order_num")]
+    stored = 0
+    for model in models:
+        for question in questions:
+            messages = [{"role": "user", "content": question}]
+            options = request_options(messages)
+            key = cache_key(model, messages, options)
+            if key is None:
+                raise RuntimeError("response_cache is disabled; set response_cache.enabled")
+            if await get(key) is not None:
+                continue
+            write = put(key, await ollama_service.complete(model, messages, options), model)
+            if write is not None:
+                await write
+            stored += 1
+    return stored
+
+
+async def _run_prewarm(models: List[str]) -> int:
+    try:
+        return await prewarm(models)
+    finally:
+        await ollama_service.close_client()
+        db.close()
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 2 or argv[1] != "prewarm":
+        print("Usage: python -m backend.core.response_cache prewarm [model ...]")
+        return 2
+    models = argv[2:] or [config_manager.config.models.default]
+    try:
+        stored = asyncio.run(_run_prewarm(models))
+    except RuntimeError as e:
+        print(e)
+        return 1
+    print(f"Cached {stored} replies")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,105 @@
+"""Role lookup for generation
+
+Role rows are cached in memory after the first read; the roles API
+invalidates the cache whenever a role is created, updated or deleted.
+
+Switching a chat to a role with a long system prompt would make the next
+turn evaluate that prompt from scratch. ``warm_prefix`` sends the system
+prompt alone to the model in the background, so Ollama already holds its KV
+state when the user's first message arrives. Warming only uses a free
+scheduler slot and is skipped while the model is busy.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from ..config import config_manager
+from ..database.connection import db
+from . import ollama as ollama_service
+from . import scheduler
+
+logger = logging.getLogger(__name__)
+
+_roles: Optional[Dict[str, dict]] = None
+# Bumped by invalidate so a load that raced with a change is not cached
+_version = 0
+
+# (model, prompt hash) -> time the prefix was last warmed
+_warmed: Dict[Tuple[str, str], float] = {}
+_warming: Dict[Tuple[str, str], asyncio.Task] = {}
+
+# Scheduler user that prefix warms are admitted as
+WARM_USER = "system:warm"
+
+async def _load_roles() -> Dict[str, dict]:
+    rows = await db.fetchall("SELECT id, name, system_prompt FROM roles")
+    return {row[0]: {"id": row[0], "name": row[1], "system_prompt": row[2]} for row in rows}
+
+async def get_role(role_id: Optional[str]) -> Optional[dict]:
+    """Return a role from the cache, loading all roles on first use"""
+    global _roles
+    if not role_id:
+        return None
+    roles = _roles
+    if roles is None:
+        version = _version
+        roles = await _load_roles()
+        if version == _version:
+            _roles = roles
+    return roles.get(role_id)
+
+async def get_system_prompt(role_id: Optional[str]) -> Optional[str]:
+    """System prompt of a role, or None if the role is unknown"""
+    role = await get_role(role_id)
+    return role["system_prompt"] if role else None
+
+def invalidate():
+    """Drop cached roles after a change in the roles table"""
+    global _roles, _version
+    _roles = None
+    _version += 1
+
+def _prefix_key(model: str, system_prompt: str) -> Tuple[str, str]:
+    return model, hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()
+
+async def _warm(key: Tuple[str, str], model: str, system_prompt: str, ticket: scheduler.Ticket):
+    try:
+        await ollama_service.complete(
+            model,
+            [{"role": "system", "content": system_prompt}],
+            options={"num_predict": 1}
+        )
+        _warmed[key] = time.monotonic()
+    except Exception as e:
+        logger.warning(f"Failed to warm system prompt for {model}: {e}")
+    finally:
+        ticket.release()
+        _warming.pop(key, None)
+
+def warm_prefix(model: str, system_prompt: Optional[str]) -> Optional[asyncio.Task]:
+    """Evaluate a system prompt on the model in the background
+
+    Skipped if the same prompt was warmed on the model within
+    ``context.prefix_warm_ttl`` seconds, is being warmed right now, or the
+    model has no free generation slot.
+    """
+    if not model or not system_prompt:
+        return None
+    key = _prefix_key(model, system_prompt)
+    if key in _warming:
+        return _warming[key]
+    warmed_at = _warmed.get(key)
+    if warmed_at is not None and time.monotonic() - warmed_at < config_manager.config.context.prefix_warm_ttl:
+        return None
+    ticket = scheduler.try_admit(model, WARM_USER)
+    if ticket is None:
+        return None
+    task = asyncio.ensure_future(_warm(key, model, system_prompt, ticket))
+    _warming[key] = task
+    return task
+
+def mark_warm(model: str, system_prompt: Optional[str]):
+    """Record that a generation just evaluated this prefix on the model"""
+    if model and system_prompt:
+        _warmed[_prefix_key(model, system_prompt)] = time.monotonic()
@@ -0,0 +1,242 @@
+"""Admission control for generation requests
+
+Each model gets a fixed number of generation slots (``scheduler.concurrency``,
+overridable per model) and a bounded wait queue. Waiting requests are grouped
+by user and granted slots round-robin across users, so one user sending many
+messages cannot starve everyone else. A request arriving at a full queue is
+rejected immediately with an estimate of when to retry.
+
+Requests that have to wait report their queue position, which is the number
+of requests that will be granted a slot before them.
+
+Background work (such as conversation compaction) is admitted at low
+priority: it only gets a slot once no user request is waiting, and it never
+counts against the wait queue.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional
+from ..config import config_manager
+from ..utils.metrics import Gauge
+
+QUEUE_DEPTH = Gauge("scheduler_queued_requests", "Generation requests waiting for a slot", ["model"])
+ACTIVE_GENERATIONS = Gauge("scheduler_active_generations", "Generation requests holding a slot", ["model"])
+
+
+class QueueFull(Exception):
+    """Raised when a model's wait queue is full"""
+
+    def __init__(self, model: str, retry_after: int):
+        super().__init__(f"Too many pending requests for {model}")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A request's claim on a generation slot
+
+    ``release`` must be called once the generation is finished or abandoned,
+    whether or not the slot was ever granted.
+    """
+
+    def __init__(self, queue: "_ModelQueue", user: str):
+        self._queue = queue
+        self.user = user
+        self.granted = False
+        self.released = False
+        self.granted_at: Optional[float] = None
+        # Position last yielded by wait, so only real changes wake it
+        self._position: Optional[int] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+
+    def position(self) -> int:
+        """Number of requests that will be served before this one"""
+        return 0 if self.granted else self._queue.position(self)
+
+    async def wait(self) -> AsyncIterator[int]:
+        """Yield the queue position each time it changes until a slot is granted"""
+        while not self.granted:
+            self._changed.clear()
+            self._position = self.position()
+            yield self._position
+            await self._changed.wait()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._queue.release(self)
+
+
+class _ModelQueue:
+    def __init__(self, model: str):
+        self.model = model
+        self.active = 0
+        # user -> waiting tickets, in the order users take turns
+        self.waiting: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self.queued = 0
+        # Low-priority tickets, granted only when no user request is waiting
+        self.background: Deque[Ticket] = deque()
+        # Exponential moving average of how long a slot is held
+        self.avg_hold: Optional[float] = None
+        self._queued_gauge = QUEUE_DEPTH.labels(model)
+        self._active_gauge = ACTIVE_GENERATIONS.labels(model)
+
+    @property
+    def limit(self) -> int:
+        scheduler = config_manager.config.scheduler
+        return max(1, scheduler.model_concurrency.get(self.model, scheduler.concurrency))
+
+    def admit(self, user: str) -> Ticket:
+        ticket = Ticket(self, user)
+        if self.active < self.limit and not self.queued:
+            self._grant(ticket)
+            return ticket
+
+        if self.queued >= config_manager.config.scheduler.max_queue:
+            raise QueueFull(self.model, self.retry_after())
+        self.waiting.setdefault(user, deque()).append(ticket)
+        self.queued += 1
+        self._notify_waiting()
+        return ticket
+
+    def try_admit(self, user: str) -> Optional[Ticket]:
+        if self.active >= self.limit or self.queued or self.background:
+            return None
+        ticket = Ticket(self, user)
+        self._grant(ticket)
+        return ticket
+
+    def admit_background(self, user: str) -> Ticket:
+        ticket = Ticket(self, user)
+        if self.active < self.limit and not self.queued and not self.background:
+            self._grant(ticket)
+        else:
+            self.background.append(ticket)
+        return ticket
+
+    def _grant(self, ticket: Ticket):
+        ticket.granted = True
+        ticket.granted_at = time.monotonic()
+        self.active += 1
+        self._active_gauge.set(self.active)
+        ticket._notify()
+
+    def _next_waiting(self) -> Optional[Ticket]:
+        """Take the next ticket, rotating the user it came from to the back"""
+        if not self.waiting:
+            return None
+        user, tickets = next(iter(self.waiting.items()))
+        ticket = tickets.popleft()
+        del self.waiting[user]
+        if tickets:
+            self.waiting[user] = tickets
+        self.queued -= 1
+        return ticket
+
+    def _fill_slots(self):
+        while self.active < self.limit:
+            ticket = self._next_waiting()
+            if ticket is None:
+                if not self.background:
+                    break
+                ticket = self.background.popleft()
+            self._grant(ticket)
+
+    def _notify_waiting(self):
+        """Wake the waiting tickets whose queue position has changed"""
+        self._queued_gauge.set(self.queued)
+        self._active_gauge.set(self.active)
+        for position, ticket in enumerate(self._in_order()):
+            if ticket._position != position:
+                ticket._notify()
+
+    def release(self, ticket: Ticket):
+        if ticket.granted:
+            self.active -= 1
+            held = time.monotonic() - ticket.granted_at
+            self.avg_hold = held if self.avg_hold is None else 0.8 * self.avg_hold + 0.2 * held
+        elif ticket in self.background:
+            self.background.remove(ticket)
+        else:
+            tickets = self.waiting.get(ticket.user)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                self.queued -= 1
+                if not tickets:
+                    del self.waiting[ticket.user]
+        self._fill_slots()
+        self._notify_waiting()
+
+    def _in_order(self) -> Iterator[Ticket]:
+        """Waiting tickets in the order the round-robin will grant them"""
+        queues = [list(tickets) for tickets in self.waiting.values()]
+        depth = 0
+        while True:
+            progressed = False
+            for tickets in queues:
+                if depth < len(tickets):
+                    yield tickets[depth]
+                    progressed = True
+            if not progressed:
+                return
+            depth += 1
+
+    def position(self, ticket: Ticket) -> int:
+        """Replay the round-robin order to find where a ticket stands"""
+        for position, waiting in enumerate(self._in_order()):
+            if waiting is ticket:
+                return position
+        return self.queued
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained enough to accept a request"""
+        hold = self.avg_hold if self.avg_hold is not None else config_manager.config.scheduler.default_retry_after
+        return max(1, math.ceil(hold * (self.queued + 1) / self.limit))
+
+
+_queues: Dict[str, _ModelQueue] = {}
+
+
+def _queue(model: str) -> _ModelQueue:
+    queue = _queues.get(model)
+    if queue is None:
+        queue = _queues[model] = _ModelQueue(model)
+    return queue
+
+
+def admit(model: str, user: str) -> Ticket:
+    """Claim a slot on ``model`` for ``user``, queueing if none is free
+
+    Raises QueueFull when the model's wait queue is already full.
+    """
+    return _queue(model).admit(user)
+
+
+def try_admit(model: str, user: str) -> Optional[Ticket]:
+    """Claim a free slot on ``model`` without queueing
+
+    Returns None when every slot is taken or anything is waiting for one.
+    """
+    return _queue(model).try_admit(user)
+
+
+def admit_background(model: str, user: str) -> Ticket:
+    """Claim a slot on ``model`` for background work
+
+    The ticket is granted only when a slot is free and no user request is
+    waiting for one; it is never rejected.
+    """
+    return _queue(model).admit_background(user)
+
+
+def status() -> Dict[str, dict]:
+    """Active and queued request counts per model"""
+    return {
+        model: {"active": queue.active, "queued": queue.queued, "limit": queue.limit}
+        for model, queue in _queues.items()
+    }
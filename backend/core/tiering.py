@@ -0,0 +1,105 @@
+"""Background compression of inactive chats
+
+Every ``tiering.interval`` seconds, chats with no message for
+``tiering.cold_after`` seconds have their log gzip-compressed (see
+``message_log.compress``). Reading a cold chat decompresses it as it
+streams, and the next message sent to it restores the plain log, so nothing
+else needs to know which tier a chat is in.
+
+Only the ``files`` messages backend is tiered. Run
+
+    python -m backend.core.tiering compress [max-age-seconds]
+
+to compress inactive chats once, e.g. before a backup.
+"""
+import asyncio
+import logging
+import sys
+from typing import List, Optional
+from ..config import config_manager
+from ..database.connection import db
+from ..utils.metrics import Counter
+from . import message_log, message_store
+
+logger = logging.getLogger(__name__)
+
+BYTES_SAVED = Counter("tiering_bytes_saved_total", "Bytes saved by compressing inactive chats")
+
+_task: Optional[asyncio.Task] = None
+
+
+def _compress_all(chat_ids: List[str], level: int) -> dict:
+    compressed = 0
+    saved = 0
+    for chat_id in chat_ids:
+        try:
+            result = message_log.compress(message_store.chat_path(chat_id), level)
+        except Exception as e:
+            logger.warning(f"Failed to compress chat {chat_id}: {e}")
+            continue
+        if result is not None:
+            compressed += 1
+            saved += result
+            BYTES_SAVED.inc(max(result, 0))
+    return {"compressed": compressed, "bytes_saved": saved}
+
+
+async def run_once(cold_after: Optional[float] = None) -> dict:
+    """Compress every plain-log chat inactive for longer than ``cold_after`` seconds"""
+    tiering = config_manager.config.tiering
+    if message_store.uses_sqlite():
+        return {"compressed": 0, "bytes_saved": 0}
+    cold_after = tiering.cold_after if cold_after is None else cold_after
+    rows = await db.fetchall(
+        "SELECT id FROM chats WHERE COALESCE(last_message_at, updated_at) "
+        "< strftime('%Y-%m-%d %H:%M:%f', 'now', ?)",
+        (f"-{int(cold_after)} seconds",)
+    )
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, _compress_all, [row[0] for row in rows], tiering.level)
+    if result["compressed"]:
+        logger.info(f"Compressed {result['compressed']} inactive chats, saving {result['bytes_saved']} bytes")
+    return result
+
+
+async def _tiering_loop():
+    while True:
+        await asyncio.sleep(config_manager.config.tiering.interval)
+        if not config_manager.config.tiering.enabled:
+            continue
+        try:
+            await run_once()
+        except Exception as e:
+            logger.warning(f"Chat tiering failed: {e}")
+
+
+def start():
+    """Start the periodic tiering job"""
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.ensure_future(_tiering_loop())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) not in (2, 3) or argv[1] != "compress":
+        print("Usage: python -m backend.core.tiering compress [max-age-seconds]")
+        return 2
+    cold_after = float(argv[2]) if len(argv) == 3 else None
+    try:
+        result = asyncio.run(run_once(cold_after))
+    finally:
+        db.close()
+    print(f"Compressed {result['compressed']} chats, saving {result['bytes_saved']} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,138 @@
+"""Shared SQLite access layer
+
+Queries run on a small dedicated thread pool so they never block the event
+loop, and each worker thread reuses a pooled connection. Reusing connections
+also reuses sqlite3's per-connection prepared statement cache.
+"""
+import asyncio
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Sequence
+from ..config import config_manager
+from ..utils.metrics import Histogram
+
+# Applied to every new connection. WAL lets readers proceed while a write is
+# in progress, which matters once several streams save messages at once.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+QUERY_SECONDS = Histogram(
+    "sqlite_query_seconds", "Time to run a statement or transaction on a pooled connection", ["statement"]
+)
+
+_STATEMENT = re.compile(r"\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+))?", re.IGNORECASE | re.DOTALL)
+
+@lru_cache(maxsize=256)
+def statement_label(sql: str) -> str:
+    """Short metrics label for a statement, e.g. ``SELECT chats``"""
+    match = _STATEMENT.match(sql)
+    if not match:
+        return "other"
+    verb = match.group(1).upper()
+    table = sql.split()[1] if verb == "UPDATE" else match.group(2)
+    return f"{verb} {table}" if table else verb
+
+class Database:
+    """Pool of SQLite connections served by a dedicated executor"""
+
+    def __init__(self, path: Optional[str] = None, pool_size: Optional[int] = None):
+        self._path = path
+        self._pool_size = pool_size
+        self._pool: Optional[queue.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return self._path or config_manager.config.storage.database
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _ensure_open(self):
+        if self._executor is not None:
+            return
+        with self._lock:
+            if self._executor is None:
+                size = self._pool_size or config_manager.config.storage.db_pool_size
+                self._pool = queue.Queue()
+                for _ in range(size):
+                    conn = self._connect()
+                    self._connections.append(conn)
+                    self._pool.put(conn)
+                self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sqlite")
+
+    def _call(self, label: str, fn: Callable[..., Any], *args) -> Any:
+        conn = self._pool.get()
+        started = time.perf_counter()
+        try:
+            # The connection context manager commits on success and rolls back on error
+            with conn:
+                return fn(conn, *args)
+        finally:
+            QUERY_SECONDS.labels(label).observe(time.perf_counter() - started)
+            self._pool.put(conn)
+
+    async def _submit(self, label: str, fn: Callable[..., Any], *args) -> Any:
+        self._ensure_open()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, label, fn, *args)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run ``fn(conn, *args)`` in one transaction on the database executor
+
+        Its latency is recorded under the function's name.
+        """
+        return await self._submit(fn.__name__, fn, *args)
+
+    def run_sync(self, fn: Callable[..., Any], *args) -> Any:
+        """Like ``run`` but on the calling thread, for code that cannot await
+
+        Blocks until a pooled connection is free, so keep ``fn`` short.
+        """
+        self._ensure_open()
+        return self._call(fn.__name__, fn, *args)
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """Execute a statement and return the number of affected rows"""
+        return await self._submit(statement_label(sql), lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql: str, rows: Sequence[Sequence]) -> int:
+        """Execute a statement for every parameter row"""
+        return await self._submit(statement_label(sql), lambda conn: conn.executemany(sql, rows).rowcount)
+
+    async def fetchone(self, sql: str, params: Sequence = ()) -> Optional[tuple]:
+        """Execute a query and return its first row"""
+        return await self._submit(statement_label(sql), lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: Sequence = ()) -> List[tuple]:
+        """Execute a query and return all rows"""
+        return await self._submit(statement_label(sql), lambda conn: conn.execute(sql, params).fetchall())
+
+    def close(self):
+        """Shut down the executor and close every pooled connection"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._pool = None
+
+# Shared instance used by the API and core modules
+db = Database()
@@ -6,14 +6,18 @@ class Message(BaseModel):
     role: str = "user"
     content: str
     model: Optional[str] = None
+    role_id: Optional[str] = None  # AI role to answer with; rebinds the chat when it changes
+    truncated: bool = False  # Reply was cut short by a disconnect or cancel
     created_at: Optional[str] = Field(default_factory=lambda: datetime.now().isoformat())
 
 class Chat(BaseModel):
     title: str
     model: str
+    role_id: Optional[str] = None
 
 class ChatUpdate(BaseModel):
-    title: str
+    title: Optional[str] = None
+    role_id: Optional[str] = None
 
 class ExampleQuestion(BaseModel):
     content: str
@@ -1,7 +1,55 @@
+import os
 import sqlite3
 import uuid
+from datetime import datetime
 from pathlib import Path
 from ..config import config_manager
+from ..core import message_log, message_store
+from . import search
+
+# Denormalized per-chat metadata kept current by save_message
+CHAT_METADATA_COLUMNS = {
+    "message_count": "INTEGER NOT NULL DEFAULT 0",
+    "last_message_preview": "TEXT",
+    "last_message_at": "TIMESTAMP"
+}
+
+PREVIEW_LENGTH = 100
+
+# Millisecond UTC timestamp; sorts correctly next to CURRENT_TIMESTAMP values
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+def message_preview(content: str) -> str:
+    """Single-line excerpt of a message for the chat list"""
+    return " ".join((content or "").split())[:PREVIEW_LENGTH]
+
+def _migrate_chats(c, chat_dir: str):
+    """Add newer columns to older databases and backfill metadata from the logs"""
+    existing = {row[1] for row in c.execute("PRAGMA table_info(chats)")}
+    if "role_id" not in existing:
+        c.execute("ALTER TABLE chats ADD COLUMN role_id TEXT")
+    missing = [name for name in CHAT_METADATA_COLUMNS if name not in existing]
+    for name in missing:
+        c.execute(f"ALTER TABLE chats ADD COLUMN {name} {CHAT_METADATA_COLUMNS[name]}")
+    if not missing:
+        return
+
+    for (chat_id,) in c.execute("SELECT id FROM chats").fetchall():
+        path = os.path.join(chat_dir, chat_id)
+        if not message_log.exists(path):
+            continue
+        count = message_log.count(path)
+        if not count:
+            continue
+        last = next(message_log.iter_messages(path, count - 1))
+        # The log's mtime is the best record of when the chat was last active
+        mtime = os.path.getmtime(os.path.join(path, message_log.LOG_FILE))
+        last_at = datetime.utcfromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        c.execute(
+            "UPDATE chats SET message_count = ?, last_message_preview = ?, last_message_at = ?, "
+            "updated_at = MAX(COALESCE(updated_at, ''), ?) WHERE id = ?",
+            (count, message_preview(last.get("content")), last_at, last_at, chat_id)
+        )
 
 def init_db():
     """Initialize database and storage"""
@@ -29,6 +77,15 @@ def init_db():
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        _migrate_chats(c, config.storage.chat_dir)
+        # Keyset pagination of the chat list walks this index
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chats_updated ON chats (updated_at DESC, id DESC)")
+
+        # Messages table, used when storage.messages_backend is "sqlite"
+        message_store.create_table(c)
+
+        # Full-text search index over message content
+        search.create_index(c)
         
         # Create example questions table
         c.execute('''
@@ -0,0 +1,181 @@
+"""Full-text search index over chat messages
+
+``messages_fts`` is an FTS5 table holding message text, and
+``search_docs`` maps each FTS rowid to its chat, sequence number, role and
+model. The mapping table is indexed on ``chat_id`` and ``model`` so filters
+and chat deletion never scan the full-text index.
+
+The unicode61 tokenizer does not split CJK text into words, so every CJK
+character is wrapped in an invisible separator before indexing and querying.
+Each character then becomes a token and multi-character queries run as
+phrase queries.
+
+Run ``python -m backend.database.search reindex`` to rebuild the index from
+the stored messages.
+"""
+import os
+import re
+import sqlite3
+import sys
+from typing import Iterable, List, Optional
+from ..config import config_manager
+from ..core import message_log, message_store
+
+# U+2063 INVISIBLE SEPARATOR, declared as a separator for the tokenizer
+SEPARATOR = "\u2063"
+
+_CJK = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])")
+
+REINDEX_BATCH_SIZE = 1000
+
+SCHEMA = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        body,
+        tokenize = "unicode61 remove_diacritics 2 separators '{SEPARATOR}'"
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS search_docs (
+        id INTEGER PRIMARY KEY,
+        chat_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT,
+        model TEXT,
+        created_at TEXT
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_search_docs_chat ON search_docs (chat_id, seq)",
+    "CREATE INDEX IF NOT EXISTS idx_search_docs_model ON search_docs (model)",
+)
+
+def segment(text: str) -> str:
+    """Make every CJK character a separate token"""
+    return _CJK.sub(lambda m: SEPARATOR + m.group(1) + SEPARATOR, text or "")
+
+def build_query(text: str) -> str:
+    """Turn user input into an FTS5 query matching all terms
+
+    Each whitespace-separated term becomes a quoted phrase, so FTS5 operators
+    in the input are treated as plain text. A trailing ``*`` keeps its
+    meaning as a prefix search.
+    """
+    terms = []
+    for term in text.split():
+        prefix = term.endswith("*") and len(term) > 1
+        if prefix:
+            term = term.rstrip("*")
+        terms.append('"' + segment(term).replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def create_index(conn: sqlite3.Connection) -> None:
+    """Create the search tables if they do not exist"""
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+def index_message(conn: sqlite3.Connection, chat_id: str, seq: int, message: dict) -> None:
+    """Add one message to the index"""
+    cursor = conn.execute(
+        "INSERT INTO search_docs (chat_id, seq, role, model, created_at) VALUES (?, ?, ?, ?, ?)",
+        (chat_id, seq, message.get("role"), message.get("model"), message.get("created_at"))
+    )
+    conn.execute(
+        "INSERT INTO messages_fts (rowid, body) VALUES (?, ?)",
+        (cursor.lastrowid, segment(message.get("content")))
+    )
+
+def delete_chat(conn: sqlite3.Connection, chat_id: str) -> None:
+    """Remove every indexed message of a chat"""
+    conn.execute(
+        "DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM search_docs WHERE chat_id = ?)",
+        (chat_id,)
+    )
+    conn.execute("DELETE FROM search_docs WHERE chat_id = ?", (chat_id,))
+
+def _clean_snippet(snippet: str) -> str:
+    return snippet.replace(SEPARATOR, "").replace("</mark><mark>", "")
+
+def search(conn: sqlite3.Connection, text: str, chat_id: Optional[str] = None,
+           model: Optional[str] = None, limit: int = 20, offset: int = 0) -> List[dict]:
+    """Return the best matching messages with highlighted snippets"""
+    query = build_query(text)
+    if not query:
+        return []
+
+    sql = """
+        SELECT d.chat_id, d.seq, d.role, d.model, d.created_at, c.title,
+               snippet(messages_fts, 0, '<mark>', '</mark>', '…', 24),
+               bm25(messages_fts) AS score
+        FROM messages_fts
+        JOIN search_docs d ON d.id = messages_fts.rowid
+        LEFT JOIN chats c ON c.id = d.chat_id
+        WHERE messages_fts MATCH ?
+    """
+    params: list = [query]
+    if chat_id:
+        sql += " AND d.chat_id = ?"
+        params.append(chat_id)
+    if model:
+        sql += " AND d.model = ?"
+        params.append(model)
+    sql += " ORDER BY score LIMIT ? OFFSET ?"
+    params.extend([limit, offset])
+
+    return [
+        {
+            "chat_id": row[0],
+            "seq": row[1],
+            "role": row[2],
+            "model": row[3],
+            "created_at": row[4],
+            "chat_title": row[5],
+            "snippet": _clean_snippet(row[6]),
+            "score": row[7]
+        }
+        for row in conn.execute(sql, params)
+    ]
+
+def _iter_rows(conn: sqlite3.Connection, chat_dir: str, chat_ids: Iterable[str]):
+    if message_store.uses_sqlite():
+        yield from message_store.iter_all(conn)
+        return
+    for chat_id in chat_ids:
+        path = os.path.join(chat_dir, chat_id)
+        if not message_log.exists(path):
+            continue
+        for seq, message in enumerate(message_log.iter_messages(path)):
+            yield chat_id, seq, message
+
+def reindex(conn: sqlite3.Connection, chat_dir: str) -> int:
+    """Rebuild the index from the stored messages in bounded-size batches"""
+    conn.execute("DROP TABLE IF EXISTS messages_fts")
+    conn.execute("DROP TABLE IF EXISTS search_docs")
+    create_index(conn)
+    conn.commit()
+
+    chat_ids = [row[0] for row in conn.execute("SELECT id FROM chats")]
+    indexed = 0
+    for chat_id, seq, message in _iter_rows(conn, chat_dir, chat_ids):
+        index_message(conn, chat_id, seq, message)
+        indexed += 1
+        if indexed % REINDEX_BATCH_SIZE == 0:
+            conn.commit()
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+    conn.commit()
+    return indexed
+
+def main(argv: List[str]) -> int:
+    if argv[1:] != ["reindex"]:
+        print("Usage: python -m backend.database.search reindex")
+        return 2
+    config = config_manager.config
+    conn = sqlite3.connect(config.storage.database)
+    try:
+        count = reindex(conn, config.storage.chat_dir)
+    finally:
+        conn.close()
+    print(f"Indexed {count} messages")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
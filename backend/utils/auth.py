@@ -1,4 +1,4 @@
-from fastapi import HTTPException, Security
+from fastapi import HTTPException, Request, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
@@ -23,6 +23,20 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
+def request_user(request: Request) -> str:
+    """Identify who sent a request: the token subject, or the client address"""
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            config = config_manager.config
+            payload = jwt.decode(token, config.server.secret_key, algorithms=["HS256"])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except JWTError:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
 def verify_password(username: str, password: str) -> bool:
     """Verify username and password against config"""
     config = config_manager.config
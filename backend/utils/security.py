@@ -1,5 +1,29 @@
 from fastapi import Request
 from fastapi.responses import Response
+from starlette.middleware.cors import CORSMiddleware
+from ..config import config_manager
+
+class ConfigCORSMiddleware:
+    """CORS middleware whose allowed origins follow ``server.cors_origins``
+
+    The wrapped CORSMiddleware is rebuilt whenever a config snapshot with a
+    different origin list is published, so no restart is needed.
+    """
+    def __init__(self, app, **options):
+        self.app = app
+        self.options = options
+        self._build(config_manager.config)
+        config_manager.subscribe(self._on_config_change)
+
+    def _build(self, config):
+        self.cors = CORSMiddleware(self.app, allow_origins=config.server.cors_origins, **self.options)
+
+    def _on_config_change(self, old, new):
+        if old.server.cors_origins != new.server.cors_origins:
+            self._build(new)
+
+    async def __call__(self, scope, receive, send):
+        await self.cors(scope, receive, send)
 
 async def add_security_headers(request: Request, call_next):
     response = await call_next(request)
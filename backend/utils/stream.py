@@ -1,53 +1,216 @@
 import json
+import time
 import asyncio
 import logging
+from typing import Awaitable, Callable, Optional, Tuple
+from ..config import config_manager
+from .metrics import Counter, Gauge, Histogram
+from . import timing
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def stream_response(response):
-    """Stream response from Ollama"""
+TIME_TO_FIRST_TOKEN = Histogram(
+    "generation_time_to_first_token_seconds",
+    "Time from the chat request to the first token from Ollama", ["model"]
+)
+INTER_TOKEN_GAP = Histogram(
+    "generation_inter_token_seconds", "Gap between consecutive tokens from Ollama", ["model"],
+    buckets=(0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5)
+)
+GENERATION_SECONDS = Histogram("generation_seconds", "Total time of a streamed generation", ["model"])
+TOKENS = Counter("generation_tokens_total", "Tokens streamed from Ollama", ["model"])
+TOKENS_PER_SECOND = Histogram(
+    "generation_tokens_per_second", "Decode rate of a streamed generation", ["model"],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 100, 150, 200, 400)
+)
+ACTIVE_STREAMS = Gauge("generation_active_streams", "Streams currently sent to clients")
+
+def _parse_line(line: str) -> Tuple[str, Optional[str]]:
+    """Classify one upstream NDJSON line as a token, done marker or error"""
+    try:
+        # Try to parse as JSON first
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        # If not JSON, treat the raw line as response text
+        logger.debug(f"Non-JSON line received: {line[:100]}...")  # Log first 100 chars
+        return "token", line
+
+    # /api/chat frames carry the text in message.content, /api/generate in response
+    if isinstance(data.get("message"), dict):
+        text = data["message"].get("content", "")
+    else:
+        text = data.get("response")
+    if text is not None:
+        if data.get("done"):
+            return "done", text
+        return "token", text
+    if data.get("done"):
+        return "done", None
+    if "error" in data:
+        return "error", data["error"]
+    return "ignore", None
+
+def format_sse(data: str, event_id: Optional[str] = None) -> str:
+    """Frame one JSON payload as a server-sent event"""
+    if event_id is None:
+        return f"data: {data}\n\n"
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+async def stream_response(
+    response,
+    on_complete: Optional[Callable[[str, bool], Awaitable]] = None,
+    model: str = "",
+    started: Optional[float] = None
+):
+    """Stream response from Ollama
+
+    The upstream NDJSON is read exactly once. Every chunk sent to the client is
+    also collected, and ``on_complete`` receives the full assistant text before
+    the final done marker goes out, so what gets saved is what the user saw.
+
+    Cancelling the task that drives this generator closes the upstream
+    response at once. The text received so far is then passed to
+    ``on_complete`` with ``truncated`` set, and the done marker says so too.
+
+    With ``stream.coalesce`` enabled the first token is sent immediately and
+    later tokens are batched into one frame until ``flush_interval_ms`` has
+    passed or ``flush_bytes`` have accumulated.
+
+    ``started`` is the ``time.perf_counter()`` value when the request arrived;
+    time to first token and generation time are measured from it.
+    """
+    stream_config = config_manager.config.stream
+    flush_interval = stream_config.flush_interval_ms / 1000
+    loop = asyncio.get_running_loop()
+
+    parts = []
+    pending = []
+    pending_bytes = 0
+    deadline = None
+    first_token_sent = False
+
+    def flush():
+        nonlocal pending, pending_bytes, deadline
+        chunk = "".join(pending)
+        pending = []
+        pending_bytes = 0
+        deadline = None
+        logger.debug(f"Sending chunk: {chunk[:100]}...")  # Log first 100 chars
+        return json.dumps({"response": chunk}) + "\n"
+
+    started = time.perf_counter() if started is None else started
+    token_count = 0
+    first_token_at = None
+    last_token_at = None
+    inter_token_gap = INTER_TOKEN_GAP.labels(model)
+    ACTIVE_STREAMS.inc()
+
+    lines = response.aiter_lines().__aiter__()
+    next_line = None
+    truncated = False
     try:
-        buffer = ""
-        async for line in response.aiter_lines():
-            line = line.strip()
-            if line:
-                logger.debug(f"Received line from Ollama: {line[:100]}...")  # Log first 100 chars
-                try:
-                    # Try to parse as JSON first
-                    data = json.loads(line)
-                    if "response" in data:
-                        chunk = data["response"]
-                        if chunk:
-                            logger.debug(f"Sending chunk: {chunk[:100]}...")  # Log first 100 chars
-                            # Ensure we're sending valid JSON for each chunk
-                            yield json.dumps({"response": chunk}) + "\n"
-                            await asyncio.sleep(0.01)  # Small delay to control flow
-                    elif "done" in data and data["done"]:
-                        # Handle completion marker
-                        if buffer:  # Send any remaining buffered content
-                            logger.debug(f"Sending final buffer: {buffer[:100]}...")  # Log first 100 chars
-                            yield json.dumps({"response": buffer}) + "\n"
-                        logger.debug("Sending done marker")
-                        break
-                    elif "error" in data:
-                        # Handle error responses
-                        logger.error(f"Error from Ollama: {data['error']}")
-                        yield json.dumps({"error": data["error"]}) + "\n"
-                        break
-                except json.JSONDecodeError:
-                    # If not JSON, wrap the line in a response object
-                    logger.debug(f"Non-JSON line received: {line[:100]}...")  # Log first 100 chars
-                    buffer += line
-                    yield json.dumps({"response": line}) + "\n"
-                    await asyncio.sleep(0.01)
+        while True:
+            if next_line is None:
+                next_line = asyncio.ensure_future(lines.__anext__())
+
+            # Wait for the next line, but no longer than the open flush window
+            timeout = max(0.0, deadline - loop.time()) if pending else None
+            done, _ = await asyncio.wait({next_line}, timeout=timeout)
+            if not done:
+                yield flush()
+                continue
+
+            task, next_line = next_line, None
+            try:
+                line = task.result().strip()
+            except StopAsyncIteration:
+                break
+            if not line:
+                continue
+            logger.debug(f"Received line from Ollama: {line[:100]}...")  # Log first 100 chars
+
+            kind, value = _parse_line(line)
+            if kind == "token" or (kind == "done" and value):
+                now = time.perf_counter()
+                if last_token_at is None:
+                    first_token_at = now
+                    TIME_TO_FIRST_TOKEN.labels(model).observe(now - started)
+                else:
+                    inter_token_gap.observe(now - last_token_at)
+                last_token_at = now
+                token_count += 1
+                parts.append(value)
+                pending.append(value)
+                pending_bytes += len(value.encode("utf-8"))
+                if not stream_config.coalesce or not first_token_sent:
+                    first_token_sent = True
+                    yield flush()
+                elif pending_bytes >= stream_config.flush_bytes:
+                    yield flush()
+                elif deadline is None:
+                    deadline = loop.time() + flush_interval
+            if kind == "done":
+                logger.debug("Sending done marker")
+                break
+            if kind == "error":
+                # Handle error responses
+                logger.error(f"Error from Ollama: {value}")
+                if pending:
+                    yield flush()
+                yield json.dumps({"error": value}) + "\n"
+                break
+
+        if pending:
+            yield flush()
+    except asyncio.CancelledError:
+        # Stopped by the client: keep what was generated so far
+        truncated = True
+        logger.info(f"Generation cancelled after {token_count} tokens")
     except Exception as e:
         # Handle any streaming errors
         error_msg = str(e)
         logger.error(f"Streaming error: {error_msg}")
+        if pending:
+            yield flush()
         if not response.is_closed:
             yield json.dumps({"error": error_msg}) + "\n"
+    finally:
+        if next_line is not None:
+            next_line.cancel()
+        await response.aclose()
+        ACTIVE_STREAMS.dec()
+        GENERATION_SECONDS.labels(model).observe(time.perf_counter() - started)
+        if token_count:
+            TOKENS.labels(model).inc(token_count)
+            if last_token_at > first_token_at:
+                TOKENS_PER_SECOND.labels(model).observe((token_count - 1) / (last_token_at - first_token_at))
+
+    if first_token_at is not None:
+        timing.record("first_token", started, first_token_at)
+        timing.record("decode", first_token_at, last_token_at)
+
+    if on_complete is not None and parts:
+        with timing.span("save_reply"):
+            save = asyncio.ensure_future(on_complete("".join(parts), truncated))
+            try:
+                # Shielded so a cancel that arrives mid-save still keeps the reply
+                await asyncio.shield(save)
+            except asyncio.CancelledError:
+                await asyncio.wait({save})
+                if not save.cancelled() and save.exception() is not None:
+                    logger.error(f"Failed to persist response: {save.exception()}")
+                raise
+            except Exception as e:
+                logger.error(f"Failed to persist response: {str(e)}")
+
+    frame = timing.timings_frame()
+    if frame is not None:
+        yield json.dumps(frame) + "\n"
             
     # Ensure we send a completion marker
     logger.debug("Stream completed, sending final done marker")
-    yield json.dumps({"done": True}) + "\n"
+    if truncated:
+        yield json.dumps({"done": True, "truncated": True}) + "\n"
+    else:
+        yield json.dumps({"done": True}) + "\n"
@@ -0,0 +1,186 @@
+"""Per-request timing spans
+
+``TimingMiddleware`` opens a trace for every HTTP request and keeps it in a
+context variable, so code anywhere below the route can time a step with
+
+    with span("verify_storage"):
+        ...
+
+Outside a request ``span`` does nothing. Spans nest, and the finished trace
+is reported in three ways:
+- a ``Server-Timing`` header on every response, covering the work done
+  before the response started (the whole request unless it streams);
+- ``timings_frame()``, which streams send as their last frame;
+- the ``tracing`` log, a JSONL file with the full span tree of a sampled
+  share of requests (off by default), appended on an executor thread.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+from ..config import config_manager
+
+logger = logging.getLogger(__name__)
+
+# Serializes appends so concurrent traces never interleave in the file
+_trace_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "children")
+
+    def __init__(self, name: str, start: Optional[float] = None):
+        self.name = name
+        self.start = time.perf_counter() if start is None else start
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    @property
+    def duration_ms(self) -> float:
+        end = time.perf_counter() if self.end is None else self.end
+        return (end - self.start) * 1000
+
+    def to_dict(self, origin: float) -> dict:
+        node = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3)
+        }
+        if self.children:
+            node["children"] = [child.to_dict(origin) for child in self.children]
+        return node
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("timing_span", default=None)
+_root: ContextVar[Optional[Span]] = ContextVar("timing_root", default=None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[Optional[Span]]:
+    """Time the enclosed block as a child of the current span"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current.reset(token)
+
+
+def record(name: str, start: float, end: Optional[float] = None) -> None:
+    """Add an already measured step to the request's root span
+
+    For code such as async generators that cannot hold a ``span`` block open.
+    """
+    root = _root.get()
+    if root is not None:
+        child = Span(name, start)
+        child.end = time.perf_counter() if end is None else end
+        root.children.append(child)
+
+
+def _totals(root: Span) -> Dict[str, float]:
+    """Duration per dotted span path, summed over repeats, in tree order"""
+    totals: Dict[str, float] = {}
+    stack = [(child.name, child) for child in reversed(root.children)]
+    while stack:
+        path, node = stack.pop()
+        totals[path] = totals.get(path, 0.0) + node.duration_ms
+        stack.extend((f"{path}.{child.name}", child) for child in reversed(node.children))
+    return totals
+
+
+def server_timing(root: Span) -> str:
+    """Render a span tree as a ``Server-Timing`` header value"""
+    entries = [f"{name};dur={duration:.1f}" for name, duration in _totals(root).items()]
+    entries.append(f"total;dur={root.duration_ms:.1f}")
+    return ", ".join(entries)
+
+
+def timings_frame() -> Optional[dict]:
+    """Stream frame with the request's timings so far, or None outside a request"""
+    root = _root.get()
+    if root is None:
+        return None
+    timings = {name: round(duration, 1) for name, duration in _totals(root).items()}
+    # A resumed generation outlives the request that started it, so measure
+    # up to now rather than to the end of that request
+    timings["total"] = round((time.perf_counter() - root.start) * 1000, 1)
+    return {"timings": timings}
+
+
+def _trace_entry(root: Span, scope: dict, status: Optional[int]) -> dict:
+    return {
+        "trace_id": uuid.uuid4().hex,
+        "time": time.time(),
+        "method": scope.get("method"),
+        "path": scope.get("path"),
+        "status": status,
+        "duration_ms": round(root.duration_ms, 3),
+        "spans": [child.to_dict(root.start) for child in root.children]
+    }
+
+
+def _write_trace(path: str, entry: dict):
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _trace_lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def _log_trace_error(write: asyncio.Future):
+    if not write.cancelled() and write.exception() is not None:
+        logger.warning(f"Failed to write trace: {write.exception()}")
+
+
+class TimingMiddleware:
+    """Opens a trace per HTTP request and reports it when the request ends"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root = Span("request")
+        root_token = _root.set(root)
+        current_token = _current.set(root)
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(root).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            root.end = time.perf_counter()
+            _current.reset(current_token)
+            _root.reset(root_token)
+            tracing = config_manager.config.tracing
+            if tracing.enabled and random.random() < tracing.sample_rate:
+                entry = _trace_entry(root, scope, status)
+                write = asyncio.get_running_loop().run_in_executor(None, _write_trace, tracing.path, entry)
+                write.add_done_callback(_log_trace_error)
@@ -0,0 +1 @@
+"""End-to-end streaming benchmarks for the backend"""
@@ -0,0 +1,204 @@
+"""Run the end-to-end streaming benchmark
+
+Starts the fake Ollama server and the backend as separate processes with a
+throwaway config and storage directory, drives the chat API with the load
+generator and prints a report. Everything runs on localhost, so it works
+offline and in CI:
+
+    python -m benchmarks --concurrency 20 --messages 5 --max-ttft-p95-ms 200
+
+Any ``--max-*`` threshold that is exceeded makes the command exit with 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+import httpx
+import yaml
+from .fake_ollama import MODEL
+from .loadgen import run_load
+from .report import format_text, summarize
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+class ProcessSampler:
+    """CPU time and resident memory of a process, read from /proc
+
+    Where /proc is unavailable the backend numbers are left out of the report.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+        self._ticks = os.sysconf("SC_CLK_TCK") if self.available else 1
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are fields 14 and 15, i.e. 12 and 13 after the command name
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+
+async def _measure(args, base_url: str, sampler: ProcessSampler) -> dict:
+    process: Optional[dict] = None
+    peak = 0
+    stop = asyncio.Event()
+
+    async def sample_memory():
+        nonlocal peak
+        while not stop.is_set():
+            peak = max(peak, sampler.rss_bytes())
+            await asyncio.sleep(0.05)
+
+    if sampler.available:
+        cpu_start = sampler.cpu_seconds()
+        rss_start = sampler.rss_bytes()
+        sampling = asyncio.ensure_future(sample_memory())
+
+    started = time.perf_counter()
+    results = await run_load(base_url, MODEL, args.concurrency, args.messages)
+    wall_time = time.perf_counter() - started
+
+    if sampler.available:
+        stop.set()
+        await sampling
+        process = {
+            "cpu_s": sampler.cpu_seconds() - cpu_start,
+            "rss_start": rss_start,
+            "rss_peak": max(peak, rss_start),
+            "concurrency": args.concurrency
+        }
+    return summarize(results, wall_time, process)
+
+
+def _write_config(workdir: Path, ollama_port: int, args) -> Path:
+    config = {
+        "ollama": {"host": f"http://127.0.0.1:{ollama_port}", "read_timeout": 300.0},
+        "storage": {
+            "chat_dir": str(workdir / "chats"),
+            "database": str(workdir / "database.db")
+        },
+        "server": {"host": "127.0.0.1", "port": 0, "cors_origins": []},
+        "models": {"default": MODEL, "available": [MODEL]},
+        "scheduler": {
+            "concurrency": args.upstream_concurrency or args.concurrency,
+            "max_queue": max(32, args.concurrency * 2)
+        },
+        "residency": {"preload": False}
+    }
+    (workdir / "chats").mkdir()
+    path = workdir / "config.yaml"
+    path.write_text(yaml.safe_dump(config), encoding="utf-8")
+    return path
+
+
+def _check_thresholds(summary: dict, args) -> list:
+    failures = []
+    checks = (
+        (args.max_ttft_p95_ms, summary["ttft_ms"]["p95"], "ttft p95"),
+        (args.max_gap_p99_ms, summary["inter_token_ms"]["p99"], "inter-token p99"),
+        (args.max_cpu_ms_per_stream, summary.get("backend", {}).get("cpu_ms_per_stream"), "CPU per stream"),
+    )
+    for limit, value, label in checks:
+        if limit is not None and value is not None and value > limit:
+            failures.append(f"{label} {value} ms exceeds {limit} ms")
+    if summary["failed"] and not args.allow_errors:
+        failures.append(f"{summary['failed']} streams failed")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="End-to-end streaming benchmark against a fake Ollama")
+    parser.add_argument("--concurrency", type=int, default=10, help="simultaneous chats")
+    parser.add_argument("--messages", type=int, default=3, help="messages sent per chat")
+    parser.add_argument("--upstream-concurrency", type=int, default=0,
+                        help="scheduler slots per model (default: one per chat)")
+    parser.add_argument("--token-rate", type=float, default=100.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--mid-stream-error-rate", type=float, default=0.0)
+    parser.add_argument("--allow-errors", action="store_true", help="do not fail the run on stream errors")
+    parser.add_argument("--max-ttft-p95-ms", type=float)
+    parser.add_argument("--max-gap-p99-ms", type=float)
+    parser.add_argument("--max-cpu-ms-per-stream", type=float)
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    ollama_port = _free_port()
+    backend_port = _free_port()
+    with tempfile.TemporaryDirectory(prefix="webui-bench-") as tmp:
+        workdir = Path(tmp)
+        config_path = _write_config(workdir, ollama_port, args)
+        env = dict(os.environ, PYTHONPATH=str(ROOT), WEBUI_CONFIG_FILE=str(config_path))
+
+        fake = subprocess.Popen([
+            sys.executable, "-m", "benchmarks.fake_ollama",
+            "--port", str(ollama_port),
+            "--token-rate", str(args.token_rate),
+            "--first-token-delay", str(args.first_token_delay),
+            "--tokens", str(args.tokens),
+            "--error-rate", str(args.error_rate),
+            "--mid-stream-error-rate", str(args.mid_stream_error_rate)
+        ], cwd=ROOT, env=env)
+        backend = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "backend.app:app",
+            "--host", "127.0.0.1", "--port", str(backend_port), "--log-level", "warning"
+        ], cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+        try:
+            _wait_ready(f"http://127.0.0.1:{ollama_port}/api/tags")
+            base_url = f"http://127.0.0.1:{backend_port}"
+            _wait_ready(f"{base_url}/health")
+            summary = asyncio.run(_measure(args, base_url, ProcessSampler(backend.pid)))
+        finally:
+            for process in (backend, fake):
+                process.terminate()
+            for process in (backend, fake):
+                process.wait(timeout=10)
+
+    print(format_text(summary))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    failures = _check_thresholds(summary, args)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
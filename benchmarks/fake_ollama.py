@@ -0,0 +1,113 @@
+"""Local stand-in for the Ollama API used by the benchmarks
+
+Serves ``/api/tags``, ``/api/ps``, ``/api/generate`` and ``/api/chat`` with
+a fixed token rate, an optional delay before the first token and optional
+error injection, so the backend can be measured without a model.
+
+    python -m benchmarks.fake_ollama --port 11435 --token-rate 50 --first-token-delay 0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+MODEL = "bench-model"
+
+
+def create_app(
+    token_rate: float = 100.0,
+    first_token_delay: float = 0.0,
+    tokens: int = 200,
+    error_rate: float = 0.0,
+    mid_stream_error_rate: float = 0.0,
+    seed: int = 0
+) -> FastAPI:
+    """Build the fake server
+
+    ``error_rate`` is the share of requests answered with HTTP 500, and
+    ``mid_stream_error_rate`` the share of streams that end with an error
+    frame halfway through.
+    """
+    app = FastAPI()
+    rng = random.Random(seed)
+    interval = 1.0 / token_rate if token_rate > 0 else 0.0
+
+    def frame(chat: bool, text: str, done: bool) -> dict:
+        if chat:
+            return {"model": MODEL, "message": {"role": "assistant", "content": text}, "done": done}
+        return {"model": MODEL, "response": text, "done": done}
+
+    async def generate(chat: bool, stream: bool):
+        if rng.random() < error_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        words = [f"tok{i} " for i in range(tokens)]
+        if not stream:
+            await asyncio.sleep(first_token_delay + interval * tokens)
+            return frame(chat, "".join(words), True)
+
+        fail_at = tokens // 2 if rng.random() < mid_stream_error_rate else None
+
+        async def body():
+            await asyncio.sleep(first_token_delay)
+            for i, word in enumerate(words):
+                if i == fail_at:
+                    yield json.dumps({"error": "injected mid-stream failure"}) + "\n"
+                    return
+                yield json.dumps(frame(chat, word, False)) + "\n"
+                if interval:
+                    await asyncio.sleep(interval)
+            yield json.dumps(frame(chat, "", True)) + "\n"
+
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": MODEL, "size": 1, "details": {"parameter_size": "0B"}}]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": MODEL, "size": 1, "size_vram": 0}]}
+
+    @app.post("/api/generate")
+    async def api_generate(request: Request):
+        body = await request.json()
+        if not body.get("prompt"):
+            # Load/unload requests carry no prompt
+            return {"model": body.get("model"), "response": "", "done": True}
+        return await generate(chat=False, stream=body.get("stream", True))
+
+    @app.post("/api/chat")
+    async def api_chat(request: Request):
+        body = await request.json()
+        return await generate(chat=True, stream=body.get("stream", True))
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-rate", type=float, default=100.0, help="tokens per second per stream")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--mid-stream-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    app = create_app(
+        token_rate=args.token_rate,
+        first_token_delay=args.first_token_delay,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        mid_stream_error_rate=args.mid_stream_error_rate,
+        seed=args.seed
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Load generator driving the backend's chat API over HTTP
+
+Each simulated user creates a chat and sends messages one after another,
+reading the server-sent events as the browser does. Every stream records its
+time to first token, the gaps between frames and how many tokens arrived.
+"""
+import asyncio
+import json
+import time
+from typing import List
+import httpx
+
+
+async def _stream_message(client: httpx.AsyncClient, chat_id: str, text: str) -> dict:
+    result = {
+        "status": None,
+        "ttft": None,
+        "gaps": [],
+        "tokens": 0,
+        "duration": None,
+        "error": None,
+        "queued": False
+    }
+    started = time.perf_counter()
+    last_frame = None
+    content = []
+    try:
+        async with client.stream("POST", f"/api/chat/{chat_id}", json={"role": "user", "content": text}) as response:
+            result["status"] = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = response.text[:200]
+                return result
+            async for line in response.aiter_lines():
+                # Server-sent events: only the data lines carry frames
+                if not line.startswith("data:"):
+                    continue
+                data = json.loads(line[len("data:"):])
+                now = time.perf_counter()
+                if "queue_position" in data:
+                    result["queued"] = True
+                elif "error" in data:
+                    result["error"] = data["error"]
+                elif data.get("response"):
+                    if last_frame is None:
+                        result["ttft"] = now - started
+                    else:
+                        result["gaps"].append(now - last_frame)
+                    last_frame = now
+                    content.append(data["response"])
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        result["duration"] = time.perf_counter() - started
+        # The fake server emits one whitespace-separated word per token
+        result["tokens"] = len("".join(content).split())
+    return result
+
+
+async def _user(client: httpx.AsyncClient, model: str, user: int, messages: int) -> List[dict]:
+    response = await client.post("/api/chats", json={"title": f"bench {user}", "model": model})
+    response.raise_for_status()
+    chat_id = response.json()["chat"]["id"]
+    results = []
+    for i in range(messages):
+        results.append(await _stream_message(client, chat_id, f"benchmark message {i} from user {user}"))
+    return results
+
+
+async def run_load(base_url: str, model: str, concurrency: int, messages: int, timeout: float = 120.0) -> List[dict]:
+    """Run ``concurrency`` users sending ``messages`` messages each"""
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        per_user = await asyncio.gather(*(_user(client, model, user, messages) for user in range(concurrency)))
+    return [result for results in per_user for result in results]
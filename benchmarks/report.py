@@ -0,0 +1,80 @@
+"""Summaries of a benchmark run"""
+import math
+from typing import Dict, List, Optional, Sequence
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, or None for an empty sample"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _distribution_ms(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    summary = {f"p{pct}": percentile(values, pct) for pct in PERCENTILES}
+    summary["max"] = max(values) if values else None
+    return {key: None if value is None else round(value * 1000, 2) for key, value in summary.items()}
+
+
+def summarize(results: List[dict], wall_time: float, process: Optional[dict] = None) -> dict:
+    """Aggregate per-stream results and backend process usage"""
+    ok = [r for r in results if r["status"] == 200 and not r["error"]]
+    rates = [r["tokens"] / r["duration"] for r in ok if r["duration"]]
+    tokens = sum(r["tokens"] for r in results)
+    summary = {
+        "streams": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "rejected": sum(1 for r in results if r["status"] == 429),
+        "queued": sum(1 for r in results if r["queued"]),
+        "wall_time_s": round(wall_time, 3),
+        "ttft_ms": _distribution_ms([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "inter_token_ms": _distribution_ms([gap for r in ok for gap in r["gaps"]]),
+        "duration_ms": _distribution_ms([r["duration"] for r in ok]),
+        "tokens_per_s": {
+            "per_stream_p50": round(percentile(rates, 50), 1) if rates else None,
+            "aggregate": round(tokens / wall_time, 1) if wall_time else None
+        }
+    }
+    if process:
+        streams = max(1, len(results))
+        summary["backend"] = {
+            "cpu_s": round(process["cpu_s"], 3),
+            "cpu_ms_per_stream": round(process["cpu_s"] * 1000 / streams, 2),
+            "rss_start_mb": round(process["rss_start"] / 2**20, 1),
+            "rss_peak_mb": round(process["rss_peak"] / 2**20, 1),
+            "rss_kb_per_concurrent_stream": round(
+                (process["rss_peak"] - process["rss_start"]) / 1024 / max(1, process["concurrency"]), 1
+            )
+        }
+    return summary
+
+
+def format_text(summary: dict) -> str:
+    """Render a summary as a plain-text table"""
+    lines = [
+        f"streams   {summary['streams']} ({summary['succeeded']} ok, {summary['failed']} failed, "
+        f"{summary['rejected']} rejected, {summary['queued']} queued)",
+        f"wall time {summary['wall_time_s']} s",
+        "",
+        f"{'ms':<16}" + "".join(f"{key:>10}" for key in ("p50", "p90", "p95", "p99", "max")),
+    ]
+    for label, key in (("ttft", "ttft_ms"), ("inter-token", "inter_token_ms"), ("stream", "duration_ms")):
+        row = summary[key]
+        lines.append(f"{label:<16}" + "".join(
+            f"{'-' if row[col] is None else row[col]:>10}" for col in ("p50", "p90", "p95", "p99", "max")
+        ))
+    rates = summary["tokens_per_s"]
+    lines += ["", f"tokens/s  {rates['per_stream_p50']} per stream (p50), {rates['aggregate']} aggregate"]
+    backend = summary.get("backend")
+    if backend:
+        lines.append(
+            f"backend   {backend['cpu_ms_per_stream']} ms CPU per stream, "
+            f"RSS {backend['rss_start_mb']} -> {backend['rss_peak_mb']} MB "
+            f"({backend['rss_kb_per_concurrent_stream']} KB per concurrent stream)"
+        )
+    return "\n".join(lines)
@@ -15,6 +15,7 @@ export default {
     chat: {
         maxExampleQuestions: 5,
         defaultTitle: '新对话',
+        messagePageSize: 50,
         messageTypes: {
             user: 'user',
             assistant: 'assistant',
@@ -1,10 +1,62 @@
-import { fetchChats, createChat, sendMessage, deleteChat, renameChat } from '../utils/api.js';
+import { fetchChats, createChat, sendMessage, deleteChat, renameChat, cancelGeneration } from '../utils/api.js';
 import { handleApiError, handleNetworkError } from '../utils/error.js';
 import { createSidebarResizer } from '../utils/sidebar.js';
 import { renderMarkdown } from '../utils/markdown.js';
 import config from '../config/index.js';
 import { logout } from '../utils/auth';
 
+const STREAM_RESUME_ATTEMPTS = 3;
+// 角色选择停留多久后才预热，避免快速切换时反复请求
+const ROLE_WARM_DELAY = 500;
+
+let roleWarmTimer = null;
+let lastWarmedRole = null;
+
+/**
+ * 读取服务端事件流（SSE），逐帧回调直到回调返回 true 或流结束
+ * @param {Response} response - fetch 响应
+ * @param {Object} stream - 记录 lastEventId，断线后用于恢复
+ * @param {Function} onFrame - 处理一帧数据
+ */
+async function readEventStream(response, stream, onFrame) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) return;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop() || '';
+
+        for (const event of events) {
+            let id = null;
+            const data = [];
+            for (const line of event.split('\n')) {
+                if (line.startsWith('id:')) id = line.slice(3).trim();
+                else if (line.startsWith('data:')) data.push(line.slice(5).trimStart());
+            }
+            if (!data.length) continue;
+            if (id) stream.lastEventId = id;
+
+            let frame;
+            try {
+                frame = JSON.parse(data.join('\n'));
+            } catch (e) {
+                console.error('Error parsing response:', e);
+                continue;
+            }
+            if (frame.timings) continue;
+            if (onFrame(frame)) {
+                reader.cancel().catch(() => {});
+                return;
+            }
+        }
+    }
+}
+
 export function createChatStore() {
     const safeGetLocalStorage = (key, defaultValue) => {
         if (typeof window === 'undefined' || !window.localStorage) {
@@ -37,6 +89,7 @@ export function createChatStore() {
         chats: [],
         currentChatId: null,
         isThinking: false,
+        queuePosition: null,
         message: '',
         error: null,
         sidebarOpen: true,
@@ -69,6 +122,8 @@ export function createChatStore() {
         })(),
         models: config.models.available,
         showScrollButtons: false,
+        hasOlderMessages: false,
+        loadingOlderMessages: false,
         roles: [],
         selectedRole: null,
 
@@ -97,6 +152,7 @@ export function createChatStore() {
             this.$watch('selectedRole', value => {
                 if (value) {
                     safeSetLocalStorage(config.storage.keys.selectedRoleId, value.id);
+                    this.warmRole(value);
                 } else {
                     safeSetLocalStorage(config.storage.keys.selectedRoleId, '');
                 }
@@ -135,12 +191,14 @@ export function createChatStore() {
 
         async loadChatMessages(chatId) {
             try {
-                const response = await fetch(`${config.api.baseUrl}/api/chats/${chatId}/messages`);
+                // 只加载最新的一页消息，更早的消息在向上滚动时加载
+                const response = await fetch(`${config.api.baseUrl}/api/chats/${chatId}/messages?limit=${config.chat.messagePageSize}`);
                 if (!response.ok) {
                     throw new Error(`HTTP error! status: ${response.status}`);
                 }
                 const messages = await response.json();
                 this.messages = messages;
+                this.hasOlderMessages = messages.length > 0 && messages[0].seq > 0;
                 this.currentChatId = chatId;
             } catch (error) {
                 const { message, timeout } = handleApiError(error, 'loading chat messages');
@@ -152,6 +210,43 @@ export function createChatStore() {
             }
         },
 
+        async loadOlderMessages() {
+            if (!this.hasOlderMessages || this.loadingOlderMessages || !this.currentChatId) {
+                return;
+            }
+            const chatId = this.currentChatId;
+            const oldest = this.messages.find(m => m.seq !== undefined);
+            if (!oldest) {
+                return;
+            }
+            this.loadingOlderMessages = true;
+            try {
+                const response = await fetch(`${config.api.baseUrl}/api/chats/${chatId}/messages?before=${oldest.seq}&limit=${config.chat.messagePageSize}`);
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                const older = await response.json();
+                if (chatId !== this.currentChatId) {
+                    return;
+                }
+                const container = this.$refs.chatContainer;
+                const previousHeight = container ? container.scrollHeight : 0;
+                this.messages = [...older, ...this.messages];
+                this.hasOlderMessages = older.length > 0 && older[0].seq > 0;
+                // 保持当前阅读位置不变
+                this.$nextTick(() => {
+                    if (container) {
+                        container.scrollTop += container.scrollHeight - previousHeight;
+                    }
+                });
+            } catch (error) {
+                const { message } = handleApiError(error, 'loading older messages');
+                console.error(message);
+            } finally {
+                this.loadingOlderMessages = false;
+            }
+        },
+
         async loadModels() {
             try {
                 // 先获取后端配置的已启用模型列表
@@ -202,6 +297,28 @@ export function createChatStore() {
             }
         },
 
+        // 预先让模型处理角色的系统提示词，减少切换角色后首条回复的等待
+        warmRole(role) {
+            if (!role || !this.selectedModel) return;
+            const model = this.selectedModel;
+            clearTimeout(roleWarmTimer);
+            roleWarmTimer = setTimeout(() => {
+                // 连续选择同一模型和角色时只预热一次
+                const key = `${model}\n${role.id}`;
+                if (key === lastWarmedRole) return;
+                lastWarmedRole = key;
+                const url = `${config.api.baseUrl}/api/roles/${encodeURIComponent(role.id)}/warm?model=${encodeURIComponent(model)}`;
+                fetch(url, { method: 'POST' })
+                    .then(response => {
+                        if (!response.ok) lastWarmedRole = null;
+                    })
+                    .catch(error => {
+                        lastWarmedRole = null;
+                        console.warn('预热角色失败:', error);
+                    });
+            }, ROLE_WARM_DELAY);
+        },
+
         async createNewChat() {
             try {
                 if (!this.selectedModel) {
@@ -215,7 +332,8 @@ export function createChatStore() {
                     },
                     body: JSON.stringify({
                         title: config.chat.defaultTitle,
-                        model: this.selectedModel
+                        model: this.selectedModel,
+                        role_id: this.selectedRole ? this.selectedRole.id : null
                     })
                 });
 
@@ -242,6 +360,15 @@ export function createChatStore() {
             }
         },
 
+        async stopGeneration() {
+            if (!this.currentChatId) return;
+            try {
+                await cancelGeneration(this.currentChatId);
+            } catch (error) {
+                console.error('Error stopping generation:', error);
+            }
+        },
+
         async sendMessage(messageText) {
             try {
                 if (!messageText || !messageText.trim()) {
@@ -292,7 +419,7 @@ export function createChatStore() {
                 };
 
                 if (this.selectedRole) {
-                    requestBody.system_prompt = this.selectedRole.system_prompt;
+                    requestBody.role_id = this.selectedRole.id;
                 }
 
                 const response = await fetch(`${config.api.baseUrl}/api/chat/${this.currentChatId}`, {
@@ -308,64 +435,45 @@ export function createChatStore() {
 
             this.message = '';
 
-                const reader = response.body.getReader();
-                const decoder = new TextDecoder();
-                let buffer = '';
-
-                while (true) {
-                    const { value, done } = await reader.read();
-                    
-                    if (done) break;
-
-                    const chunk = decoder.decode(value, { stream: true });
-                    buffer += chunk;
-                    
-                    const lines = buffer.split('\n');
-                    buffer = lines.pop() || '';
-                    
-                    for (const line of lines) {
-                        if (!line.trim()) continue;
-                        
-                        try {
-                            const data = JSON.parse(line);
-                            
-                            if (data.error) {
-                                console.error('Error from server:', data.error);
-                                this.messages[lastMessageIndex].content = `Error: ${data.error}`;
-                                this.isThinking = false;
-                                break;
-                            }
-
-                            if (data.done) {
-                                this.isThinking = false;
-                                break;
-                            }
-                            
-                            if (data.response) {
-                                this.messages[lastMessageIndex].content += data.response;
-                                this.messages = [...this.messages];
-                            }
-                        } catch (e) {
-                            console.error('Error parsing response:', e);
-                            this.messages[lastMessageIndex].content = `Error: Failed to parse server response`;
-                            this.isThinking = false;
-                        }
+                const handleFrame = (data) => {
+                    if (data.error) {
+                        console.error('Error from server:', data.error);
+                        this.messages[lastMessageIndex].content = `Error: ${data.error}`;
+                        return true;
                     }
-                }
+                    if (data.done) {
+                        return true;
+                    }
+                    if (data.queue_position !== undefined) {
+                        this.queuePosition = data.queue_position;
+                    } else if (data.response) {
+                        this.queuePosition = null;
+                        this.messages[lastMessageIndex].content += data.response;
+                        this.messages = [...this.messages];
+                    }
+                    return false;
+                };
 
-                if (buffer.trim()) {
+                // 连接中断时带上最后收到的事件 ID 重新连接，服务端从断点继续发送
+                const stream = { lastEventId: null };
+                let current = response;
+                for (let attempt = 0; ; attempt++) {
                     try {
-                        const data = JSON.parse(buffer);
-                        if (data.response) {
-                            this.messages[lastMessageIndex].content += data.response;
-                            this.messages = [...this.messages];
-                        }
+                        await readEventStream(current, stream, handleFrame);
+                        break;
                     } catch (e) {
-                        console.error('Error parsing final buffer:', e);
+                        if (!stream.lastEventId || attempt >= STREAM_RESUME_ATTEMPTS) throw e;
+                        console.warn('Stream interrupted, resuming:', e);
+                        await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+                        current = await fetch(`${config.api.baseUrl}/api/chat/${this.currentChatId}/stream`, {
+                            headers: { 'Last-Event-ID': stream.lastEventId }
+                        });
+                        if (!current.ok) throw e;
                     }
                 }
 
                 this.isThinking = false;
+                this.queuePosition = null;
 
                 this.$nextTick(() => {
                     const chatContainer = this.$refs.chatContainer;
@@ -376,6 +484,7 @@ export function createChatStore() {
 
             } catch (error) {
                 console.error('Error in sendMessage:', error);
+                this.queuePosition = null;
                 this.messages = this.messages.slice(0, -1);
                 this.messages = [...this.messages, {
                     role: 'system',
@@ -455,6 +564,10 @@ export function createChatStore() {
                 const clientHeight = container.clientHeight;
                 
                 this.showScrollButtons = scrollHeight > clientHeight + 100;
+
+                if (scrollTop < 200) {
+                    this.loadOlderMessages();
+                }
             }
         },
 
@@ -121,6 +121,22 @@ export async function deleteChat(chatId) {
     }
 }
 
+/**
+ * 停止聊天正在生成的回复，已生成的部分会保存
+ * @param {string} chatId - 聊天 ID
+ * @returns {Promise<Object>} 取消结果
+ */
+export async function cancelGeneration(chatId) {
+    try {
+        const response = await apiRequest(`/chat/${chatId}/generation`, {
+            method: 'DELETE'
+        });
+        return await response.json();
+    } catch (error) {
+        throw handleApiError(error, 'cancelling generation');
+    }
+}
+
 /**
  * 重命名聊天
  * @param {string} chatId - 聊天 ID
@@ -142,11 +158,19 @@ export async function renameChat(chatId, newTitle) {
 /**
  * 获取聊天消息历史
  * @param {string} chatId - 聊天 ID
+ * @param {Object} page - 分页参数 { before, after, limit }，均为可选
  * @returns {Promise<Array>} 消息列表
  */
-export async function fetchChatMessages(chatId) {
+export async function fetchChatMessages(chatId, page = {}) {
     try {
-        const response = await apiRequest(`/chats/${chatId}/messages`);
+        const params = new URLSearchParams();
+        for (const [key, value] of Object.entries(page)) {
+            if (value !== undefined && value !== null) {
+                params.set(key, value);
+            }
+        }
+        const query = params.toString() ? `?${params}` : '';
+        const response = await apiRequest(`/chats/${chatId}/messages${query}`);
         return await response.json();
     } catch (error) {
         throw handleApiError(error, 'fetching chat messages');
@@ -0,0 +1,47 @@
+"""Point the backend at a throwaway storage directory before it is imported"""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_root = tempfile.mkdtemp(prefix="webui-lite-tests-")
+_config_file = os.path.join(_root, "config.yaml")
+with open(_config_file, "w", encoding="utf-8") as f:
+    f.write(
+        "ollama:\n"
+        "  host: http://127.0.0.1:9\n"
+        "storage:\n"
+        f"  chat_dir: {os.path.join(_root, 'chats')}\n"
+        f"  database: {os.path.join(_root, 'database.db')}\n"
+    )
+os.makedirs(os.path.join(_root, "chats"))
+os.environ["WEBUI_CONFIG_FILE"] = _config_file
+
+from backend.config import config_manager  # noqa: E402
+from backend.database.connection import db  # noqa: E402
+from backend.database.init import init_db  # noqa: E402
+
+init_db()
+
+
+@pytest.fixture
+def configure():
+    """Publish a config with some sections overridden, restoring it afterwards"""
+    original = config_manager.config
+
+    def apply(**sections):
+        config = config_manager.config
+        updates = {
+            name: getattr(config, name).model_copy(update=values)
+            for name, values in sections.items()
+        }
+        config_manager._publish(config.model_copy(update=updates))
+
+    yield apply
+    config_manager._publish(original)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    db.close()
+    shutil.rmtree(_root, ignore_errors=True)
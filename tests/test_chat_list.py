@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from backend.core import chat as chat_service
+from backend.database.connection import db
+
+
+def _insert_chats(rows):
+    def insert(conn):
+        conn.execute("DELETE FROM chats")
+        conn.executemany(
+            "INSERT INTO chats (id, title, model, updated_at) VALUES (?, ?, 'm', ?)",
+            [(chat_id, chat_id, updated_at) for chat_id, updated_at in rows]
+        )
+
+    asyncio.run(db.run(insert))
+
+
+def _page(limit, cursor=None):
+    response = asyncio.run(chat_service.get_chats(limit=limit, cursor=cursor))
+    return [chat["id"] for chat in json.loads(response.body)], response.headers.get("x-next-cursor")
+
+
+def test_pages_cover_every_chat_once_in_activity_order():
+    # Two chats share a timestamp so the id breaks the tie
+    _insert_chats([
+        ("a", "2024-01-01 10:00:00.000"),
+        ("b", "2024-01-03 10:00:00.000"),
+        ("c", "2024-01-02 10:00:00.000"),
+        ("d", "2024-01-02 10:00:00.000"),
+        ("e", "2024-01-04 10:00:00.000"),
+    ])
+
+    pages = []
+    ids, cursor = _page(2)
+    pages.append(ids)
+    while cursor:
+        ids, cursor = _page(2, cursor)
+        pages.append(ids)
+
+    assert pages == [["e", "b"], ["d", "c"], ["a"]]
+
+
+def test_cursor_is_stable_when_a_chat_moves_to_the_front():
+    _insert_chats([(chat_id, f"2024-01-0{day} 10:00:00.000") for day, chat_id in enumerate("abcd", 1)])
+    first, cursor = _page(2)
+    assert first == ["d", "c"]
+
+    # Activity on an already listed chat must not shift the next page
+    asyncio.run(db.execute("UPDATE chats SET updated_at = '2024-02-01 10:00:00.000' WHERE id = 'c'"))
+    assert _page(2, cursor)[0] == ["b", "a"]
+
+
+def test_full_last_page_is_followed_by_an_empty_one():
+    _insert_chats([("a", "2024-01-01 10:00:00.000"), ("b", "2024-01-02 10:00:00.000")])
+    ids, cursor = _page(2)
+    assert ids == ["b", "a"]
+    assert _page(2, cursor) == ([], None)
@@ -0,0 +1,111 @@
+import asyncio
+
+from backend.core import chat as chat_service
+from backend.core import context, persistence, scheduler
+from backend.database.db_models import Chat, Message
+
+# 40 characters: 10 tokens plus the per-message overhead
+TURN = "x" * 40
+TURN_TOKENS = 10 + context.MESSAGE_OVERHEAD
+
+
+def _run(test):
+    async def main():
+        try:
+            return await test()
+        finally:
+            await persistence.stop()
+
+    return asyncio.run(main())
+
+
+async def _chat_with_turns(count: int) -> str:
+    chat_id = (await chat_service.create_chat(Chat(title="test", model="m")))["chat"]["id"]
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        await chat_service.save_message(chat_id, Message(role=role, content=f"{i:02d}{TURN[2:]}", model="m"))
+    return chat_id
+
+
+def _fake_complete(monkeypatch, calls):
+    async def complete(model, messages, options=None):
+        calls.append((model, messages))
+        return "SUMMARY"
+
+    monkeypatch.setattr(context.ollama_service, "complete", complete)
+
+
+def test_estimate_counts_cjk_characters_one_token_each():
+    assert context.estimate_tokens("abcdefgh") == 2
+    assert context.estimate_tokens("你好世界") == 4
+    assert context.estimate_tokens("") == 0
+
+
+def test_assemble_keeps_the_newest_turns_within_budget(configure):
+    # The system prompt costs 1 + 4 tokens, leaving room for three turns
+    configure(context={"max_prompt_tokens": 5 + 3 * TURN_TOKENS + 5, "compaction_enabled": False})
+
+    async def test():
+        chat_id = await _chat_with_turns(6)
+        messages = await context.assemble(chat_id, "m", "sys")
+        assert messages[0] == {"role": "system", "content": "sys"}
+        assert [m["content"][:2] for m in messages[1:]] == ["03", "04", "05"]
+
+    _run(test)
+
+
+def test_newest_turn_is_kept_even_over_budget(configure):
+    configure(context={"max_prompt_tokens": 1, "compaction_enabled": False})
+
+    async def test():
+        chat_id = await _chat_with_turns(3)
+        assert [m["content"][:2] for m in await context.assemble(chat_id, "m")] == ["02"]
+
+    _run(test)
+
+
+def test_compaction_replaces_older_turns_with_a_summary(configure, monkeypatch):
+    # Half the budget holds one turn verbatim, so five of six get summarized
+    configure(context={"max_prompt_tokens": 3 * TURN_TOKENS, "recent_ratio": 0.5, "summary_model": ""})
+    calls = []
+    _fake_complete(monkeypatch, calls)
+
+    async def test():
+        chat_id = await _chat_with_turns(6)
+        await context.assemble(chat_id, "m")
+        await context.schedule_compaction(chat_id, "m")
+
+        assert len(calls) == 1 and calls[0][0] == "m"
+        assert (await context.load_summary(chat_id))["upto"] == 5
+        messages = await context.assemble(chat_id, "m")
+        assert messages[0]["content"].endswith("SUMMARY")
+        assert [m["content"][:2] for m in messages[1:]] == ["05"]
+
+        # Nothing new to fold in, so no second call
+        await context.compact(chat_id, "m")
+        assert len(calls) == 1
+
+    _run(test)
+
+
+def test_compaction_waits_until_the_model_is_free(configure, monkeypatch):
+    configure(
+        context={"max_prompt_tokens": 3 * TURN_TOKENS, "recent_ratio": 0.5, "summary_model": "summarizer"},
+        scheduler={"concurrency": 1}
+    )
+    calls = []
+    _fake_complete(monkeypatch, calls)
+
+    async def test():
+        chat_id = await _chat_with_turns(6)
+        user_request = scheduler.admit("summarizer", "alice")
+        compaction = context.schedule_compaction(chat_id, "m")
+        await asyncio.sleep(0.05)
+        assert calls == [] and not compaction.done()
+
+        user_request.release()
+        await compaction
+        assert [model for model, _ in calls] == ["summarizer"]
+        assert scheduler.status()["summarizer"]["active"] == 0
+
+    _run(test)
@@ -0,0 +1,205 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from backend.api.chat import _resume
+from backend.core import generations
+from backend.utils.stream import stream_response
+
+
+def _frames(gate: asyncio.Queue):
+    """Frames released one at a time through ``gate``; None ends the stream"""
+    async def frames():
+        while True:
+            frame = await gate.get()
+            if frame is None:
+                return
+            yield frame + "\n"
+
+    return frames()
+
+
+def test_event_ids_split_into_generation_and_seq():
+    assert generations.parse_event_id("3f2a9c-12") == ("3f2a9c", 12)
+    assert generations.parse_event_id(" 3f2a9c-0\n") == ("3f2a9c", 0)
+    assert generations.parse_event_id("3f2a9c") is None
+    assert generations.parse_event_id("3f2a9c-x") is None
+
+
+def test_resume_replays_frames_after_the_last_event_id():
+    async def test():
+        gate = asyncio.Queue()
+        generation = generations.start("resume", "m", _frames(gate))
+        for i in range(3):
+            gate.put_nowait(f"frame {i}")
+
+        # The first client reads two frames and drops off
+        events = generation.events()
+        seen = [await events.__anext__() for _ in range(2)]
+        await events.aclose()
+        last_event_id = seen[-1][0]
+
+        # More arrives while nobody is following
+        gate.put_nowait("frame 3")
+        gate.put_nowait(None)
+
+        generation_id, seq = generations.parse_event_id(last_event_id)
+        assert generations.get("resume").id == generation_id
+        resumed = [event async for event in generation.events(seq)]
+        assert [data for _, data in resumed] == ["frame 2", "frame 3"]
+        assert [event_id for event_id, _ in resumed] == [generation.event_id(2), generation.event_id(3)]
+
+    asyncio.run(test())
+
+
+def test_resume_past_the_replay_buffer_is_refused(configure):
+    configure(stream={"replay_frames": 4})
+
+    async def test():
+        gate = asyncio.Queue()
+        generation = generations.start("trimmed", "m", _frames(gate))
+        for i in range(10):
+            gate.put_nowait(f"frame {i}")
+        gate.put_nowait(None)
+        await generation.task
+
+        # Recent frames can still be resumed, the start of the stream cannot
+        assert [data for _, data in [e async for e in generation.events(8)]] == ["frame 9"]
+        events = [e async for e in generation.events(0)]
+        assert events == [(None, json.dumps({"error": "stream can no longer be resumed", "resumable": False}))]
+
+    asyncio.run(test())
+
+
+def test_resume_endpoint_rejects_unknown_event_ids():
+    async def test():
+        gate = asyncio.Queue()
+        generations.start("endpoint", "m", _frames(gate))
+        with pytest.raises(HTTPException) as invalid:
+            _resume("endpoint", "not-an-id")
+        assert invalid.value.status_code == 400
+        with pytest.raises(HTTPException) as other:
+            _resume("endpoint", "0123456789ab-3")
+        assert other.value.status_code == 404
+        gate.put_nowait(None)
+
+    asyncio.run(test())
+
+
+class _SlowReply:
+    """An upstream reply that streams one token every 10 ms until closed"""
+
+    def __init__(self):
+        self.is_closed = False
+
+    async def aiter_lines(self):
+        while True:
+            await asyncio.sleep(0.01)
+            yield json.dumps({"message": {"content": "tok "}, "done": False})
+
+    async def aclose(self):
+        self.is_closed = True
+
+
+def _reply_generation(chat_id: str, saved: list, finished: list):
+    reply = _SlowReply()
+
+    async def save(content, truncated):
+        saved.append((content, truncated))
+
+    async def on_finish():
+        finished.append(True)
+
+    frames = stream_response(reply, on_complete=save)
+    return reply, generations.start(chat_id, "m", frames, on_finish=on_finish)
+
+
+def test_cancel_saves_the_partial_reply_and_releases(configure):
+    configure(stream={"coalesce": False})
+
+    async def test():
+        saved, finished = [], []
+        reply, generation = _reply_generation("cancel", saved, finished)
+        await asyncio.sleep(0.05)
+
+        await generation.cancel()
+        assert reply.is_closed
+        assert len(saved) == 1 and saved[0][1] is True and saved[0][0].startswith("tok ")
+        frames = [json.loads(data) for _, data in [e async for e in generation.events()]]
+        assert frames[-1] == {"done": True, "truncated": True}
+        await asyncio.sleep(0)
+        assert finished == [True]
+
+    asyncio.run(test())
+
+
+def test_cancel_before_the_first_step_still_finishes():
+    async def test():
+        finished = []
+
+        async def on_finish():
+            finished.append(True)
+
+        gate = asyncio.Queue()
+        generation = generations.start("early", "m", _frames(gate), on_finish=on_finish)
+        await generation.cancel()
+        assert generation.finished
+        assert [data for _, data in [e async for e in generation.events()]] == [
+            json.dumps({"done": True, "truncated": True})
+        ]
+        await asyncio.sleep(0)
+        assert finished == [True]
+
+    asyncio.run(test())
+
+
+def test_abandoned_generation_is_cancelled_after_the_grace_period(configure):
+    configure(stream={"coalesce": False, "disconnect_grace": 0.2})
+
+    async def test():
+        saved, finished = [], []
+        _, generation = _reply_generation("abandon", saved, finished)
+        events = generation.events()
+        await events.__anext__()
+        await events.aclose()
+
+        # Reconnecting within the grace period keeps it running
+        await asyncio.sleep(0.05)
+        events = generation.events()
+        await events.__anext__()
+        await asyncio.sleep(0.25)
+        assert not generation.finished
+        await events.aclose()
+
+        await asyncio.sleep(0.4)
+        assert generation.finished
+        assert len(saved) == 1 and saved[0][1] is True
+
+    asyncio.run(test())
+
+
+def test_cancel_during_the_save_still_keeps_the_reply(configure):
+    configure(stream={"coalesce": False})
+
+    async def test():
+        saved = []
+        saving = asyncio.Event()
+
+        async def slow_save(content, truncated):
+            saving.set()
+            await asyncio.sleep(0.05)
+            saved.append((content, truncated))
+
+        frames = stream_response(_SlowReply(), on_complete=slow_save)
+        generation = generations.start("double-cancel", "m", frames)
+        await asyncio.sleep(0.03)
+        generation.task.cancel()
+        await saving.wait()
+
+        # A second cancel lands while the partial reply is being saved
+        await generation.cancel()
+        assert len(saved) == 1 and saved[0][1] is True
+
+    asyncio.run(test())
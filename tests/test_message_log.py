@@ -0,0 +1,86 @@
+import json
+import os
+
+from backend.core import message_log
+
+
+def _messages(n, start=0):
+    return [{"role": "user", "content": f"message {i}"} for i in range(start, start + n)]
+
+
+def _new_chat(tmp_path, messages=()):
+    chat_dir = str(tmp_path / "chat")
+    os.makedirs(chat_dir)
+    message_log.create(chat_dir)
+    if messages:
+        message_log.append_many(chat_dir, list(messages))
+    return chat_dir
+
+
+def test_append_and_read_by_seq(tmp_path):
+    chat_dir = _new_chat(tmp_path)
+    assert message_log.append_many(chat_dir, _messages(3)) == 0
+    assert message_log.append(chat_dir, {"role": "assistant", "content": "reply"}) == 3
+
+    assert message_log.count(chat_dir) == 4
+    assert [m["content"] for m in message_log.iter_messages(chat_dir, 1, 3)] == ["message 1", "message 2"]
+
+
+def test_torn_tail_is_truncated_before_the_next_append(tmp_path):
+    chat_dir = _new_chat(tmp_path, _messages(2))
+    # A crash halfway through writing a line
+    with open(os.path.join(chat_dir, message_log.LOG_FILE), "ab") as log:
+        log.write(b'{"role":"user","cont')
+
+    assert message_log.append(chat_dir, {"role": "user", "content": "after crash"}) == 2
+    assert [m["content"] for m in message_log.iter_messages(chat_dir)] == ["message 0", "message 1", "after crash"]
+
+
+def test_unindexed_complete_line_is_indexed(tmp_path):
+    chat_dir = _new_chat(tmp_path, _messages(2))
+    # A crash between writing the line and its offset
+    with open(os.path.join(chat_dir, message_log.LOG_FILE), "ab") as log:
+        log.write(message_log.encode_message({"role": "user", "content": "unindexed"}))
+
+    assert message_log.append(chat_dir, {"role": "user", "content": "next"}) == 3
+    assert message_log.count(chat_dir) == 4
+    assert [m["content"] for m in message_log.iter_messages(chat_dir, 2)] == ["unindexed", "next"]
+
+
+def test_legacy_chat_is_migrated_on_first_read(tmp_path):
+    chat_dir = str(tmp_path / "legacy")
+    os.makedirs(chat_dir)
+    with open(os.path.join(chat_dir, message_log.LEGACY_FILE), "w", encoding="utf-8") as f:
+        json.dump(_messages(3), f, indent=2)
+
+    assert message_log.count(chat_dir) == 3
+    assert not os.path.exists(os.path.join(chat_dir, message_log.LEGACY_FILE))
+    assert [m["content"] for m in message_log.iter_messages(chat_dir)] == ["message 0", "message 1", "message 2"]
+
+
+def test_compress_and_promote_round_trip(tmp_path):
+    chat_dir = _new_chat(tmp_path, _messages(50))
+    log_file = os.path.join(chat_dir, message_log.LOG_FILE)
+    cold_file = os.path.join(chat_dir, message_log.COLD_FILE)
+
+    saved = message_log.compress(chat_dir, level=6)
+    assert saved is not None and saved > 0
+    assert os.path.exists(cold_file) and not os.path.exists(log_file)
+
+    # Cold chats are counted and read without being decompressed to disk
+    assert message_log.count(chat_dir) == 50
+    assert [m["content"] for m in message_log.iter_messages(chat_dir, 48)] == ["message 48", "message 49"]
+    assert not os.path.exists(log_file)
+
+    # The next append restores the plain log
+    assert message_log.append(chat_dir, {"role": "user", "content": "back"}) == 50
+    assert os.path.exists(log_file) and not os.path.exists(cold_file)
+    assert [m["content"] for m in message_log.iter_messages(chat_dir)] == [
+        m["content"] for m in _messages(50)
+    ] + ["back"]
+
+
+def test_compress_skips_chats_without_a_plain_log(tmp_path):
+    chat_dir = _new_chat(tmp_path, _messages(2))
+    assert message_log.compress(chat_dir) is not None
+    assert message_log.compress(chat_dir) is None
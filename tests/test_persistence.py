@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from backend.core import chat as chat_service
+from backend.core import message_store, persistence
+from backend.database import search
+from backend.database.connection import db
+from backend.database.db_models import Chat
+
+
+@pytest.fixture(params=["files", "sqlite"], autouse=True)
+def backend(request, configure):
+    configure(storage={"messages_backend": request.param})
+    return request.param
+
+
+def _run(test):
+    """Run a test coroutine, then drain and stop the writer on the same loop"""
+    async def main():
+        try:
+            return await test()
+        finally:
+            await persistence.stop()
+
+    return asyncio.run(main())
+
+
+async def _new_chat() -> str:
+    return (await chat_service.create_chat(Chat(title="test", model="m")))["chat"]["id"]
+
+
+def _message(i: int) -> dict:
+    return {"role": "user", "content": f"message {i}"}
+
+
+def _stored(chat_id: str):
+    return [m["content"] for m in message_store.iter_messages(chat_id)]
+
+
+def test_flushed_ack_returns_seqs_in_submission_order(configure):
+    configure(persistence={"ack": "flushed"})
+
+    async def test():
+        chat_id = await _new_chat()
+        seqs = await asyncio.gather(*(persistence.submit(chat_id, _message(i)) for i in range(20)))
+        assert seqs == list(range(20))
+        # Acknowledged means written, metadata included
+        assert _stored(chat_id) == [f"message {i}" for i in range(20)]
+        row = await db.fetchone("SELECT message_count FROM chats WHERE id = ?", (chat_id,))
+        assert row[0] == 20
+
+    _run(test)
+
+
+def test_queued_ack_returns_before_the_write(configure):
+    configure(persistence={"ack": "queued", "flush_interval_ms": 50})
+
+    async def test():
+        chat_id = await _new_chat()
+        assert await persistence.submit(chat_id, _message(0)) is None
+        assert await persistence.submit(chat_id, _message(1)) is None
+        assert chat_id in persistence.pending_chats()
+
+        # History reads see queued messages whether or not they were written yet
+        assert [m["content"] for m in await persistence.load(chat_id)] == ["message 0", "message 1"]
+
+        await persistence.flushed(chat_id)
+        assert chat_id not in persistence.pending_chats()
+        assert _stored(chat_id) == ["message 0", "message 1"]
+
+    _run(test)
+
+
+def test_load_during_flushes_never_duplicates_or_drops(configure):
+    configure(persistence={"ack": "queued", "flush_interval_ms": 1, "max_batch": 8})
+
+    async def test():
+        chat_id = await _new_chat()
+
+        async def write():
+            for i in range(200):
+                await persistence.submit(chat_id, _message(i))
+                if i % 5 == 0:
+                    await asyncio.sleep(0)
+
+        async def read():
+            for _ in range(100):
+                contents = [m["content"] for m in await persistence.load(chat_id)]
+                assert contents == [f"message {i}" for i in range(len(contents))]
+                await asyncio.sleep(0)
+
+        await asyncio.gather(write(), read(), read())
+        await persistence.flushed(chat_id)
+        assert len(await persistence.load(chat_id)) == 200
+
+    _run(test)
+
+
+def test_stop_drains_the_queue(configure):
+    configure(persistence={"ack": "queued", "flush_interval_ms": 1000})
+
+    async def test():
+        chat_id = await _new_chat()
+        for i in range(5):
+            await persistence.submit(chat_id, _message(i))
+        await persistence.stop()
+        assert persistence.pending_chats() == set()
+        assert _stored(chat_id) == [f"message {i}" for i in range(5)]
+
+    _run(test)
+
+
+def test_chat_deleted_before_its_metadata_update_gets_no_index_rows(configure, backend):
+    configure(persistence={"ack": "flushed"})
+
+    async def test():
+        chat_id = await _new_chat()
+        # Only the row is gone, as when a delete lands between log write and record
+        await db.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+        if backend == "files":
+            assert await persistence.submit(chat_id, _message(0)) == 0
+        else:
+            with pytest.raises(FileNotFoundError):
+                await persistence.submit(chat_id, _message(0))
+        row = await db.fetchone("SELECT COUNT(*) FROM search_docs WHERE chat_id = ?", (chat_id,))
+        assert row[0] == 0
+
+    _run(test)
+
+
+def test_metadata_failure_does_not_fail_written_messages(configure, backend, monkeypatch):
+    if backend != "files":
+        pytest.skip("sqlite inserts messages and metadata in one transaction")
+    configure(persistence={"ack": "flushed"})
+
+    def broken_index(conn, chat_id, seq, message):
+        raise RuntimeError("index unavailable")
+
+    async def test():
+        chat_id = await _new_chat()
+        monkeypatch.setattr(search, "index_message", broken_index)
+        assert await persistence.submit(chat_id, _message(0)) == 0
+        assert _stored(chat_id) == ["message 0"]
+
+    _run(test)
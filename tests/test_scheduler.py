@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from backend.api.chat import _admit
+from backend.core import scheduler
+
+
+def test_waiting_users_take_turns(configure):
+    configure(scheduler={"concurrency": 1, "max_queue": 8})
+    model = "fairness"
+    first = scheduler.admit(model, "alice")
+    assert first.granted
+
+    # Alice queues two more before Bob and Carol ask once each
+    waiting = {
+        name: scheduler.admit(model, user)
+        for name, user in [("alice 2", "alice"), ("alice 3", "alice"), ("bob", "bob"), ("carol", "carol")]
+    }
+    assert not any(ticket.granted for ticket in waiting.values())
+    assert {name: ticket.position() for name, ticket in waiting.items()} == {
+        "alice 2": 0, "bob": 1, "carol": 2, "alice 3": 3
+    }
+
+    # Each release hands the single slot to the next ticket in turn
+    order = []
+    current = first
+    for _ in waiting:
+        current.release()
+        name, current = next((n, t) for n, t in waiting.items() if t.granted and n not in order)
+        order.append(name)
+    assert order == ["alice 2", "bob", "carol", "alice 3"]
+
+    current.release()
+    assert scheduler.status()[model] == {"active": 0, "queued": 0, "limit": 1}
+
+
+def test_released_waiting_ticket_leaves_the_queue(configure):
+    configure(scheduler={"concurrency": 1, "max_queue": 8})
+    model = "abandon"
+    active = scheduler.admit(model, "alice")
+    gone = scheduler.admit(model, "bob")
+    next_up = scheduler.admit(model, "carol")
+    assert next_up.position() == 1
+
+    gone.release()
+    assert next_up.position() == 0
+    active.release()
+    assert next_up.granted and not gone.granted
+    next_up.release()
+
+
+def test_full_queue_is_rejected_with_retry_after(configure):
+    configure(scheduler={"concurrency": 1, "max_queue": 2, "default_retry_after": 10.0})
+    model = "full"
+    tickets = [scheduler.admit(model, f"user {i}") for i in range(3)]
+
+    with pytest.raises(scheduler.QueueFull) as rejected:
+        scheduler.admit(model, "late")
+    # Two queued ahead plus the new request, one slot, ten seconds each
+    assert rejected.value.retry_after == 30
+
+    request = Request({"type": "http", "headers": [], "client": ("127.0.0.1", 5000)})
+    with pytest.raises(HTTPException) as error:
+        _admit(model, request)
+    assert error.value.status_code == 429
+    assert error.value.headers == {"Retry-After": "30"}
+
+    for ticket in tickets:
+        ticket.release()
+    assert scheduler.status()[model]["queued"] == 0
+
+
+def test_waiting_tickets_report_only_position_changes(configure):
+    configure(scheduler={"concurrency": 1, "max_queue": 8})
+    model = "positions"
+
+    async def scenario():
+        active = scheduler.admit(model, "alice")
+        waiting = scheduler.admit(model, "bob")
+        updates = waiting.wait()
+        assert await updates.__anext__() == 0
+
+        # Requests queueing behind it leave its position unchanged
+        behind = [scheduler.admit(model, user) for user in ("carol", "dave")]
+        assert not waiting._changed.is_set()
+
+        behind[0].release()
+        assert not waiting._changed.is_set()
+
+        active.release()
+        assert waiting.granted
+        with pytest.raises(StopAsyncIteration):
+            await updates.__anext__()
+        waiting.release()
+        behind[1].release()
+
+    asyncio.run(scenario())
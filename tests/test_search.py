@@ -0,0 +1,71 @@
+import os
+import sqlite3
+
+import pytest
+
+from backend.core import message_log
+from backend.database import search
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE chats (id TEXT PRIMARY KEY, title TEXT)")
+    search.create_index(conn)
+    yield conn
+    conn.close()
+
+
+def _add_chat(conn, chat_id, messages):
+    conn.execute("INSERT INTO chats (id, title) VALUES (?, ?)", (chat_id, f"chat {chat_id}"))
+    for seq, message in enumerate(messages):
+        search.index_message(conn, chat_id, seq, message)
+
+
+def test_query_terms_are_quoted_phrases():
+    # Operators and quotes in the input are plain text, a trailing * stays a prefix
+    assert search.build_query('deploy* AND "prod') == '"deploy"* "AND" """prod"'
+    assert search.build_query("   ") == ""
+
+
+def test_cjk_terms_match_single_characters(conn):
+    _add_chat(conn, "a", [{"role": "user", "content": "如何配置数据库连接", "model": "m"}])
+    _add_chat(conn, "b", [{"role": "user", "content": "数据结构", "model": "m"}])
+
+    assert [hit["chat_id"] for hit in search.search(conn, "数据库")] == ["a"]
+    assert sorted(hit["chat_id"] for hit in search.search(conn, "数据")) == ["a", "b"]
+    # Separators never leak into the snippet
+    assert search.search(conn, "配置")[0]["snippet"] == "如何<mark>配置</mark>数据库连接"
+
+
+def test_filters_prefixes_and_operator_input(conn):
+    _add_chat(conn, "a", [
+        {"role": "user", "content": "deploy the service", "model": "small"},
+        {"role": "assistant", "content": "deployment finished", "model": "small"}
+    ])
+    _add_chat(conn, "b", [{"role": "user", "content": "deploy NEAR the edge", "model": "large"}])
+
+    assert len(search.search(conn, "deploy*")) == 3
+    assert sorted(hit["seq"] for hit in search.search(conn, "deploy*", chat_id="a")) == [0, 1]
+    assert [hit["chat_id"] for hit in search.search(conn, "deploy", model="large")] == ["b"]
+    assert [hit["chat_id"] for hit in search.search(conn, "NEAR")] == ["b"]
+
+    search.delete_chat(conn, "a")
+    assert [hit["chat_id"] for hit in search.search(conn, "deploy*")] == ["b"]
+
+
+def test_reindex_rebuilds_from_chat_logs(conn, configure, tmp_path):
+    configure(storage={"messages_backend": "files"})
+    for chat_id, contents in [("a", ["alpha one", "alpha two"]), ("b", ["beta"])]:
+        conn.execute("INSERT INTO chats (id, title) VALUES (?, ?)", (chat_id, chat_id))
+        chat_dir = tmp_path / chat_id
+        os.makedirs(chat_dir)
+        message_log.create(str(chat_dir))
+        message_log.append_many(str(chat_dir), [{"role": "user", "content": c} for c in contents])
+    # A stale row for a message that no longer exists
+    search.index_message(conn, "gone", 0, {"role": "user", "content": "alpha ghost"})
+    conn.commit()
+
+    assert search.reindex(conn, str(tmp_path)) == 3
+    assert sorted((hit["chat_id"], hit["seq"]) for hit in search.search(conn, "alpha")) == [("a", 0), ("a", 1)]
+    assert search.search(conn, "ghost") == []
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+from backend.utils.stream import stream_response
+
+
+class FakeResponse:
+    """Ollama /api/chat NDJSON lines, optionally spaced out in time"""
+
+    def __init__(self, tokens, delay=0.0, done=True):
+        self.tokens = tokens
+        self.delay = delay
+        self.done = done
+        self.reads = 0
+        self.is_closed = False
+
+    async def aiter_lines(self):
+        self.reads += 1
+        for token in self.tokens:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield json.dumps({"message": {"role": "assistant", "content": token}, "done": False})
+        if self.done:
+            yield json.dumps({"message": {"role": "assistant", "content": ""}, "done": True})
+
+    async def aclose(self):
+        self.is_closed = True
+
+
+def _collect(response, **kwargs):
+    async def main():
+        return [json.loads(chunk) async for chunk in stream_response(response, **kwargs)]
+
+    return asyncio.run(main())
+
+
+def _text(frames):
+    return "".join(frame.get("response", "") for frame in frames)
+
+
+def test_reply_is_read_once_and_saved_as_sent(configure):
+    configure(stream={"coalesce": False})
+    response = FakeResponse(["Hel", "lo", " wor", "ld"])
+    saved = []
+
+    async def on_complete(content, truncated):
+        saved.append((content, truncated))
+
+    frames = _collect(response, on_complete=on_complete)
+    assert response.reads == 1 and response.is_closed
+    assert _text(frames) == "Hello world"
+    assert saved == [("Hello world", False)]
+    assert frames[-1] == {"done": True}
+
+
+def test_error_frame_keeps_the_text_before_it(configure):
+    configure(stream={"coalesce": False})
+
+    class FailingResponse(FakeResponse):
+        async def aiter_lines(self):
+            yield json.dumps({"message": {"content": "partial"}, "done": False})
+            yield json.dumps({"error": "model crashed"})
+
+    saved = []
+
+    async def on_complete(content, truncated):
+        saved.append(content)
+
+    frames = _collect(FailingResponse([]), on_complete=on_complete)
+    assert {"error": "model crashed"} in frames
+    assert saved == ["partial"]
+
+
+def test_tokens_are_coalesced_after_the_first(configure):
+    configure(stream={"coalesce": True, "flush_interval_ms": 1000, "flush_bytes": 8})
+    tokens = ["a", "bb", "cc", "dd", "ee", "f"]
+    frames = [frame["response"] for frame in _collect(FakeResponse(tokens)) if "response" in frame]
+    # The first token goes out alone, then frames fill up to flush_bytes
+    assert frames == ["a", "bbccddee", "f"]
+
+
+def test_coalesced_tokens_flush_when_the_interval_passes(configure):
+    configure(stream={"coalesce": True, "flush_interval_ms": 25, "flush_bytes": 4096})
+    tokens = ["x"] * 20
+    frames = [frame["response"] for frame in _collect(FakeResponse(tokens, delay=0.01)) if "response" in frame]
+    assert "".join(frames) == "x" * 20
+    # Slow tokens still leave within the interval rather than all at the end,
+    # but several share a frame
+    assert 2 < len(frames) < 20